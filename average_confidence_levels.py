@@ -1,7 +1,7 @@
 import numpy as np
 import os
-import matplotlib.pyplot as plt
 from optparse import OptionParser
+from posterior_io import load_text_samples, load_samples
 
 if __name__=="__main__":
     parser=OptionParser()
@@ -31,7 +31,11 @@ if __name__=="__main__":
     all_files = os.listdir(work_folder)
     catalogs = [a for a in all_files if 'cat' in a]
     for c in catalogs:
-        posteriors = np.genfromtxt(os.path.join(work_folder,c+"/posterior.dat"),names=True)
+        # posterior.dat is only written by runs with --plot 1
+        if os.path.exists(os.path.join(work_folder,c+"/posterior.dat")):
+            posteriors = load_text_samples(os.path.join(work_folder,c+"/posterior.dat"), columns = p)
+        else:
+            posteriors = load_samples(os.path.join(work_folder,c+"/posterior"), columns = p)
         for pi in p:
             confidence_levels[pi].append(np.percentile(posteriors[pi],[5,50,95]))
             print(c,pi, confidence_levels[pi][-1])
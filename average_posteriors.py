@@ -1,21 +1,11 @@
 import numpy as np
 import os
-import matplotlib.pyplot as plt
-from scipy.stats import gaussian_kde
 from optparse import OptionParser
 import sys
 import readdata
 from dpgmm import *
-import multiprocessing as mp
 from scipy.misc import logsumexp
 from cosmology import *
-import matplotlib.patches as mpatches
-import matplotlib.lines as mlines
-import matplotlib
-import matplotlib.cm as cm
-import cPickle as pickle
-
-matplotlib.rcParams['contour.negative_linestyle'] = 'solid'
 
 def FindHeightForLevel(inArr, adLevels):
     # flatten the array
@@ -58,6 +48,13 @@ if __name__ == "__main__":
     parser.add_option('-m',action='store',type='string',default='LambdaCDM',help='model (LambdaCDM, LambdaCDMDE)', dest='model')
     (options,args)=parser.parse_args()
 
+    # plotting imports are deferred until the options are parsed
+    import matplotlib
+    import matplotlib.pyplot as plt
+    import matplotlib.lines as mlines
+    import cPickle as pickle
+    matplotlib.rcParams['contour.negative_linestyle'] = 'solid'
+
     eps = 1e-3
     x_flat = np.linspace(0.5+eps,1.0-eps,Nbins)
     y_flat = np.linspace(0.04+eps,1.0-eps,Nbins)
@@ -1,19 +1,12 @@
 import numpy as np
 import os
-import matplotlib.pyplot as plt
-from scipy.stats import gaussian_kde
 from optparse import OptionParser
 import sys
 import readdata
 from dpgmm import *
-import multiprocessing as mp
 from scipy.special import logsumexp
 from cosmology import *
-import matplotlib
-import matplotlib.pyplot as plt
-import dill as pickle
-
-matplotlib.rcParams['contour.negative_linestyle'] = 'solid'
+from posterior_io import load_posterior
 
 def init_plotting():
    plt.rcParams['figure.figsize'] = (3.4, 3.4)
@@ -136,6 +129,13 @@ if __name__=="__main__":
     parser.add_option('-N',action='store',type='int',default=None,help='Number of bins for the grid sampling', dest='N')
     (options,args)=parser.parse_args()
 
+    # plotting and pool imports are deferred until the options are parsed
+    import multiprocessing as mp
+    import matplotlib
+    import matplotlib.pyplot as plt
+    import dill as pickle
+    matplotlib.rcParams['contour.negative_linestyle'] = 'solid'
+
     model = opts.model
     out_folder = options.output
     os.system("mkdir -p %s"%out_folder)
@@ -161,11 +161,9 @@ if __name__=="__main__":
     dy = np.diff(y_flat)[0]
     X,Y = np.meshgrid(x_flat,y_flat)
 
-    from cpnest import nest2pos
     for i,c in enumerate(catalogs):
         print("processing ",c)
-        samples = np.genfromtxt(os.path.join(options.data,c+"/chain_5000_1234.txt"),names=True)
-        posteriors = nest2pos.draw_posterior_many([samples], [5000], verbose=False)
+        posteriors = load_posterior(os.path.join(options.data,c), 5000, columns = ['h','om'])
         if i==0:
             h = posteriors['h'][::5]
             om = posteriors['om'][::5]
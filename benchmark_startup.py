@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import re
+import subprocess
+import sys
+import time
+from optparse import OptionParser
+
+"""
+startup time of the inference entry point: times fresh interpreters importing
+it, lists the slowest imports (python -X importtime) and fails if the startup
+exceeds the budget or if any of the postprocessing modules gets loaded.
+"""
+
+# modules only the postprocessing needs, an inference job must never import them
+# (multiprocessing is not among them, cpnest needs it to run the samplers)
+forbidden = ['matplotlib', 'corner', 'scipy.stats', 'dill']
+
+def run(module, *flags):
+    """
+    import module in a fresh interpreter, returns the wall time and the stderr
+    """
+    code = "import sys; import {0}; sys.stdout.write(' '.join(sys.modules))".format(module)
+    t0 = time.time()
+    p = subprocess.run([sys.executable]+list(flags)+['-c', code], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    elapsed = time.time()-t0
+    if p.returncode != 0:
+        sys.stderr.write(p.stderr)
+        raise SystemExit("importing {0} failed".format(module))
+    return elapsed, p.stdout.split(), p.stderr
+
+if __name__=="__main__":
+    parser=OptionParser()
+    parser.add_option('-m','--module',  default='cosmological_inference', type='string', metavar='module', help='entry point to time (default cosmological_inference)')
+    parser.add_option('-n','--repeat',  default=10, type='int', metavar='repeat', help='number of fresh interpreters to time (default 10)')
+    parser.add_option('--budget',       default=1.0, type='float', metavar='budget', help='maximum median startup time in seconds (default 1)')
+    parser.add_option('--top',          default=10, type='int', metavar='top', help='number of slowest imports to report (default 10)')
+    (opts,args)=parser.parse_args()
+
+    # the first run warms up the file system cache and the bytecode
+    run(opts.module)
+    times = sorted(run(opts.module)[0] for _ in range(opts.repeat))
+    median = times[len(times)//2]
+    print("startup of {0}: median {1:.3f} s, min {2:.3f} s, max {3:.3f} s over {4} runs".format(opts.module, median, times[0], times[-1], opts.repeat))
+
+    _, modules, importtime = run(opts.module, '-X', 'importtime')
+    cumulative = []
+    for line in importtime.splitlines():
+        m = re.match(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)', line)
+        # the entry point itself is not interesting, it includes everything else
+        if m is not None and m.group(4) != opts.module:
+            cumulative.append((int(m.group(2)), m.group(4)))
+    print("slowest imports (cumulative, including their submodules):")
+    for us, name in sorted(cumulative, reverse=True)[:opts.top]:
+        print("{0:>10.1f} ms  {1}".format(us/1e3, name))
+
+    loaded = [f for f in forbidden if f in modules]
+    if loaded:
+        raise SystemExit("{0} imports postprocessing modules: {1}".format(opts.module, ', '.join(loaded)))
+    if median > opts.budget:
+        raise SystemExit("startup {0:.3f} s exceeds the budget of {1:.3f} s".format(median, opts.budget))
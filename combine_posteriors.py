@@ -2,22 +2,13 @@
 
 import numpy as np
 import os
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
-from scipy.stats import gaussian_kde
 from optparse import OptionParser
 import sys
 import readdata
 from dpgmm import *
-import multiprocessing as mp
 from scipy.special import logsumexp
 from cosmology import *
-import matplotlib.patches as mpatches
-import matplotlib.lines as mlines
-import dill as pickle
-
-matplotlib.rcParams['contour.negative_linestyle'] = 'solid'
+from posterior_io import load_posterior
 
 def init_plotting():
     plt.rcParams['figure.figsize'] = (3.4, 3.4)
@@ -146,6 +137,14 @@ if __name__=="__main__":
     parser.add_option('--nlive',action='store',type='int',default=5000,help='Number of live points', dest='nlive')
     (options,args)=parser.parse_args()
 
+    # plotting and pool imports are deferred until the options are parsed
+    import multiprocessing as mp
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import dill as pickle
+    matplotlib.rcParams['contour.negative_linestyle'] = 'solid'
+
     out_folder = os.path.join(options.output,str(options.realisation))
     os.system("mkdir -p %s"%out_folder)
     np.random.seed(options.realisation)
@@ -187,7 +186,6 @@ if __name__=="__main__":
     lX,lY = np.meshgrid(logit(x_flat,h_min,h_max),logit(y_flat,om_min,om_max))
     logjacobian_factor = logjacobian(X,h_min,h_max)+logjacobian(Y,om_min,om_max)
     
-    from cpnest import nest2pos
     init_plotting()
     # sort the events by increasing ID
     if options.realisation == 0: events = sorted(events, key=lambda x: x.ID)
@@ -197,10 +195,7 @@ if __name__=="__main__":
     
         folder_name = "EVENT_1%03d"%e.ID
         print("processing ",folder_name)
-        posteriors = nest2pos.draw_posterior_many([np.genfromtxt(os.path.join(options.data,folder_name+"/chain_{}_1234.txt".format(options.nlive)),
-                                                   names=True)],
-                                                   [options.nlive],
-                                                   verbose=False)
+        posteriors = load_posterior(os.path.join(options.data,folder_name), options.nlive, columns = ['h','om','z%d'%e.ID])
 
         if options.pickle == False:
             
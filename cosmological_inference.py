@@ -0,0 +1,18 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+inference-only entry point: same options as cosmological_model.py,
+runs the sampler and exits without loading any of the postprocessing
+(plotting) modules, so that the many short per-event jobs start quickly
+"""
+from __future__ import unicode_literals
+import cosmological_model as cm
+
+if __name__=='__main__':
+
+    (opts,args)=cm.parse_options(cm.build_parser())
+    if opts.postprocess != 0:
+        raise SystemExit("cosmological_inference.py does not postprocess, use cosmological_model.py --postprocess 1")
+    events, em_selection = cm.read_events(opts)
+    C = cm.build_model(opts, events, em_selection)
+    cm.run_sampler(C, opts, cm.output_folder(opts))
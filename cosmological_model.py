@@ -1,19 +1,15 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
-import unittest
 import numpy as np
-import lal
 import cpnest.model
 import sys
 import os
 from optparse import OptionParser
-import itertools as it
 import cosmology as cs
 import readdata
-from scipy.special import logsumexp
 import likelihood as lk
-from functools import reduce
+import posterior_io
 
 """
 G = the GW is in a galaxy that i see
@@ -41,7 +37,20 @@ class CosmologicalModel(cpnest.model.Model):
         self.z_threshold    = kwargs['z_threshold']
         self.snr_threshold  = kwargs['snr_threshold']
         self.event_class    = kwargs['event_class']
-        self.O              = None
+        self.tabulate       = kwargs['tabulate']
+        self.distance_cache = cs.DistanceCache(tolerance = kwargs['cache_tolerance'], store = kwargs['distance_store'])
+        self.backend        = kwargs['backend']
+        self.accuracy       = kwargs['accuracy']
+        self.host_window    = kwargs['host_window']
+        self.host_density_points    = kwargs['host_density']
+        self.host_density_tolerance = kwargs['host_density_tolerance']
+        # integrate the event redshifts out of the likelihood instead of sampling them
+        self.marginalise    = kwargs['marginalise_redshifts']
+        self.redshift_points = kwargs['redshift_points']
+        self.redshift_order = kwargs['redshift_order']
+        # OpenMP threads of each likelihood call, independent of the sampler threads
+        self.likelihood_threads = kwargs['likelihood_threads']
+        self.gw_selection   = kwargs['gw_selection']
         
         if self.model == "LambdaCDM":
             
@@ -68,9 +77,25 @@ class CosmologicalModel(cpnest.model.Model):
             print("Cosmological model %s not supported. exiting..\n"%self.model)
             exit()
         
-        for e in self.data:
-            self.bounds.append([e.zmin,e.zmax])
-            self.names.append('z%d'%e.ID)
+        if not self.marginalise:
+            for e in self.data:
+                self.bounds.append([e.zmin,e.zmax])
+                self.names.append('z%d'%e.ID)
+        
+        self.zmin = np.array([e.zmin for e in self.data], dtype=np.float64)
+        self.zmax = np.array([e.zmax for e in self.data], dtype=np.float64)
+        
+        # largest redshift any event can be placed at, used as the edge of the distance tables
+        self.table_zmax = np.max([np.max(e.zmax) for e in self.data])
+        # reusable cosmology objects, one per sampler thread
+        self.pool       = cs.CosmologyPool(self.table_zmax, self.tabulate, self.distance_cache, self.backend, self.accuracy)
+        # detection probability of the GW selection effect, from a table or from the horizon redshift
+        self.detection_table = None
+        if self.gw_selection:
+            if kwargs['detection_table'] is not None:
+                self.detection_table = lk.DetectionProbabilityTable.load(kwargs['detection_table'])
+            else:
+                self.detection_table = lk.DetectionProbabilityTable.from_horizon(self.z_threshold, self.snr_threshold, zmax = self.table_zmax)
             
         self._initialise_galaxy_hosts()
         
@@ -79,73 +104,254 @@ class CosmologicalModel(cpnest.model.Model):
         print("Cosmological model: {0}".format(self.model))
         print("Number of events: {0}".format(len(self.data)))
         print("EM correction: {0}".format(self.em_selection))
+        print("GW correction: {0}".format(self.gw_selection))
+        print("Likelihood threads: {0}".format(self.likelihood_threads if self.likelihood_threads > 0 else "1/core"))
+        if self.marginalise:
+            print("Event redshifts: marginalised ({0} grid points within 8 sigma of each distance, Gauss-Hermite order {1})".format(self.redshift_points,self.redshift_order))
+        if self.host_density is not None:
+            print("Host density: tabulated on {0} points, max error {1:.1e}".format(self.host_density.npoints,self.host_density.error))
+        elif self.host_window > 0:
+            print("Host window: {0} sigma, hosts neglected below {1:.1e} of their redshift probability".format(self.host_window,lk.host_window_neglected_mass(self.host_window)))
+        print("Cosmology backend: {0} ({1} accuracy)".format(self.backend,self.accuracy))
+        if self.tabulate > 0:
+            O = cs.CosmologicalParameters(0.73,0.25,0.75,-1.0,0.0,self.backend,self.accuracy)
+            O.Tabulate(self.table_zmax, self.tabulate)
+            print("Tabulated distances: {0} points, max relative error {1:.1e}".format(self.tabulate,O.TabulationError()))
+            O.DestroyCosmologicalParameters()
         print("==========================================")
 
     def _initialise_galaxy_hosts(self):
         self.hosts = {e.ID:np.array([(g.redshift,g.dredshift,g.weight) for g in e.potential_galaxy_hosts]) for e in self.data}
+        # flattened catalog of all the hosts and per event arrays for the batched likelihood
+        self.host_catalog, self.host_offsets = lk.flatten_hosts([self.hosts[e.ID] for e in self.data])
+        self.host_widths = lk.host_redshift_widths(self.host_catalog, self.host_offsets)
+        # per-host constants of the host sum (z, 1/sigma_z, log w - log sigma_z), computed once
+        self.host_constants = lk.host_constants(self.host_catalog)
+        # the host redshift density does not depend on the cosmology: tabulate it once
+        self.host_density = None
+        if self.host_density_points > 0:
+            self.host_density = lk.HostDensityTable(self.host_catalog, self.host_offsets, self.zmin, self.zmax,
+                                                    self.host_density_points, self.host_density_tolerance)
+        self.dl     = np.array([e.dl for e in self.data], dtype=np.float64)
+        self.sigma  = np.array([e.sigma for e in self.data], dtype=np.float64)
         
     def log_prior(self,x):
-        logP = super(CosmologicalModel,self).log_prior(x)
-        
-        if np.isfinite(logP):
-            """
-            apply a uniform in comoving volume density redshift prior
-            """
-            if self.model == "LambdaCDM":
-                z_idx = 2
-                self.O = cs.CosmologicalParameters(x['h'],x['om'],1.0-x['om'],-1.0,0.0)
-            elif self.model == "LambdaCDMDE":
-                z_idx = 5
-                self.O = cs.CosmologicalParameters(x['h'],x['om'],x['ol'],x['w0'],x['w1'])
-                
-            elif self.model == "CLambdaCDM":
-                z_idx = 3
-                self.O = cs.CosmologicalParameters(x['h'],x['om'],x['ol'],-1.0,0.0)
-            
-            elif self.model == "DE":
-                z_idx = 2
-                self.O = cs.CosmologicalParameters(0.73,0.25,0.75,x['w0'],x['w1'])
-            
-#            if self.event_class == "EMRI" or self.event_class == "sBH":
-#                for j,e in enumerate(self.data):
-#                    #log_norm = np.log(self.O.IntegrateComovingVolumeDensity(self.bounds[z_idx+j][1]))
-#                    logP += np.log(self.O.UniformComovingVolumeDensity(x['z%d'%e.ID]))#-log_norm
-                
-        return logP
+        # uniform within the bounds, the uniform in comoving volume
+        # redshift prior is part of the likelihood
+        return super(CosmologicalModel,self).log_prior(x)
+
+    def cosmology(self, x):
+        """
+        cosmology of the point x, taken from the per-thread pool. A pure function of x:
+        the model keeps no per-point state, so one instance can be shared by any
+        number of sampler threads. The object stays valid until the next call from the same thread
+        """
+        if self.model == "LambdaCDM":
+            return self.pool.get(x['h'],x['om'],1.0-x['om'],-1.0,0.0)
+        elif self.model == "LambdaCDMDE":
+            return self.pool.get(x['h'],x['om'],x['ol'],x['w0'],x['w1'])
+        elif self.model == "CLambdaCDM":
+            return self.pool.get(x['h'],x['om'],x['ol'],-1.0,0.0)
+        elif self.model == "DE":
+            return self.pool.get(0.73,0.25,0.75,x['w0'],x['w1'])
 
     def log_likelihood(self,x):
         
-        # compute the p(GW|G\Omega)p(G|\Omega)+p(GW|~G\Omega)p(~G|\Omega)
-        logL = np.sum([lk.logLikelihood_single_event(self.hosts[e.ID], e.dl, e.sigma, self.O, x['z%d'%e.ID],
-                                em_selection = self.em_selection, zmin = self.bounds[2+j][0], zmax = self.bounds[2+j][1]) for j,e in enumerate(self.data)])
+        omega = self.cosmology(x)
+        if self.marginalise:
+            return self._log_likelihood_marginalised(omega)
+        
+        # the event redshifts are the last N parameters
+        event_redshifts = np.frombuffer(x.values, dtype=np.float64)[-self.N:]
+        
+        # compute the p(GW|G\Omega)p(G|\Omega)+p(GW|~G\Omega)p(~G|\Omega) for all the events at once
+        logL = lk.logLikelihood_multiple_events(self.host_catalog, self.host_offsets, self.dl, self.sigma, omega, event_redshifts,
+                                                em_selection = self.em_selection, zmin = self.zmin, zmax = self.zmax,
+                                                window = self.host_window, widths = self.host_widths, density = self.host_density,
+                                                constants = self.host_constants, threads = self.likelihood_threads)
+
+        return logL-self._log_gw_selection(omega)
+
+    def _log_gw_selection(self, omega):
+        """
+        N log alpha, with alpha the fraction of the sources within the prior range
+        that are detectable (see likelihood.gw_selection_normalisation), 0 if disabled
+        """
+        if not self.gw_selection:
+            return 0.0
+        return self.N*lk.gw_selection_normalisation(omega, self.detection_table, self.snr_threshold, self.table_zmax)
+
+    def log_likelihood_gradient(self, x):
+        """
+        gradient of the log likelihood with respect to the parameters, ordered as self.names.
+        cpnest itself never calls it: with --nhamiltonian > 0 run_sampler passes the Hamiltonian
+        proposals of hamiltonian_proposals.py, which reflect on the likelihood constraint along it
+        """
+        values = np.frombuffer(x.values, dtype=np.float64)
+        omega  = self.cosmology(x)
+        if self.marginalise:
+            logL, gradient = lk.logLikelihood_marginalised_gradient(self.host_catalog, self.host_offsets, self.dl, self.sigma, omega,
+                                                                     em_selection = self.em_selection, zmin = self.zmin, zmax = self.zmax,
+                                                                     constants = self.host_constants, npoints = self.redshift_points,
+                                                                     order = self.redshift_order, threads = self.likelihood_threads)
+            return self._cosmology_gradient(gradient-self._log_gw_selection_gradient(omega))
+        logL, gradient, redshift_gradient = lk.logLikelihood_multiple_events_gradient(self.host_catalog, self.host_offsets, self.dl, self.sigma, omega, values[-self.N:],
+                                                                                      em_selection = self.em_selection, zmin = self.zmin, zmax = self.zmax,
+                                                                                      window = self.host_window, widths = self.host_widths, density = self.host_density,
+                                                                                      constants = self.host_constants, threads = self.likelihood_threads)
+        return np.concatenate((self._cosmology_gradient(gradient-self._log_gw_selection_gradient(omega)), redshift_gradient))
+
+    def _log_gw_selection_gradient(self, omega):
+        if not self.gw_selection:
+            return np.zeros(5)
+        return self.N*lk.gw_selection_normalisation(omega, self.detection_table, self.snr_threshold, self.table_zmax, gradient = True)[1]
+
+    def _cosmology_gradient(self, gradient):
+        """
+        gradient with respect to the cosmological parameters of the model from the one
+        with respect to (h, om, ol, w0, w1)
+        """
+        d = dict(zip(('h','om','ol','w0','w1'), gradient))
+        if self.model == "LambdaCDM":
+            # ol = 1-om
+            d['om'] -= d['ol']
+        return np.array([d[n] for n in self.names if n in d])
+
+    def log_prior_gradient(self, x):
+        """
+        gradient of the log prior: the prior is uniform within the bounds
+        """
+        return np.zeros(len(self.names))
+
+    def force(self, x):
+        """
+        force of cpnest's Hamiltonian proposals, minus the gradient of
+        the potential (minus the log prior): the gradient of the log prior
+        """
+        return self.log_prior_gradient(x)
+
+    def check_log_likelihood_gradient(self, x, step = 1e-6):
+        """
+        largest difference between log_likelihood_gradient and central finite differences
+        of log_likelihood at x, relative to 1+|derivative|
+        """
+        gradient = self.log_likelihood_gradient(x)
+        error    = 0.0
+        for i,n in enumerate(self.names):
+            f = []
+            for sign in (1.0, -1.0):
+                y = x.copy()
+                y[n] += sign*step
+                f.append(self.log_likelihood(y))
+            numerical = (f[0]-f[1])/(2.0*step)
+            error = max(error, abs(gradient[i]-numerical)/(1.0+abs(numerical)))
+        return error
+
+    def _log_likelihood_marginalised(self, omega):
+        return lk.logLikelihood_marginalised(self.host_catalog, self.host_offsets, self.dl, self.sigma, omega,
+                                             em_selection = self.em_selection, zmin = self.zmin, zmax = self.zmax,
+                                             constants = self.host_constants, npoints = self.redshift_points, order = self.redshift_order,
+                                             threads = self.likelihood_threads)-self._log_gw_selection(omega)
 
-        self.O.DestroyCosmologicalParameters()
+    def reconstruct_redshifts(self, x, seed = 0):
+        """
+        add to the posterior samples x of a run with marginalised redshifts
+        one draw of every event redshift from its posterior given each sample
+        """
+        from numpy.lib import recfunctions
+        rng = np.random.RandomState(seed)
+        points  = np.column_stack([x[n] for n in self.names])
+        z = np.array([lk.draw_event_redshifts(self.host_catalog, self.host_offsets, self.dl, self.sigma, self.pool.get(*c),
+                                              em_selection = self.em_selection, zmin = self.zmin, zmax = self.zmax,
+                                              constants = self.host_constants, npoints = self.redshift_points,
+                                              order = self.redshift_order, rng = rng) for c in self.cosmologies(points)])
+        return recfunctions.append_fields(x, ['z%d'%e.ID for e in self.data], z.T, usemask = False)
 
+    def cosmologies(self, points):
+        """
+        cosmology records (see cosmology.cosmology_dtype) of an array of
+        points with shape (M, number of parameters), columns ordered as self.names
+        """
+        points  = np.atleast_2d(points)
+        records = np.zeros(points.shape[0], dtype=cs.cosmology_dtype)
+        for name in cs.cosmology_dtype.names:
+            records[name] = points[:,self.names.index(name)] if name in self.names else truths[name]
+        if self.model == "LambdaCDM":
+            records['ol'] = 1.0-records['om']
+        return records
+
+    def log_likelihood_population(self, points, threads = None):
+        """
+        log likelihood of M points at once, given as an array with shape
+        (M, number of parameters), columns ordered as self.names
+        """
+        points = np.atleast_2d(points)
+        if self.marginalise:
+            return np.array([self._log_likelihood_marginalised(self.pool.get(*c)) for c in self.cosmologies(points)])
+        cosmologies = self.cosmologies(points)
+        logL = lk.logLikelihood_population(self.host_catalog, self.host_offsets, self.dl, self.sigma,
+                                           cosmologies, points[:,-self.N:],
+                                           em_selection = self.em_selection, zmin = self.zmin, zmax = self.zmax,
+                                           pool = self.pool, threads = threads,
+                                           window = self.host_window, widths = self.host_widths, density = self.host_density,
+                                           constants = self.host_constants)
+        if self.gw_selection:
+            logL -= np.array([self._log_gw_selection(self.pool.get(*c)) for c in cosmologies])
         return logL
 
 truths = {'h':0.73,'om':0.25,'ol':0.75,'w0':-1.0,'w1':0.0}
 usage=""" %prog (options)"""
 
-if __name__=='__main__':
-
+def build_parser():
+    """
+    command line options, shared with the inference-only entry point cosmological_inference.py
+    """
     parser=OptionParser(usage)
     parser.add_option('-o','--out-dir', default=None,type='string',metavar='DIR',help='Directory for output')
     parser.add_option('-t','--threads', default=None,type='int',metavar='threads',help='Number of threads (default = 1/core)')
+    parser.add_option('--nhamiltonian', default=0, type='int',metavar='nhamiltonian',help='number of sampler threads using Hamiltonian proposals, driven by the analytic likelihood gradient (default 0)')
     parser.add_option('-d','--data',    default=None,type='string',metavar='data',help='galaxy data location')
     parser.add_option('-e','--event',   default=None,type='int',metavar='event',help='event number')
     parser.add_option('-c','--event-class',default=None,type='string',metavar='event_class',help='class of the event(s) [MBH, EMRI, sBH]')
     parser.add_option('-m','--model',   default='LambdaCDM',type='string',metavar='model',help='cosmological model to assume for the analysis (default LambdaCDM). Supports LambdaCDM, CLambdaCDM, DE and LambdaCDMDE')
     parser.add_option('-j','--joint',   default=0, type='int',metavar='joint',help='run a joint analysis for N events, randomly selected. (EMRI only)')
     parser.add_option('-s','--seed',   default=0, type='int', metavar='seed',help='rando seed initialisation')
-    parser.add_option('--snr_threshold',    default=0, type='float',metavar='snr_threshold',help='SNR detection threshold')
+    parser.add_option('--snr_threshold',    default=0, type='float',metavar='snr_threshold',help='SNR detection threshold, required by --gw_selection without --detection_table')
     parser.add_option('--zhorizon',     default=1000.0, type='float',metavar='zhorizon',help='Horizon redshift corresponding to the SNR threshold')
     parser.add_option('--em_selection', default=0, type='int',metavar='em_selection',help='use EM selection function')
+    parser.add_option('--gw_selection', default=0, type='int',metavar='gw_selection',help='use GW selection function')
+    parser.add_option('--detection_table', default=None, type='string',metavar='detection_table',help='.npz table of the GW detection probability over redshift and SNR threshold (default None, computed from --zhorizon and --snr_threshold)')
     parser.add_option('--nlive',        default=1000, type='int',metavar='nlive',help='number of live points')
     parser.add_option('--poolsize',     default=100, type='int',metavar='poolsize',help='poolsize for the samplers')
     parser.add_option('--maxmcmc',      default=1000, type='int',metavar='maxmcmc',help='maximum number of mcmc steps')
     parser.add_option('--postprocess',  default=0, type='int',metavar='postprocess',help='run only the postprocessing')
-    (opts,args)=parser.parse_args()
-    
+    parser.add_option('--plot',         default=0, type='int',metavar='plot',help='have cpnest also write nested_samples.dat and posterior.dat and plot the samples of each parameter at the end of the run, this imports matplotlib (default 0)')
+    parser.add_option('--host_window',  default=0.0, type='float',metavar='host_window',help='sum only over the hosts within this many redshift standard deviations of the event redshift, or over all of them if none is that close (default 0, all hosts)')
+    parser.add_option('--host_density', default=0, type='int',metavar='host_density',help='initial number of redshift grid points of the tabulated host density of each event (default 0, sum over the hosts at every call)')
+    parser.add_option('--host_density_tolerance', default=1e-4, type='float',metavar='host_density_tolerance',help='maximum interpolation error of the tabulated host density, relative to its peak (default 1e-4)')
+    parser.add_option('--marginalise_redshifts', default=0, type='int',metavar='marginalise_redshifts',help='integrate the event redshifts in the likelihood instead of sampling them, they are reconstructed in postprocessing (default 0)')
+    parser.add_option('--redshift_points', default=201, type='int',metavar='redshift_points',help='minimum number of redshift grid points per event for the marginalisation, within 8 sigma of its distance likelihood on either side (default 201)')
+    parser.add_option('--redshift_order', default=5, type='int',metavar='redshift_order',help='Gauss-Hermite order of the integral over each host narrower than the distance likelihood, for the marginalisation (default 5)')
+    parser.add_option('--likelihood_threads', default=1, type='int',metavar='likelihood_threads',help='number of OpenMP threads over the events in each likelihood call, independent of --threads and --poolsize (default 1, 0 for 1/core)')
+    parser.add_option('--tabulate',     default=0, type='int',metavar='tabulate',help='number of redshift grid points for the tabulated distances (default 0, use the LAL integrators)')
+    parser.add_option('--cache_tolerance', default=0.0, type='float',metavar='cache_tolerance',help='resolution in (om, ol, w0, w1) below which cosmologies share the same distance table. Makes the likelihood piecewise constant in these parameters, hence incompatible with --nhamiltonian (default 0, exact)')
+    parser.add_option('--distance_store', default=None, type='string',metavar='distance_store',help='directory of the on-disk distance table store shared between jobs (default None, tables are kept in memory only)')
+    parser.add_option('--backend',      default='lal', type='string',metavar='backend',help='cosmology integration backend: lal (adaptive) or native (fixed order Gauss-Legendre, whose cost does not depend on w0 and w1: with --accuracy low it keeps LambdaCDMDE and DE runs as fast as LambdaCDM ones). default lal')
+    parser.add_option('--accuracy',     default='medium', type='string',metavar='accuracy',help='accuracy of the native backend: low, medium or high. default medium')
+    return parser
+
+def parse_options(parser, argv = None):
+    (opts,args)=parser.parse_args(argv)
+    if opts.cache_tolerance > 0.0 and opts.nhamiltonian > 0:
+        parser.error("--cache_tolerance > 0 makes the likelihood a step function in the shape parameters, its gradient is wrong: use 0 with --nhamiltonian")
+    if opts.gw_selection and opts.detection_table is None and opts.snr_threshold <= 0.0:
+        parser.error("--gw_selection without --detection_table computes the detection probability from the horizon: it needs --snr_threshold > 0, the SNR of a source at --zhorizon")
+    return opts, args
+
+def read_events(opts):
+    """
+    events to analyse and the EM selection flag to use for them
+    """
     em_selection = opts.em_selection
 
     if opts.event_class == "MBH":
@@ -181,6 +387,67 @@ if __name__=='__main__':
         print("==================================================")
     else:
         events = readdata.read_event(opts.event_class, opts.data, opts.event)
+    return events, em_selection
+
+def output_folder(opts):
+    if opts.out_dir is None:
+        return opts.data+"/EVENT_1%03d/"%(opts.event+1)
+    return opts.out_dir
+
+def build_model(opts, events, em_selection):
+    return CosmologicalModel(opts.model,
+                             events,
+                             em_selection = em_selection,
+                             snr_threshold= opts.snr_threshold,
+                             gw_selection = opts.gw_selection,
+                             detection_table = opts.detection_table,
+                             z_threshold  = opts.zhorizon,
+                             event_class  = opts.event_class,
+                             tabulate     = opts.tabulate,
+                             cache_tolerance = opts.cache_tolerance,
+                             distance_store = opts.distance_store,
+                             backend      = opts.backend,
+                             accuracy     = opts.accuracy,
+                             host_window  = opts.host_window,
+                             host_density = opts.host_density,
+                             host_density_tolerance = opts.host_density_tolerance,
+                             marginalise_redshifts = opts.marginalise_redshifts,
+                             redshift_points = opts.redshift_points,
+                             redshift_order = opts.redshift_order,
+                             likelihood_threads = opts.likelihood_threads)
+
+def run_sampler(C, opts, output):
+    """
+    run cpnest on the model C, writing its output in output, and return the posterior samples.
+    The chain and the posterior are also stored in binary form (see posterior_io)
+    """
+    proposals = None
+    if opts.nhamiltonian > 0:
+        # Hamiltonian proposals driven by the analytic likelihood gradient
+        from cpnest.proposal import DefaultProposalCycle, EnsembleSliceProposalCycle
+        from hamiltonian_proposals import GradientHamiltonianProposalCycle
+        proposals = dict(mhs = DefaultProposalCycle, hmc = GradientHamiltonianProposalCycle, sli = EnsembleSliceProposalCycle)
+    # cpnest plots only with verbose 2, an inference-only run never imports matplotlib
+    work=cpnest.CPNest(C,
+                       verbose      = 2 if opts.plot else 1,
+                       poolsize     = opts.poolsize,
+                       nthreads     = opts.threads,
+                       nlive        = opts.nlive,
+                       maxmcmc      = opts.maxmcmc,
+                       output       = output,
+                       nhamiltonian = opts.nhamiltonian,
+                       proposals    = proposals)
+
+    work.run()
+    print('log Evidence {0}'.format(work.NS.logZ))
+    posterior_io.save_samples(posterior_io.chain_path(output, opts.nlive), work.nested_samples, nlive = opts.nlive)
+    posterior_io.save_samples(os.path.join(output, "posterior"), work.posterior_samples, nlive = opts.nlive)
+    return work.posterior_samples.ravel()
+
+if __name__=='__main__':
+
+    (opts,args)=parse_options(build_parser())
+    events, em_selection = read_events(opts)
 
 #    redshifts = [e.z_true for e in events]
 #    galaxy_redshifts = [g.redshift for e in events for g in e.potential_galaxy_hosts]
@@ -217,7 +484,7 @@ if __name__=='__main__':
 ##        om = 0.25
 ##        ol = 1.0-om
 #        O = cs.CosmologicalParameters(h,om,ol,-1.0,0.0)
-##        distances = np.array([O.LuminosityDistance(zi) for zi in z])
+##        distances = O.LuminosityDistanceArray(z)
 ##        plt.plot(z, [lk.em_selection_function(d) for d in distances], lw = 0.25, color=s_m.to_rgba(h), alpha = 0.75, linestyle='dashed')
 #        pz = np.array([O.UniformComovingVolumeDensity(zi) for zi in z])/O.IntegrateComovingVolumeDensity(z.max())
 ##        pz = np.array([O.ComovingVolumeElement(zi) for zi in z])/O.IntegrateComovingVolume(z.max())
@@ -244,7 +511,7 @@ if __name__=='__main__':
 #    O = cs.CosmologicalParameters(0.73,0.25,0.75,-1.0,0.0)
 #    pz = np.array([O.ComovingVolumeElement(zi) for zi in z])/O.IntegrateComovingVolume(z.max())
 #    pz = np.array([O.UniformComovingVolumeDensity(zi) for zi in z])/O.IntegrateComovingVolumeDensity(z.max())
-#    distances = np.array([O.LuminosityDistance(zi) for zi in z])
+#    distances = O.LuminosityDistanceArray(z)
 #    plt.plot(z, [lk.em_selection_function(d) for d in distances], lw = 0.5, color='k', linestyle='dashed')
 #    O.DestroyCosmologicalParameters()
 #    plt.plot(z,np.cumsum(pz)/pz.sum(), lw = 0.5, color='k')
@@ -259,40 +526,22 @@ if __name__=='__main__':
 #    exit()
 
     model = opts.model
-
-    if opts.out_dir is None:
-        output = opts.data+"/EVENT_1%03d/"%(opts.event+1)
-    else:
-        output = opts.out_dir
-    
-    C = CosmologicalModel(model,
-                          events,
-                          em_selection = em_selection,
-                          snr_threshold= opts.snr_threshold,
-                          z_threshold  = opts.zhorizon,
-                          event_class  = opts.event_class)
+    output = output_folder(opts)
+    C = build_model(opts, events, em_selection)
     
     if opts.postprocess == 0:
-        work=cpnest.CPNest(C,
-                           verbose      = 2,
-                           poolsize     = opts.poolsize,
-                           nthreads     = opts.threads,
-                           nlive        = opts.nlive,
-                           maxmcmc      = opts.maxmcmc,
-                           output       = output,
-                           nhamiltonian = 0)
-
-        work.run()
-        print('log Evidence {0}'.format(work.NS.logZ))
-        x = work.posterior_samples.ravel()
+        x = run_sampler(C, opts, output)
     else:
-        x = np.genfromtxt(os.path.join(output,"chain_"+str(opts.nlive)+"_1234.txt"), names=True)
-        from cpnest import nest2pos
-        x = nest2pos.draw_posterior_many([x], [opts.nlive], verbose=False)
+        x = posterior_io.load_posterior(output, opts.nlive)
+    
+    if C.marginalise:
+        x = C.reconstruct_redshifts(x)
 
     import matplotlib
     import matplotlib.pyplot as plt
+    from matplotlib.collections import LineCollection
     from scipy.stats import norm
+    import posterior_predictive as pp
     
     if opts.event_class == "EMRI":
         for e in C.data:
@@ -311,15 +560,13 @@ if __name__=='__main__':
             s_m = matplotlib.cm.ScalarMappable(cmap=c_m, norm=normalisation)
             s_m.set_array([])
             ax.axvline(e.z_true, linestyle='dotted', lw=0.5, color='k')
-            for i in range(x.shape[0])[::10]:
-                if model == "LambdaCDM": O = cs.CosmologicalParameters(x['h'][i],x['om'][i],1.0-x['om'][i],-1.0,0.0)
-                elif model == "LambdaCDMDE": O = cs.CosmologicalParameters(x['h'][i],x['om'][i],x['ol'][i],x['w0'][i],x['w1'][i])
-                elif model == "CLambdaCDM": O = cs.CosmologicalParameters(x['h'][i],x['om'][i],x['ol'][i],-1.0,0.0)
-                elif model == "DE": O = cs.CosmologicalParameters(truths['h'],truths['om'],truths['ol'],x['w0'][i],x['w1'][i])
-                distances = np.array([O.LuminosityDistance(zi) for zi in z])
-                if model == "DE":  ax2.plot(z, [lk.em_selection_function(d) for d in distances], lw = 0.15, color=s_m.to_rgba(x['w0'][i]), alpha = 0.5)
-                else: ax2.plot(z, [lk.em_selection_function(d) for d in distances], lw = 0.15, color=s_m.to_rgba(x['h'][i]), alpha = 0.5)
-                O.DestroyCosmologicalParameters()
+            # selection function of every 10th sample, drawn as a single collection
+            cosmologies = pp.posterior_cosmologies(x, model)[::10]
+            selection   = pp.predictive_curves(cosmologies, z, which = ('em_selection',), threads = opts.threads)['em_selection']
+            colour      = cosmologies['w0'] if model == "DE" else cosmologies['h']
+            lines = LineCollection([np.column_stack((z, s)) for s in selection], linewidths = 0.15, colors = s_m.to_rgba(colour), alpha = 0.5)
+            ax2.add_collection(lines)
+            ax2.set_xlim(z.min(), z.max())
                 
             CB = plt.colorbar(s_m, orientation='vertical', pad=0.15)
             if model == "DE": CB.set_label('w_0')
@@ -350,50 +597,14 @@ if __name__=='__main__':
         omega_true = cs.CosmologicalParameters(0.73,0.25,0.75,-1,0)
         redshift = np.logspace(-3,1.0,100)
         
-        # loop over the posterior samples to get all models to then average
-        # for the plot
-        
-        models = []
-        
-        for k in range(x.shape[0]):
-            if opts.model == "LambdaCDM":
-                omega = cs.CosmologicalParameters(x['h'][k],
-                                               x['om'][k],
-                                               1.0-x['om'][k],
-                                               -1,
-                                               0.0)
-            elif opts.model == "CLambdaCDM":
-                omega = cs.CosmologicalParameters(x['h'][k],
-                                               x['om'][k],
-                                               x['ol'][k],
-                                               -1,
-                                               0.0)
-            elif opts.model == "LambdaCDMDE":
-                omega = cs.CosmologicalParameters(x['h'][k],
-                                               x['om'][k],
-                                               x['ol'][k],
-                                               x['w0'][k],
-                                               x['w1'][k])
-            elif opts.model == "DE":
-                omega = cs.CosmologicalParameters(0.73,
-                                               0.25,
-                                               0.75,
-                                               x['w0'][k],
-                                               x['w1'][k])
-            else:
-                print(opts.model,"is unknown")
-                exit()
-            models.append([omega.LuminosityDistance(zi)/1e3 for zi in redshift])
-            omega.DestroyCosmologicalParameters()
-        
-        models = np.array(models)
-        model2p5,model16,model50,model84,model97p5 = np.percentile(models,[2.7,16.0,50.0,84.0,97.5],axis = 0)
-        
+        # percentiles of the distance over the posterior samples
+        bands = pp.predictive_bands(x, opts.model, redshift, which = ('luminosity_distance',), threads = opts.threads)
+        model2p5,model16,model50,model84,model97p5 = bands['luminosity_distance']/1e3
         
         fig = plt.figure()
         ax = fig.add_subplot(111)
         ax.errorbar(z,dl,xerr=deltaz,yerr=deltadl,markersize=1,linewidth=2,color='k',fmt='o')
-        ax.plot(redshift,[omega_true.LuminosityDistance(zi)/1e3 for zi in redshift],linestyle='dashed',color='red', zorder = 22)
+        ax.plot(redshift,omega_true.LuminosityDistanceArray(redshift)/1e3,linestyle='dashed',color='red', zorder = 22)
         ax.plot(redshift,model50,color='k')
         ax.errorbar(ztrue, dl, yerr=deltadl, xerr=dztrue, markersize=2,linewidth=1,color='r',fmt='o')
         ax.fill_between(redshift,model2p5,model97p5,facecolor='turquoise')
@@ -0,0 +1,167 @@
+# declarations shared with the other extension modules (cimport cosmology)
+
+cdef extern from "lal/LALCosmologyCalculator.h" nogil:
+    ctypedef struct LALCosmologicalParameters:
+        double h;
+        double om;
+        double ol;
+        double ok;
+        double w0;
+        double w1;
+        double w2;
+    
+    cdef double XLALLuminosityDistance(
+            LALCosmologicalParameters *omega, 
+            double z)
+
+    cdef double XLALAngularDistance(
+            LALCosmologicalParameters *omega, 
+            double z)
+
+    cdef double XLALComovingLOSDistance(
+            LALCosmologicalParameters *omega, 
+            double z)
+
+    cdef double XLALComovingTransverseDistance(
+            LALCosmologicalParameters *omega, 
+            double z)
+
+    cdef double XLALHubbleDistance(
+            LALCosmologicalParameters *omega
+            )
+
+    cdef double XLALHubbleParameter(double z,
+            void *omega
+            )
+
+    cdef double XLALIntegrateHubbleParameter(LALCosmologicalParameters *omega, double z)
+
+    cdef double XLALUniformComovingVolumeDistribution(
+            LALCosmologicalParameters *omega, 
+            double z,
+            double zmax)
+
+    cdef double XLALUniformComovingVolumeDensity(
+            double z,
+            void *omega)
+
+    cdef double XLALIntegrateComovingVolumeDensity(LALCosmologicalParameters *omega, double z)
+
+    cdef double XLALIntegrateComovingVolume(LALCosmologicalParameters *omega, double z)
+
+    cdef double XLALComovingVolumeElement(double z, void *omega)
+
+    cdef double XLALComovingVolume(LALCosmologicalParameters *omega, double z)
+
+    cdef LALCosmologicalParameters *XLALCreateCosmologicalParameters(double h, double om, double ol, double w0, double w1, double w2)
+
+    cdef void XLALDestroyCosmologicalParameters(LALCosmologicalParameters *omega)
+
+    cdef double XLALGetHubbleConstant(LALCosmologicalParameters *omega)
+
+    cdef double XLALGetOmegaMatter(LALCosmologicalParameters *omega)
+
+    cdef double XLALGetOmegaLambda(LALCosmologicalParameters *omega)
+
+    cdef double XLALGetOmegaK(LALCosmologicalParameters *omega)
+
+    cdef double XLALGetW0(LALCosmologicalParameters *omega)
+
+    cdef double XLALGetW1(LALCosmologicalParameters *omega)
+
+    cdef double XLALGetW2(LALCosmologicalParameters *omega)
+
+# integration backends
+cdef enum:
+    BACKEND_LAL     = 0
+    BACKEND_NATIVE  = 1
+
+# quantities that can be evaluated pointwise in redshift,
+# used to dispatch the scalar and the array interfaces
+cdef enum:
+    HUBBLE_PARAMETER                = 0
+    LUMINOSITY_DISTANCE             = 1
+    COMOVING_VOLUME_ELEMENT         = 2
+    UNIFORM_COMOVING_VOLUME_DENSITY = 3
+    COMOVING_VOLUME                 = 4
+    INTEGRATE_COMOVING_VOLUME       = 5
+    INTEGRATE_COMOVING_VOLUME_DENSITY = 6
+    COMOVING_DISTANCE               = 7
+
+# components of the gradients with respect to the redshift and the parameters
+cdef enum:
+    D_Z  = 0
+    D_H  = 1
+    D_OM = 2
+    D_OL = 3
+    D_W0 = 4
+    D_W1 = 5
+    NGRADIENT = 6
+
+cdef class CosmologicalParameters:
+    cdef LALCosmologicalParameters* __LALCosmologicalParameters
+    cdef public double h
+    cdef public double om
+    cdef public double ol
+    cdef public double w0
+    cdef public double w1
+    cdef int _backend
+    cdef int _accuracy
+    # tabulated mode: dimensionless comoving distance chi(z) = Dc(z)/dH
+    # and its derivative 1/E(z) on a uniform grid in [0, zmax]
+    cdef bint _tabulated
+    cdef int _table_npoints
+    cdef double _table_dz
+    cdef double _table_zmax
+    cdef double _table_error
+    cdef const double[::1] _table_chi
+    cdef const double[::1] _table_dchi
+    cdef object _table_cache
+    # results that depend only on the shape parameters, stored in units of dH
+    # and cleared whenever om, ol, w0 or w1 change. LRU (OrderedDict) of at most
+    # MEMO_SIZE entries, read and written through _memo_get and _memo_set
+    cdef object _memo
+
+    cpdef void UpdateFromRecord(self, object record) except *
+    cdef void _shape_changed(self) except *
+    cpdef void SetH(self, double h) except *
+    cpdef void SetOM(self, double om) except *
+    cpdef void SetOL(self, double ol) except *
+    cpdef void SetW0(self, double w0) except *
+    cpdef void SetW1(self, double w1) except *
+    cpdef void Update(self, double h, double om, double ol, double w0, double w1) except *
+    cpdef void Tabulate(self, double zmax = *, int npoints = *, object cache = *) except *
+    cpdef void ClearTabulation(self)
+    cpdef double TabulationError(self)
+    cdef double _interpolate_chi(self, double z) nogil
+    cdef double _transverse(self, double chi) nogil
+    cdef double _transverse_derivative(self, double chi) nogil
+    cdef double _transverse_curvature_derivative(self, double chi) nogil
+    cdef void _log_distance_gradient(self, double z, double *dlog_dl, double *dlog_density) nogil
+    cdef void _log_norm_gradient(self, double zmax, double *dlog_norm) nogil
+    cdef double _inverse_hubble(self, double z) nogil
+    cdef double _chi(self, double z) nogil
+    cdef double _luminosity_distance_derivative(self, double z) nogil
+    cdef double _inverse_luminosity_distance(self, double dl) nogil
+    cdef void _inverse_luminosity_distance_array(self, const double[::1] dl, double[::1] out) nogil
+    cdef double _evaluate_chi(self, int quantity, double z, double chi) nogil
+    cdef double _evaluate_native(self, int quantity, double z) nogil
+    cdef double _evaluate(self, int quantity, double z) nogil
+    cdef void _cumulative_integral(self, int quantity, const double[::1] z, const Py_ssize_t[::1] order, double[::1] out) nogil
+    cdef object _memo_get(self, object key)
+    cdef void _memo_set(self, object key, object value) except *
+    cdef object _memoized_cumulative_integral(self, int quantity, int power, object z, object out)
+    cdef void _evaluate_array(self, int quantity, const double[::1] z, double[::1] out) nogil
+    cdef object _array_call(self, int quantity, object z, object out)
+    cpdef double HubbleParameter(self,double z)
+    cpdef double LuminosityDistance(self, double z)
+    cpdef double ComovingDistance(self, double z)
+    cpdef double RedshiftFromLuminosityDistance(self, double dl)
+    cpdef double HubbleDistance(self)
+    cpdef double IntegrateComovingVolumeDensity(self, double zmax)
+    cpdef double IntegrateComovingVolume(self, double zmax)
+    cpdef double UniformComovingVolumeDensity(self, double z)
+    cpdef double UniformComovingVolumeDistribution(self, double z, double zmax)
+    cpdef double ComovingVolumeElement(self,double z)
+    cpdef double ComovingVolume(self,double z)
+    cpdef void DestroyCosmologicalParameters(self)
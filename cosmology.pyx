@@ -1,135 +1,1051 @@
 from __future__ import division
 import numpy as np
 cimport numpy as np
-from libc.math cimport log,exp,sqrt,cos,fabs,sin,sinh
+from libc.math cimport log,exp,pow,sqrt,cos,cosh,fabs,sin,sinh,ceil,M_PI,INFINITY
 cimport cython
+from collections import OrderedDict
+import os
+import hashlib
+import tempfile
+from threading import Lock, local
 
-cdef extern from "lal/LALCosmologyCalculator.h" nogil:
-    ctypedef struct LALCosmologicalParameters:
-        double h;
-        double om;
-        double ol;
-        double ok;
-        double w0;
-        double w1;
-        double w2;
-    
-    cdef double XLALLuminosityDistance(
-            LALCosmologicalParameters *omega, 
-            double z)
-
-    cdef double XLALAngularDistance(
-            LALCosmologicalParameters *omega, 
-            double z)
-
-    cdef double XLALComovingLOSDistance(
-            LALCosmologicalParameters *omega, 
-            double z)
-
-    cdef double XLALComovingTransverseDistance(
-            LALCosmologicalParameters *omega, 
-            double z)
-
-    cdef double XLALHubbleDistance(
-            LALCosmologicalParameters *omega
-            )
+# integration backends, see cosmology.pxd
+backends = {'lal':BACKEND_LAL, 'native':BACKEND_NATIVE}
 
-    cdef double XLALHubbleParameter(double z,
-            void *omega
-            )
+# accuracy tiers of the native backend: Gauss-Legendre order and
+# maximum width in redshift of each panel of the composite rule.
+# Worst case relative errors on the comoving distance for z in [0, 10],
+# over the corners of om in [0.04, 0.5], ol in [0, 1], w0 in [-3, 0.3], w1 in [-3, 3]:
+# low ~2e-4, medium ~1e-8 (same as the LAL integrators), high ~1e-14
+accuracy_tiers = {'low':0, 'medium':1, 'high':2}
+cdef int[3] TIER_ORDER = [6, 8, 16]
+cdef double[3] TIER_PANEL = [1.0, 0.5, 0.5]
+_tier_nodes   = np.zeros((3, 16), dtype=np.float64)
+_tier_weights = np.zeros((3, 16), dtype=np.float64)
+for _tier in range(3):
+    _tier_nodes[_tier, :TIER_ORDER[_tier]], _tier_weights[_tier, :TIER_ORDER[_tier]] = np.polynomial.legendre.leggauss(TIER_ORDER[_tier])
+cdef double[:, ::1] tier_nodes   = _tier_nodes
+cdef double[:, ::1] tier_weights = _tier_weights
 
-    cdef double XLALIntegrateHubbleParameter(LALCosmologicalParameters *omega, double z)
+@cython.cdivision(True)
+cdef inline double native_inverse_hubble(LALCosmologicalParameters *omega, double z) nogil:
+    """
+    1/E(z) for the w0-w1 (CPL) dark energy equation of state w(z) = w0+w1*z/(1+z),
+    same parametrisation as XLALHubbleParameter
+    """
+    cdef double x  = 1.0+z
+    cdef double de = omega.ol
+    if omega.w0 != -1.0 or omega.w1 != 0.0:
+        de *= pow(x, 3.0*(1.0+omega.w0+omega.w1))*exp(-3.0*omega.w1*z/x)
+    return 1.0/sqrt(x*x*(omega.om*x+omega.ok)+de)
 
-    cdef double XLALUniformComovingVolumeDistribution(
-            LALCosmologicalParameters *omega, 
-            double z,
-            double zmax)
+@cython.cdivision(True)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef double native_integrate_inverse_hubble(LALCosmologicalParameters *omega, double a, double b, int accuracy) nogil:
+    """
+    integral of 1/E(z) between a and b with the composite
+    Gauss-Legendre rule of the requested accuracy tier
+    """
+    cdef int j, k
+    cdef int order   = TIER_ORDER[accuracy]
+    cdef int npanels = <int>ceil((b-a)/TIER_PANEL[accuracy])
+    cdef double step, half, mid, res = 0.0
+    if npanels < 1:
+        return 0.0
+    step = (b-a)/npanels
+    half = 0.5*step
+    for j in range(npanels):
+        mid = a+(j+0.5)*step
+        for k in range(order):
+            res += tier_weights[accuracy, k]*native_inverse_hubble(omega, mid+half*tier_nodes[accuracy, k])
+    return half*res
 
-    cdef double XLALUniformComovingVolumeDensity(
-            double z,
-            void *omega)
+@cython.cdivision(True)
+cdef inline void native_hubble_squared_gradient(LALCosmologicalParameters *omega, double z, double *dE2) nogil:
+    """
+    derivatives of E(z)^2 = om (1+z)^3+ok (1+z)^2+ol f_DE(z), with ok = 1-om-ol,
+    with respect to z and the parameters (D_Z ... D_W1 components of dE2, D_H is zero)
+    """
+    cdef double x  = 1.0+z
+    cdef double de = 1.0
+    if omega.w0 != -1.0 or omega.w1 != 0.0:
+        de = pow(x, 3.0*(1.0+omega.w0+omega.w1))*exp(-3.0*omega.w1*z/x)
+    dE2[D_Z]  = 3.0*omega.om*x*x+2.0*omega.ok*x+omega.ol*de*3.0*((1.0+omega.w0+omega.w1)/x-omega.w1/(x*x))
+    dE2[D_H]  = 0.0
+    dE2[D_OM] = x*x*x-x*x
+    dE2[D_OL] = de-x*x
+    dE2[D_W0] = omega.ol*de*3.0*log(x)
+    dE2[D_W1] = omega.ol*de*3.0*(log(x)-z/x)
 
-    cdef double XLALIntegrateComovingVolumeDensity(LALCosmologicalParameters *omega, double z)
+@cython.cdivision(True)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void native_integrate_inverse_hubble_gradient(LALCosmologicalParameters *omega, double a, double b, int accuracy, double *dchi) nogil:
+    """
+    add to dchi the derivatives of the integral of 1/E(z) between a and b with respect
+    to the shape parameters, -1/2 int E^-3 dE^2/dtheta dz (D_OM ... D_W1 components),
+    with the composite Gauss-Legendre rule of the requested accuracy tier
+    """
+    cdef int i, j, k
+    cdef int order   = TIER_ORDER[accuracy]
+    cdef int npanels = <int>ceil((b-a)/TIER_PANEL[accuracy])
+    cdef double step, half, zk, inverse_hubble, w
+    cdef double dE2[NGRADIENT]
+    if npanels < 1:
+        return
+    step = (b-a)/npanels
+    half = 0.5*step
+    for j in range(npanels):
+        for k in range(order):
+            zk = a+(j+0.5)*step+half*tier_nodes[accuracy, k]
+            inverse_hubble = native_inverse_hubble(omega, zk)
+            native_hubble_squared_gradient(omega, zk, dE2)
+            w  = -0.5*half*tier_weights[accuracy, k]*inverse_hubble*inverse_hubble*inverse_hubble
+            for i in range(D_OM, NGRADIENT):
+                dchi[i] += w*dE2[i]
 
-    cdef double XLALIntegrateComovingVolume(LALCosmologicalParameters *omega, double z)
+cdef tuple _tabulate_chi(LALCosmologicalParameters *omega, double zmax, int npoints, int backend = BACKEND_LAL, int accuracy = 1):
+    """
+    dimensionless comoving distance chi(z) = Dc(z)/dH and its derivative 1/E(z)
+    on a uniform grid of npoints redshifts in [0, zmax]. Neither depends on h.
+    The native backend accumulates the integral cell by cell.
+    """
+    cdef int i
+    cdef double z
+    cdef double dz = zmax/(npoints-1)
+    cdef np.ndarray[double, ndim=1] chi  = np.empty(npoints, dtype=np.float64)
+    cdef np.ndarray[double, ndim=1] dchi = np.empty(npoints, dtype=np.float64)
+    if backend == BACKEND_NATIVE:
+        chi[0]  = 0.0
+        dchi[0] = native_inverse_hubble(omega, 0.0)
+        for i in range(1, npoints):
+            z       = i*dz
+            chi[i]  = chi[i-1]+native_integrate_inverse_hubble(omega, z-dz, z, accuracy)
+            dchi[i] = native_inverse_hubble(omega, z)
+        return chi, dchi
+    for i in range(npoints):
+        z       = i*dz
+        chi[i]  = XLALIntegrateHubbleParameter(omega, z)
+        dchi[i] = XLALHubbleParameter(z, omega)
+    return chi, dchi
 
-    cdef double XLALComovingVolumeElement(double z, void *omega)
+# Gauss-Legendre rule on [-1, 1] used for the cumulative redshift integrals
+cdef int GL_ORDER = 8
+cdef double GL_MAX_STEP = 0.1
+_gl_nodes, _gl_weights = np.polynomial.legendre.leggauss(GL_ORDER)
+cdef double[::1] gl_nodes   = _gl_nodes
+cdef double[::1] gl_weights = _gl_weights
 
-    cdef double XLALComovingVolume(LALCosmologicalParameters *omega, double z)
+# largest number of results memoized by a CosmologicalParameters for its current shape
+cdef int MEMO_SIZE = 64
 
-    cdef LALCosmologicalParameters *XLALCreateCosmologicalParameters(double h, double om, double ol, double w0, double w1, double w2)
+class DistanceCache(object):
+    """
+    LRU cache of the dimensionless distance tables used by
+    CosmologicalParameters.Tabulate.
+    Distances scale exactly as 1/h, so the tables are keyed only on the
+    shape parameters (om, ol, w0, w1) and on the redshift grid, and are shared
+    by every h. If tolerance > 0 the shape parameters are snapped to a grid
+    of that spacing, so that cosmologies closer than the tolerance share a
+    table computed at the snapped point. The distances are then piecewise
+    constant in the shape parameters, with jumps at the snapping boundaries,
+    so a tolerance > 0 must not be used where derivatives are needed.
+    If store is a directory, tables missing from memory are looked up there
+    before being computed, and the computed ones are written there. The files
+    are named after a hash of the key, are never modified once written and are
+    memory-mapped read-only, so concurrent jobs on a node share them through the
+    page cache. Each file is written to a temporary name and renamed into
+    place, hence a reader never sees a partial table and jobs racing to
+    create the same table simply produce the same file twice.
+    Parameters:
+    ===============
+    maxsize: :obj:'int': maximum number of tables kept in memory
+    tolerance: :obj:'numpy.double': resolution in the shape parameters. default = 0, exact keys
+    store: :obj:'str': directory of the persistent table store. default = None, memory only
+    """
+    def __init__(self, maxsize = 128, tolerance = 0.0, store = None):
+        self.maxsize    = maxsize
+        self.tolerance  = tolerance
+        self.store      = store
+        self.hits       = 0
+        self.misses     = 0
+        self.store_hits = 0
+        self._tables    = OrderedDict()
+        self._lock      = Lock()
+        if store is not None:
+            os.makedirs(store, exist_ok = True)
 
-    cdef void XLALDestroyCosmologicalParameters(LALCosmologicalParameters *omega)
+    def __reduce__(self):
+        """
+        pickle support: the copy starts empty, with its own lock, and finds
+        the tables already computed in the store, if any
+        """
+        return (DistanceCache, (self.maxsize, self.tolerance, self.store))
 
-    cdef double XLALGetHubbleConstant(LALCosmologicalParameters *omega)
+    def __len__(self):
+        return len(self._tables)
 
-    cdef double XLALGetOmegaMatter(LALCosmologicalParameters *omega)
+    def snap(self, om, ol, w0, w1):
+        if self.tolerance > 0.0:
+            return tuple(self.tolerance*np.round(p/self.tolerance) for p in (om, ol, w0, w1))
+        return (om, ol, w0, w1)
 
-    cdef double XLALGetOmegaLambda(LALCosmologicalParameters *omega)
+    def path(self, key):
+        """
+        file of the persistent store holding the tables of key. The hash
+        is taken over the exact binary value of every float in the key
+        """
+        name = hashlib.sha1(repr(tuple(float(k).hex() for k in key)).encode()).hexdigest()
+        return os.path.join(self.store, name+'.npy')
 
-    cdef double XLALGetOmegaK(LALCosmologicalParameters *omega)
+    def _load(self, key):
+        try:
+            tables = np.load(self.path(key), mmap_mode = 'r')
+        except (IOError, ValueError):
+            return None
+        return tables[0], tables[1]
 
-    cdef double XLALGetW0(LALCosmologicalParameters *omega)
+    def _save(self, key, tables):
+        fd, tmp = tempfile.mkstemp(dir = self.store, suffix = '.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, np.vstack(tables))
+            os.replace(tmp, self.path(key))
+        except OSError:
+            # a full or read-only store only costs the recomputation
+            if os.path.exists(tmp): os.remove(tmp)
 
-    cdef double XLALGetW1(LALCosmologicalParameters *omega)
+    def get(self, om, ol, w0, w1, zmax, npoints, backend = BACKEND_LAL, accuracy = 1):
+        """
+        return the (chi, 1/E) tables for the given shape, grid and
+        integration backend, computing and storing them if needed
+        """
+        cdef LALCosmologicalParameters *omega
+        shape = self.snap(om, ol, w0, w1)
+        key   = shape+(zmax, npoints, backend, accuracy)
+        with self._lock:
+            tables = self._tables.pop(key, None)
+            if tables is not None:
+                self.hits += 1
+                self._tables[key] = tables
+                return tables
+        tables = self._load(key) if self.store is not None else None
+        if tables is None:
+            omega  = XLALCreateCosmologicalParameters(1.0, shape[0], shape[1], shape[2], shape[3], 0.0)
+            tables = _tabulate_chi(omega, zmax, npoints, backend, accuracy)
+            XLALDestroyCosmologicalParameters(omega)
+            for t in tables: t.setflags(write = False)
+            if self.store is not None:
+                self._save(key, tables)
+        else:
+            self.store_hits += 1
+        with self._lock:
+            self.misses += 1
+            self._tables[key] = tables
+            while len(self._tables) > self.maxsize:
+                self._tables.popitem(last = False)
+        return tables
 
-    cdef double XLALGetW2(LALCosmologicalParameters *omega)
+    def clear(self):
+        with self._lock:
+            self._tables.clear()
 
+# fixed layout record describing one cosmology, so that batches of
+# parameter sets can be stored and shipped to worker processes as a single buffer
+cosmology_dtype = np.dtype([('h',np.float64),('om',np.float64),('ol',np.float64),('w0',np.float64),('w1',np.float64)])
 
 cdef class CosmologicalParameters:
-    cdef LALCosmologicalParameters* __LALCosmologicalParameters
-    cdef public double h
-    cdef public double om
-    cdef public double ol
-    cdef public double w0
-    cdef public double w1
-    def __cinit__(self,double h, double om, double ol, double w0, double w1):
+    def __cinit__(self,double h, double om, double ol, double w0, double w1, object backend = 'lal', object accuracy = 'medium'):
+        """
+        backend: 'lal' (adaptive LAL integrators) or 'native' (fixed order
+                 Gauss-Legendre quadrature). default = 'lal'
+        accuracy: accuracy tier of the native backend, 'low', 'medium' or 'high'. default = 'medium'
+        """
+        if backend not in backends:
+            raise ValueError("unknown backend %s, supported: %s"%(backend, ', '.join(backends)))
+        if accuracy not in accuracy_tiers:
+            raise ValueError("unknown accuracy %s, supported: %s"%(accuracy, ', '.join(accuracy_tiers)))
+        self._backend  = backends[backend]
+        self._accuracy = accuracy_tiers[accuracy]
         self.h = h
         self.om = om
         self.ol = ol
         self.w0 = w0
         self.w1 = w1
         self.__LALCosmologicalParameters = XLALCreateCosmologicalParameters(self.h,self.om,self.ol,self.w0,self.w1,0.0)
+        self._tabulated = 0
+        self._memo      = OrderedDict()
     
-    cpdef void SetH(self, double h):
+    def __reduce__(self):
+        """
+        pickle support: the LAL structure is rebuilt from the parameters,
+        the distance tables (if any) travel with the object
+        """
+        state = None
+        if self._tabulated:
+            state = (self._table_zmax, self._table_npoints, np.asarray(self._table_chi), np.asarray(self._table_dchi))
+        return (CosmologicalParameters, (self.h, self.om, self.ol, self.w0, self.w1, self.backend, self.accuracy), state)
+
+    def __setstate__(self, state):
+        if state is not None:
+            self._table_zmax, self._table_npoints, self._table_chi, self._table_dchi = state
+            self._table_dz      = self._table_zmax/(self._table_npoints-1)
+            self._table_error   = -1.0
+            self._tabulated     = 1
+            self._memo.clear()
+
+    def ToRecord(self):
+        """
+        the parameters as a cosmology_dtype record
+        """
+        return np.array((self.h, self.om, self.ol, self.w0, self.w1), dtype=cosmology_dtype)[()]
+
+    cpdef void UpdateFromRecord(self, object record) except *:
+        self.Update(record['h'], record['om'], record['ol'], record['w0'], record['w1'])
+
+    def __dealloc__(self):
+        if self.__LALCosmologicalParameters != NULL:
+            XLALDestroyCosmologicalParameters(self.__LALCosmologicalParameters)
+            self.__LALCosmologicalParameters = NULL
+
+    cdef void _shape_changed(self) except *:
+        """
+        keep the curvature in sync and invalidate everything that
+        depends on (om, ol, w0, w1)
+        """
+        self.__LALCosmologicalParameters.ok = 1.0-self.om-self.ol
+        self._memo.clear()
+        if self._tabulated:
+            try:
+                self.Tabulate(self._table_zmax, self._table_npoints, self._table_cache)
+            except:
+                # never keep answering from the table of the previous shape
+                self.ClearTabulation()
+                raise
+
+    cpdef void SetH(self, double h) except *:
+        # chi(z) does not depend on h, the table stays valid
         self.h = h
         self.__LALCosmologicalParameters.h = h
     
-    cpdef void SetOM(self, double om):
+    cpdef void SetOM(self, double om) except *:
         self.om = om
         self.__LALCosmologicalParameters.om = om
+        self._shape_changed()
 
-    cpdef void SetOL(self, double ol):
+    cpdef void SetOL(self, double ol) except *:
         self.ol = ol
         self.__LALCosmologicalParameters.ol = ol
+        self._shape_changed()
 
-    cpdef double HubbleParameter(self,double z):
+    cpdef void SetW0(self, double w0) except *:
+        self.w0 = w0
+        self.__LALCosmologicalParameters.w0 = w0
+        self._shape_changed()
+
+    cpdef void SetW1(self, double w1) except *:
+        self.w1 = w1
+        self.__LALCosmologicalParameters.w1 = w1
+        self._shape_changed()
+
+    cpdef void Update(self, double h, double om, double ol, double w0, double w1) except *:
+        """
+        set all the parameters at once, reusing the underlying LAL structure.
+        The tables and memoized integrals are only recomputed if the shape
+        parameters (om, ol, w0, w1) actually changed.
+        """
+        self.SetH(h)
+        if om == self.om and ol == self.ol and w0 == self.w0 and w1 == self.w1:
+            return
+        self.om = om
+        self.ol = ol
+        self.w0 = w0
+        self.w1 = w1
+        self.__LALCosmologicalParameters.om = om
+        self.__LALCosmologicalParameters.ol = ol
+        self.__LALCosmologicalParameters.w0 = w0
+        self.__LALCosmologicalParameters.w1 = w1
+        self._shape_changed()
+
+    property tabulated:
+        def __get__(self):
+            return bool(self._tabulated)
+
+    property backend:
+        def __get__(self):
+            return 'native' if self._backend == BACKEND_NATIVE else 'lal'
+
+    property accuracy:
+        def __get__(self):
+            return [k for k, v in accuracy_tiers.items() if v == self._accuracy][0]
+
+    cpdef void Tabulate(self, double zmax = 10.0, int npoints = 1000, object cache = None) except *:
+        """
+        Switch to tabulated mode: compute the comoving distance on a uniform
+        grid of npoints redshifts in [0, zmax] once, and answer the distance
+        and volume element queries within the grid by cubic Hermite interpolation.
+        Queries outside the grid fall back to the LAL integrators.
+        If a DistanceCache is given, the tables are taken from it when a
+        cosmology with the same (om, ol, w0, w1) has already been tabulated.
+        """
+        if npoints < 2 or zmax <= 0.0:
+            raise ValueError("tabulation needs zmax > 0 and at least 2 points")
+        if cache is None:
+            tables = _tabulate_chi(self.__LALCosmologicalParameters, zmax, npoints, self._backend, self._accuracy)
+        else:
+            tables = cache.get(self.__LALCosmologicalParameters.om,
+                               self.__LALCosmologicalParameters.ol,
+                               self.__LALCosmologicalParameters.w0,
+                               self.__LALCosmologicalParameters.w1,
+                               zmax, npoints, self._backend, self._accuracy)
+        self._table_chi, self._table_dchi = tables
+        self._table_cache   = cache
+        self._table_npoints = npoints
+        self._table_dz      = zmax/(npoints-1)
+        self._table_zmax    = zmax
+        self._table_error   = -1.0
+        self._tabulated     = 1
+        # the memoized integrals were computed from the previous table or backend
+        self._memo.clear()
+
+    cpdef void ClearTabulation(self):
+        self._tabulated   = 0
+        self._table_chi   = None
+        self._table_dchi  = None
+        self._table_cache = None
+        self._memo.clear()
+
+    cpdef double TabulationError(self):
+        """
+        Maximum relative error of the tabulated luminosity distance, comoving distance
+        and comoving volume element with respect to the LAL integrators,
+        measured at the midpoints of the grid, where the interpolation error peaks.
+        """
+        if not self._tabulated:
+            return 0.0
+        if self._table_error >= 0.0:
+            return self._table_error
+        cdef int i
+        cdef double z, err = 0.0
+        for i in range(1, self._table_npoints):
+            z   = (i-0.5)*self._table_dz
+            err = max(err, fabs(self._evaluate(LUMINOSITY_DISTANCE, z)/XLALLuminosityDistance(self.__LALCosmologicalParameters, z)-1.0))
+            err = max(err, fabs(self._evaluate(COMOVING_DISTANCE, z)/XLALComovingLOSDistance(self.__LALCosmologicalParameters, z)-1.0))
+            err = max(err, fabs(self._evaluate(COMOVING_VOLUME_ELEMENT, z)/XLALComovingVolumeElement(z, self.__LALCosmologicalParameters)-1.0))
+        self._table_error = err
+        return err
+
+    @cython.cdivision(True)
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cdef double _interpolate_chi(self, double z) nogil:
+        """
+        cubic Hermite interpolation of chi(z), using the exact derivative 1/E(z)
+        """
+        cdef int i = <int>(z/self._table_dz)
+        if i >= self._table_npoints-1: i = self._table_npoints-2
+        cdef double t  = z/self._table_dz-i
+        cdef double t2 = t*t
+        cdef double t3 = t2*t
+        return ((2.0*t3-3.0*t2+1.0)*self._table_chi[i]
+                +(t3-2.0*t2+t)*self._table_dz*self._table_dchi[i]
+                +(3.0*t2-2.0*t3)*self._table_chi[i+1]
+                +(t3-t2)*self._table_dz*self._table_dchi[i+1])
+
+    @cython.cdivision(True)
+    cdef double _transverse(self, double chi) nogil:
+        """
+        dimensionless transverse comoving distance from chi, same curvature
+        conventions as XLALComovingTransverseDistance
+        """
+        cdef double ok = self.__LALCosmologicalParameters.ok
+        cdef double sqrtok
+        if fabs(ok) < 1e-14:
+            return chi
+        sqrtok = sqrt(fabs(ok))
+        if ok > 0.0:
+            return sinh(sqrtok*chi)/sqrtok
+        return sin(sqrtok*chi)/sqrtok
+
+    @cython.cdivision(True)
+    cdef double _transverse_derivative(self, double chi) nogil:
+        """
+        derivative of the dimensionless transverse comoving distance with respect to chi
+        """
+        cdef double ok = self.__LALCosmologicalParameters.ok
+        cdef double sqrtok
+        if fabs(ok) < 1e-14:
+            return 1.0
+        sqrtok = sqrt(fabs(ok))
+        if ok > 0.0:
+            return cosh(sqrtok*chi)
+        return cos(sqrtok*chi)
+
+    @cython.cdivision(True)
+    cdef double _transverse_curvature_derivative(self, double chi) nogil:
+        """
+        derivative of the dimensionless transverse comoving distance with respect to ok at fixed chi,
+        (chi T'(chi)-T(chi))/(2 ok), from its series close to flatness
+        """
+        cdef double ok = self.__LALCosmologicalParameters.ok
+        cdef double chi2 = chi*chi
+        if fabs(ok)*chi2 < 1e-3:
+            return chi*chi2*(1.0/6.0+ok*chi2*(1.0/60.0+ok*chi2/1680.0))
+        return (chi*self._transverse_derivative(chi)-self._transverse(chi))/(2.0*ok)
+
+    @cython.cdivision(True)
+    cdef void _log_distance_gradient(self, double z, double *dlog_dl, double *dlog_density) nogil:
+        """
+        gradients of the log luminosity distance and of the log uniform in comoving volume
+        density log(dVc/dz/(1+z)) at z, with respect to z and the parameters
+        (D_Z ... D_W1 components). The derivatives of chi with respect to the shape
+        parameters are integrated with the native rule of the accuracy tier, whatever the backend
+        """
+        cdef LALCosmologicalParameters *omega = self.__LALCosmologicalParameters
+        cdef int i
+        cdef double chi = self._chi(z)
+        cdef double dm  = self._transverse(chi)
+        cdef double ddm = self._transverse_derivative(chi)
+        cdef double dok = self._transverse_curvature_derivative(chi)
+        cdef double inverse_hubble = native_inverse_hubble(omega, z)
+        cdef double dchi[NGRADIENT]
+        cdef double dE2[NGRADIENT]
+        cdef double dlog_dm
+        for i in range(NGRADIENT): dchi[i] = 0.0
+        native_integrate_inverse_hubble_gradient(omega, 0.0, z, self._accuracy, dchi)
+        native_hubble_squared_gradient(omega, z, dE2)
+        dlog_dl[D_Z]      = 1.0/(1.0+z)+ddm*inverse_hubble/dm
+        dlog_density[D_Z] = 2.0*ddm*inverse_hubble/dm-0.5*dE2[D_Z]*inverse_hubble*inverse_hubble-1.0/(1.0+z)
+        # dH scales as 1/h
+        dlog_dl[D_H]      = -1.0/self.h
+        dlog_density[D_H] = -3.0/self.h
+        for i in range(D_OM, NGRADIENT):
+            dlog_dm = ddm*dchi[i]
+            # ok = 1-om-ol
+            if i == D_OM or i == D_OL: dlog_dm -= dok
+            dlog_dm /= dm
+            dlog_dl[i]      = dlog_dm
+            dlog_density[i] = 2.0*dlog_dm-0.5*dE2[i]*inverse_hubble*inverse_hubble
+
+    @cython.cdivision(True)
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cdef void _log_norm_gradient(self, double zmax, double *dlog_norm) nogil:
+        """
+        gradient of the log normalisation of the redshift prior, log int_0^zmax dVc/dz/(1+z) dz,
+        with respect to the parameters; dlog_norm[D_Z] is its derivative with respect to zmax.
+        Same composite rule as _evaluate_native, carrying chi and its derivatives from panel to panel
+        """
+        cdef LALCosmologicalParameters *omega = self.__LALCosmologicalParameters
+        cdef int i, j, k
+        cdef int order   = TIER_ORDER[self._accuracy]
+        cdef int npanels = <int>ceil(zmax/TIER_PANEL[self._accuracy])
+        cdef double step, half, a, zk, chi, chi_k, dm, ddm, dok, inverse_hubble, density, norm = 0.0
+        cdef double dchi[NGRADIENT]
+        cdef double dchi_k[NGRADIENT]
+        cdef double dE2[NGRADIENT]
+        for i in range(NGRADIENT):
+            dchi[i]      = 0.0
+            dlog_norm[i] = 0.0
+        if npanels < 1:
+            return
+        step = zmax/npanels
+        half = 0.5*step
+        chi  = 0.0
+        for j in range(npanels):
+            a = j*step
+            for k in range(order):
+                zk    = a+half+half*tier_nodes[self._accuracy, k]
+                chi_k = chi+native_integrate_inverse_hubble(omega, a, zk, self._accuracy)
+                for i in range(NGRADIENT): dchi_k[i] = dchi[i]
+                native_integrate_inverse_hubble_gradient(omega, a, zk, self._accuracy, dchi_k)
+                native_hubble_squared_gradient(omega, zk, dE2)
+                dm  = self._transverse(chi_k)
+                ddm = self._transverse_derivative(chi_k)
+                dok = self._transverse_curvature_derivative(chi_k)
+                inverse_hubble = native_inverse_hubble(omega, zk)
+                # dVc/dz/(1+z) in units of 4 pi dH^3, and its derivatives
+                density = tier_weights[self._accuracy, k]*dm*dm*inverse_hubble/(1.0+zk)
+                norm   += density
+                for i in range(D_OM, NGRADIENT):
+                    dlog_norm[i] += density*(2.0*(ddm*dchi_k[i]-(dok if i == D_OM or i == D_OL else 0.0))/dm
+                                             -0.5*dE2[i]*inverse_hubble*inverse_hubble)
+            chi += native_integrate_inverse_hubble(omega, a, a+step, self._accuracy)
+            native_integrate_inverse_hubble_gradient(omega, a, a+step, self._accuracy, dchi)
+        for i in range(D_OM, NGRADIENT):
+            dlog_norm[i] /= norm
+        dm = self._transverse(chi)
+        dlog_norm[D_Z] = dm*dm*native_inverse_hubble(omega, zmax)/(1.0+zmax)/(half*norm)
+        dlog_norm[D_H] = -3.0/self.h
+
+    cdef double _inverse_hubble(self, double z) nogil:
+        """
+        1/E(z) from the selected backend
+        """
+        if self._backend == BACKEND_NATIVE:
+            return native_inverse_hubble(self.__LALCosmologicalParameters, z)
         return XLALHubbleParameter(z, self.__LALCosmologicalParameters)
 
+    cdef double _chi(self, double z) nogil:
+        """
+        dimensionless comoving distance Dc(z)/dH from the table,
+        if available, or from the selected backend
+        """
+        if self._tabulated and 0.0 <= z <= self._table_zmax:
+            return self._interpolate_chi(z)
+        if self._backend == BACKEND_NATIVE:
+            return native_integrate_inverse_hubble(self.__LALCosmologicalParameters, 0.0, z, self._accuracy)
+        return XLALIntegrateHubbleParameter(self.__LALCosmologicalParameters, z)
+
+    @cython.cdivision(True)
+    cdef double _luminosity_distance_derivative(self, double z) nogil:
+        """
+        dDl/dz = dH*(dm+(1+z)*ddm/dchi/E(z))
+        """
+        cdef double dH = XLALHubbleDistance(self.__LALCosmologicalParameters)
+        cdef double chi = self._chi(z)
+        return dH*(self._transverse(chi)+(1.0+z)*self._transverse_derivative(chi)*self._inverse_hubble(z))
+
+    @cython.cdivision(True)
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cdef double _inverse_luminosity_distance(self, double dl) nogil:
+        """
+        redshift at which the luminosity distance equals dl.
+        In tabulated mode the root is first bracketed by bisection over
+        the grid nodes, otherwise it is bracketed in [0, inf).
+        The root is then polished by Newton iterations, falling
+        back to bisection whenever a step leaves the bracket.
+        """
+        cdef int lo, hi, mid, k
+        cdef double a = 0.0, b = INFINITY, z, f, df, step
+        cdef double dH = XLALHubbleDistance(self.__LALCosmologicalParameters)
+        if dl <= 0.0:
+            return 0.0
+        if self._tabulated and dl <= dH*(1.0+self._table_zmax)*self._transverse(self._table_chi[self._table_npoints-1]):
+            lo = 0
+            hi = self._table_npoints-1
+            while hi-lo > 1:
+                mid = (lo+hi)//2
+                if dH*(1.0+mid*self._table_dz)*self._transverse(self._table_chi[mid]) < dl: lo = mid
+                else: hi = mid
+            a = lo*self._table_dz
+            b = hi*self._table_dz
+            z = 0.5*(a+b)
+        else:
+            # low redshift Hubble law as starting point
+            z = dl/dH
+        for k in range(100):
+            f  = self._evaluate(LUMINOSITY_DISTANCE, z)-dl
+            if f < 0.0: a = z
+            else: b = z
+            df   = self._luminosity_distance_derivative(z)
+            step = f/df
+            if z-step <= a or z-step >= b:
+                if b == INFINITY: step = -z
+                else: step = z-0.5*(a+b)
+            z -= step
+            if fabs(step) < 1e-12*(1.0+z):
+                break
+        return z
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cdef void _inverse_luminosity_distance_array(self, const double[::1] dl, double[::1] out) nogil:
+        cdef Py_ssize_t i
+        for i in range(dl.shape[0]):
+            out[i] = self._inverse_luminosity_distance(dl[i])
+
+    @cython.cdivision(True)
+    cdef double _evaluate_chi(self, int quantity, double z, double chi) nogil:
+        """
+        the distances and the volume element at z, given chi(z)
+        """
+        cdef double dH = XLALHubbleDistance(self.__LALCosmologicalParameters)
+        cdef double dm
+        if quantity == COMOVING_DISTANCE:
+            return dH*chi
+        dm = self._transverse(chi)
+        if quantity == LUMINOSITY_DISTANCE:
+            return dH*(1.0+z)*dm
+        # dVc/dz = 4 pi dH^3 dm^2 / E(z)
+        if quantity == COMOVING_VOLUME_ELEMENT:
+            return 4.0*M_PI*dH*dH*dH*dm*dm*self._inverse_hubble(z)
+        return 4.0*M_PI*dH*dH*dH*dm*dm*self._inverse_hubble(z)/(1.0+z)
+
+    @cython.cdivision(True)
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cdef double _evaluate_native(self, int quantity, double z) nogil:
+        cdef LALCosmologicalParameters *omega = self.__LALCosmologicalParameters
+        cdef double dH = XLALHubbleDistance(omega)
+        cdef double ok = omega.ok
+        cdef double chi, dm, sqrtok, zk, step, half, mid, a, acc
+        cdef int j, k, npanels
+        cdef int order = TIER_ORDER[self._accuracy]
+        if quantity == HUBBLE_PARAMETER:
+            return native_inverse_hubble(omega, z)
+        if quantity == COMOVING_VOLUME or quantity == INTEGRATE_COMOVING_VOLUME:
+            # closed form of Hogg (1999) eq. 29, written in terms of chi so that
+            # it stays valid beyond the equator of a closed universe
+            chi = native_integrate_inverse_hubble(omega, 0.0, z, self._accuracy)
+            if fabs(ok) < 1e-14:
+                return 4.0*M_PI*dH*dH*dH*chi*chi*chi/3.0
+            sqrtok = sqrt(fabs(ok))
+            if ok > 0.0:
+                return 2.0*M_PI*dH*dH*dH*(0.5*sinh(2.0*sqrtok*chi)/sqrtok-chi)/ok
+            return 2.0*M_PI*dH*dH*dH*(chi-0.5*sin(2.0*sqrtok*chi)/sqrtok)/fabs(ok)
+        if quantity == INTEGRATE_COMOVING_VOLUME_DENSITY:
+            # composite rule over [0, z], carrying chi from one panel to the next
+            npanels = <int>ceil(z/TIER_PANEL[self._accuracy])
+            if npanels < 1:
+                return 0.0
+            step = z/npanels
+            half = 0.5*step
+            chi  = 0.0
+            acc  = 0.0
+            for j in range(npanels):
+                a   = j*step
+                mid = a+half
+                for k in range(order):
+                    zk   = mid+half*tier_nodes[self._accuracy, k]
+                    dm   = self._transverse(chi+native_integrate_inverse_hubble(omega, a, zk, self._accuracy))
+                    acc += tier_weights[self._accuracy, k]*dm*dm*native_inverse_hubble(omega, zk)/(1.0+zk)
+                chi += native_integrate_inverse_hubble(omega, a, a+step, self._accuracy)
+            return 4.0*M_PI*dH*dH*dH*half*acc
+        return self._evaluate_chi(quantity, z, native_integrate_inverse_hubble(omega, 0.0, z, self._accuracy))
+
+    @cython.cdivision(True)
+    cdef double _evaluate(self, int quantity, double z) nogil:
+        """
+        Evaluate the requested quantity at redshift z.
+        Single entry point for the scalar and the array interfaces.
+        """
+        if self._tabulated and 0.0 <= z <= self._table_zmax:
+            if (quantity == LUMINOSITY_DISTANCE or quantity == COMOVING_DISTANCE
+                or quantity == COMOVING_VOLUME_ELEMENT or quantity == UNIFORM_COMOVING_VOLUME_DENSITY):
+                return self._evaluate_chi(quantity, z, self._interpolate_chi(z))
+        if self._backend == BACKEND_NATIVE:
+            return self._evaluate_native(quantity, z)
+        if quantity == HUBBLE_PARAMETER:
+            return XLALHubbleParameter(z, self.__LALCosmologicalParameters)
+        elif quantity == LUMINOSITY_DISTANCE:
+            return XLALLuminosityDistance(self.__LALCosmologicalParameters, z)
+        elif quantity == COMOVING_VOLUME_ELEMENT:
+            return XLALComovingVolumeElement(z, self.__LALCosmologicalParameters)
+        elif quantity == UNIFORM_COMOVING_VOLUME_DENSITY:
+            return XLALUniformComovingVolumeDensity(z, self.__LALCosmologicalParameters)
+        elif quantity == COMOVING_VOLUME:
+            return XLALComovingVolume(self.__LALCosmologicalParameters, z)
+        elif quantity == INTEGRATE_COMOVING_VOLUME:
+            return XLALIntegrateComovingVolume(self.__LALCosmologicalParameters, z)
+        elif quantity == INTEGRATE_COMOVING_VOLUME_DENSITY:
+            return XLALIntegrateComovingVolumeDensity(self.__LALCosmologicalParameters, z)
+        elif quantity == COMOVING_DISTANCE:
+            return XLALComovingLOSDistance(self.__LALCosmologicalParameters, z)
+        return 0.0
+
+    @cython.cdivision(True)
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cdef void _cumulative_integral(self, int quantity, const double[::1] z, const Py_ssize_t[::1] order, double[::1] out) nogil:
+        """
+        integral of quantity from 0 to z[i] for every i. The upper limits are
+        visited in increasing order, so the whole set costs a single
+        integral from 0 to max(z), split into Gauss-Legendre steps of at most GL_MAX_STEP.
+        """
+        cdef Py_ssize_t i, k
+        cdef int j, nsteps
+        cdef double a = 0.0, b, step, mid, half, acc = 0.0
+        for i in range(order.shape[0]):
+            b = z[order[i]]
+            if b > a:
+                nsteps = <int>((b-a)/GL_MAX_STEP)+1
+                step   = (b-a)/nsteps
+                half   = 0.5*step
+                for j in range(nsteps):
+                    mid = a+(j+0.5)*step
+                    for k in range(GL_ORDER):
+                        acc += half*gl_weights[k]*self._evaluate(quantity, mid+half*gl_nodes[k])
+                a = b
+            out[order[i]] = acc
+
+    cdef object _memo_get(self, object key):
+        """
+        memoized value of key for the current shape parameters, None if there is none
+        """
+        value = self._memo.pop(key, None)
+        if value is not None:
+            self._memo[key] = value
+        return value
+
+    cdef void _memo_set(self, object key, object value) except *:
+        self._memo[key] = value
+        while len(self._memo) > MEMO_SIZE:
+            self._memo.popitem(last = False)
+
+    cdef object _memoized_cumulative_integral(self, int quantity, int power, object z, object out):
+        """
+        cumulative integrals of a quantity scaling as dH**power, memoized
+        in units of dH**power for the current shape parameters and upper limits z
+        """
+        z = np.ascontiguousarray(z, dtype=np.float64)
+        if out is None:
+            out = np.empty(z.shape, dtype=np.float64)
+        elif not isinstance(out, np.ndarray) or out.dtype != np.float64 or not out.flags['C_CONTIGUOUS'] or out.shape != z.shape:
+            raise ValueError("out must be a C-contiguous float64 array with the same shape as z")
+        cdef double scale = XLALHubbleDistance(self.__LALCosmologicalParameters)**power
+        cdef const double[::1] zv
+        cdef const Py_ssize_t[::1] order
+        cdef double[::1] vv
+        key = (quantity, z.tobytes())
+        values = self._memo_get(key)
+        if values is None:
+            values = np.empty(z.size, dtype=np.float64)
+            zv     = z.reshape(-1)
+            order  = np.argsort(z, axis=None).astype(np.intp)
+            vv     = values
+            with nogil:
+                self._cumulative_integral(quantity, zv, order, vv)
+            values /= scale
+            self._memo_set(key, values)
+        np.multiply(values.reshape(z.shape), scale, out=out)
+        return out
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cdef void _evaluate_array(self, int quantity, const double[::1] z, double[::1] out) nogil:
+        cdef Py_ssize_t i
+        for i in range(z.shape[0]):
+            out[i] = self._evaluate(quantity, z[i])
+
+    cdef object _array_call(self, int quantity, object z, object out):
+        """
+        Wrap the nogil loop for python callers: accepts any array-like
+        (numpy array, typed memoryview, list) and writes into out if given,
+        otherwise into a freshly allocated array with the shape of z.
+        """
+        z = np.ascontiguousarray(z, dtype=np.float64)
+        if out is None:
+            out = np.empty(z.shape, dtype=np.float64)
+        elif not isinstance(out, np.ndarray) or out.dtype != np.float64 or not out.flags['C_CONTIGUOUS'] or out.shape != z.shape:
+            raise ValueError("out must be a C-contiguous float64 array with the same shape as z")
+        cdef const double[::1] zv = z.reshape(-1)
+        cdef double[::1] ov = out.reshape(-1)
+        with nogil:
+            self._evaluate_array(quantity, zv, ov)
+        return out
+
+    cpdef double HubbleParameter(self,double z):
+        return self._evaluate(HUBBLE_PARAMETER, z)
+
     cpdef double LuminosityDistance(self, double z):
-        return XLALLuminosityDistance(self.__LALCosmologicalParameters,z)
+        return self._evaluate(LUMINOSITY_DISTANCE, z)
+
+    cpdef double ComovingDistance(self, double z):
+        return self._evaluate(COMOVING_DISTANCE, z)
+
+    cpdef double RedshiftFromLuminosityDistance(self, double dl):
+        """
+        inverse of LuminosityDistance
+        """
+        return self._inverse_luminosity_distance(dl)
+
+    def LogDistanceGradient(self, double z):
+        """
+        gradients of log LuminosityDistance(z) and log UniformComovingVolumeDensity(z)
+        with respect to (z, h, om, ol, w0, w1), as two numpy arrays
+        """
+        dlog_dl      = np.empty(NGRADIENT, dtype=np.float64)
+        dlog_density = np.empty(NGRADIENT, dtype=np.float64)
+        cdef double[::1] a = dlog_dl
+        cdef double[::1] b = dlog_density
+        self._log_distance_gradient(z, &a[0], &b[0])
+        return dlog_dl, dlog_density
+
+    def LogNormalisationGradient(self, double zmax):
+        """
+        gradient of log IntegrateComovingVolumeDensity(zmax) with respect to (zmax, h, om, ol, w0, w1)
+        """
+        dlog_norm = np.empty(NGRADIENT, dtype=np.float64)
+        cdef double[::1] a = dlog_norm
+        self._log_norm_gradient(zmax, &a[0])
+        return dlog_norm
 
     cpdef double HubbleDistance(self):
         return XLALHubbleDistance(self.__LALCosmologicalParameters)
 
     cpdef double IntegrateComovingVolumeDensity(self, double zmax):
-        return XLALIntegrateComovingVolumeDensity(self.__LALCosmologicalParameters,zmax)
+        return self._evaluate(INTEGRATE_COMOVING_VOLUME_DENSITY, zmax)
 
     cpdef double IntegrateComovingVolume(self, double zmax):
-        return XLALIntegrateComovingVolume(self.__LALCosmologicalParameters,zmax)
+        return self._evaluate(INTEGRATE_COMOVING_VOLUME, zmax)
 
     cpdef double UniformComovingVolumeDensity(self, double z):
-        return XLALUniformComovingVolumeDensity(z, self.__LALCosmologicalParameters)
+        return self._evaluate(UNIFORM_COMOVING_VOLUME_DENSITY, z)
 
     cpdef double UniformComovingVolumeDistribution(self, double z, double zmax):
         return XLALUniformComovingVolumeDistribution(self.__LALCosmologicalParameters, z, zmax)
 
     cpdef double ComovingVolumeElement(self,double z):
-        return XLALComovingVolumeElement(z, self.__LALCosmologicalParameters)
+        return self._evaluate(COMOVING_VOLUME_ELEMENT, z)
 
     cpdef double ComovingVolume(self,double z):
-        return XLALComovingVolume(self.__LALCosmologicalParameters, z)
+        return self._evaluate(COMOVING_VOLUME, z)
+
+    # array versions of the above: z can be a numpy array or a memoryview,
+    # the loop runs in C without the GIL. If out is given it must be a
+    # C-contiguous float64 array with the same shape as z and is filled in place.
+    def HubbleParameterArray(self, z, out = None):
+        return self._array_call(HUBBLE_PARAMETER, z, out)
+
+    def LuminosityDistanceArray(self, z, out = None):
+        return self._array_call(LUMINOSITY_DISTANCE, z, out)
+
+    def ComovingDistanceArray(self, z, out = None):
+        return self._array_call(COMOVING_DISTANCE, z, out)
+
+    # The two integrals below share one cumulative quadrature over the sorted
+    # upper limits (e.g. the zmax of all the events in a joint run) and are memoized
+    # for the current (om, ol, w0, w1), so repeated calls with the same limits are free
+    def IntegrateComovingVolumeDensityArray(self, zmax, out = None):
+        return self._memoized_cumulative_integral(UNIFORM_COMOVING_VOLUME_DENSITY, 3, zmax, out)
+
+    def IntegrateComovingVolumeArray(self, zmax, out = None):
+        return self._memoized_cumulative_integral(COMOVING_VOLUME_ELEMENT, 3, zmax, out)
+
+    def UniformComovingVolumeDensityArray(self, z, out = None):
+        return self._array_call(UNIFORM_COMOVING_VOLUME_DENSITY, z, out)
+
+    def ComovingVolumeElementArray(self, z, out = None):
+        return self._array_call(COMOVING_VOLUME_ELEMENT, z, out)
+
+    def ComovingVolumeArray(self, z, out = None):
+        return self._array_call(COMOVING_VOLUME, z, out)
+
+    def RedshiftFromLuminosityDistanceArray(self, dl, out = None):
+        """
+        inverse of LuminosityDistanceArray. Much faster in tabulated mode,
+        provided the table covers the largest distance.
+        """
+        dl = np.ascontiguousarray(dl, dtype=np.float64)
+        if out is None:
+            out = np.empty(dl.shape, dtype=np.float64)
+        elif not isinstance(out, np.ndarray) or out.dtype != np.float64 or not out.flags['C_CONTIGUOUS'] or out.shape != dl.shape:
+            raise ValueError("out must be a C-contiguous float64 array with the same shape as dl")
+        cdef const double[::1] dlv = dl.reshape(-1)
+        cdef double[::1] ov = out.reshape(-1)
+        with nogil:
+            self._inverse_luminosity_distance_array(dlv, ov)
+        return out
 
     cpdef void DestroyCosmologicalParameters(self):
-        XLALDestroyCosmologicalParameters(self.__LALCosmologicalParameters)
+        """
+        free the LAL structure right away. Not needed anymore, the structure is
+        released when the object is garbage collected, and
+        the object must not be used after this call
+        """
+        if self.__LALCosmologicalParameters != NULL:
+            XLALDestroyCosmologicalParameters(self.__LALCosmologicalParameters)
+            self.__LALCosmologicalParameters = NULL
         return
+
+def validate_native_backend(accuracy = 'medium', double zmax = 10.0, int npoints = 200, cosmologies = None):
+    """
+    Maximum relative difference between the native and the LAL backends
+    for the luminosity distance, the comoving volume element, the comoving volume
+    (against XLALIntegrateComovingVolume: the closed form of XLALComovingVolume does not
+    hold past the equator of a closed universe) and the normalisation of the
+    uniform in comoving volume redshift distribution,
+    over npoints redshifts in (0, zmax] and a set of cosmologies
+    (default: the corners and centre of the parameter space of CosmologicalModel)
+    Returns a dictionary {quantity: maximum relative error}
+    """
+    if cosmologies is None:
+        cosmologies = [(0.73,0.25,0.75,-1.0,0.0)]
+        cosmologies += [(h,om,ol,w0,w1) for h in (0.5,1.0) for om in (0.04,0.5) for ol in (0.0,1.0) for w0 in (-2.0,0.0) for w1 in (-1.0,1.0)]
+    z = np.linspace(zmax/npoints, zmax, npoints)
+    errors = {'LuminosityDistance':0.0, 'ComovingVolumeElement':0.0, 'ComovingVolume':0.0, 'IntegrateComovingVolumeDensity':0.0}
+    for p in cosmologies:
+        lal    = CosmologicalParameters(*p)
+        native = CosmologicalParameters(*p, backend = 'native', accuracy = accuracy)
+        for q in ('LuminosityDistance', 'ComovingVolumeElement', 'ComovingVolume'):
+            reference = [getattr(lal, 'IntegrateComovingVolume' if q == 'ComovingVolume' else q)(zi) for zi in z]
+            errors[q] = max(errors[q], np.max(np.abs(getattr(native, q+'Array')(z)/reference-1.0)))
+        errors['IntegrateComovingVolumeDensity'] = max(errors['IntegrateComovingVolumeDensity'],
+            np.max(np.abs([native.IntegrateComovingVolumeDensity(zi)/lal.IntegrateComovingVolumeDensity(zi)-1.0 for zi in z[::10]])))
+    return errors
+
+def FromRecord(record):
+    """
+    new CosmologicalParameters from a cosmology_dtype record
+    """
+    return CosmologicalParameters(record['h'], record['om'], record['ol'], record['w0'], record['w1'])
+
+def pack_cosmologies(cosmologies):
+    """
+    cosmology_dtype array describing a sequence of CosmologicalParameters
+    """
+    return np.array([(c.h, c.om, c.ol, c.w0, c.w1) for c in cosmologies], dtype=cosmology_dtype)
+
+def records_to_shared_memory(records):
+    """
+    copy a cosmology_dtype array into a new shared memory block.
+    Workers attach to it by name with records_from_shared_memory, without copying.
+    The caller owns the block and must close() and unlink() it when done.
+    """
+    from multiprocessing.shared_memory import SharedMemory
+    records = np.ascontiguousarray(records, dtype=cosmology_dtype)
+    block   = SharedMemory(create = True, size = max(records.nbytes, 1))
+    np.ndarray(records.shape, dtype=cosmology_dtype, buffer=block.buf)[...] = records
+    return block
+
+def records_from_shared_memory(name, n):
+    """
+    zero-copy view of n cosmology_dtype records in the shared memory block name.
+    Returns the view and the block, which must be kept alive (and eventually closed)
+    while the view is in use.
+    """
+    from multiprocessing.shared_memory import SharedMemory
+    block = SharedMemory(name = name)
+    return np.ndarray((n,), dtype=cosmology_dtype, buffer=block.buf), block
+
+class CosmologyPool(object):
+    """
+    Per-thread pool of reusable CosmologicalParameters.
+    get() hands every thread its own object, updated in place to the requested
+    parameters, so that samplers and postprocessing loops do not allocate
+    and free a LAL structure for every point. An object returned by get() stays valid
+    until the next get() from the same thread.
+    Parameters:
+    ===============
+    zmax, npoints, cache: if npoints > 0 the pooled objects are tabulated
+                          (see CosmologicalParameters.Tabulate)
+    backend, accuracy: integration backend of the pooled objects
+    """
+    def __init__(self, zmax = 10.0, npoints = 0, cache = None, backend = 'lal', accuracy = 'medium'):
+        self.zmax       = zmax
+        self.npoints    = npoints
+        self.cache      = cache
+        self.backend    = backend
+        self.accuracy   = accuracy
+        self._local     = local()
+
+    def __reduce__(self):
+        """
+        pickle support: the copy is rebuilt from the constructor arguments,
+        the per-thread objects stay with the original
+        """
+        return (CosmologyPool, (self.zmax, self.npoints, self.cache, self.backend, self.accuracy))
+
+    def get(self, double h, double om, double ol, double w0, double w1):
+        cdef CosmologicalParameters omega = getattr(self._local, 'omega', None)
+        if omega is None:
+            omega = CosmologicalParameters(h, om, ol, w0, w1, self.backend, self.accuracy)
+            if self.npoints > 0:
+                omega.Tabulate(self.zmax, self.npoints, self.cache)
+            self._local.omega = omega
+        else:
+            omega.Update(h, om, ol, w0, w1)
+        return omega
@@ -9,7 +9,7 @@ MBH_Models = ['heavy_Q3',
 
 if __name__=="__main__":
     parser=OptionParser()
-    parser.add_option('-p','--program',default=None,type='string',help='Executable')
+    parser.add_option('-p','--program',default=None,type='string',help='Executable (cosmological_inference.py starts faster than cosmological_model.py for inference-only jobs)')
     parser.add_option('--path',default=None,type='string',help='Executable path')
     parser.add_option('-t','--threads',default=4,type='int',metavar='threads',help='Number of cpu cores to request (default = all of them)')
     parser.add_option('-d','--data',default=None,type='string',metavar='data',help='catalogs location (folder with EVENT_ subfolders)')
@@ -22,6 +22,9 @@ if __name__=="__main__":
     parser.add_option('--snr_threshold', default=20, type='int',metavar='snr_threshold',help='SNR selection threshold')
     parser.add_option('--gw_selection', default=0, type='int',metavar='gw_selection',help='use GW selection function')
     parser.add_option('--em_selection', default=1, type='int',metavar='em_selection',help='use EM selection function')
+    parser.add_option('--tabulate', default=0, type='int',metavar='tabulate',help='number of redshift grid points for the tabulated distances (default 0, no tabulation)')
+    parser.add_option('--distance_store', default=None, type='string',metavar='distance_store',help='directory of the distance table store shared by all the jobs (default: none)')
+    parser.add_option('--detection_table', default=None, type='string',metavar='detection_table',help='.npz GW detection probability table used by --gw_selection (default: computed from the horizon)')
     parser.add_option('--submit', default=0, type='int',metavar='submit',help='automatically submit the job (default: False)')
     
     (opts,args)=parser.parse_args()
@@ -29,6 +32,14 @@ if __name__=="__main__":
     program = opts.program
     submit  = opts.submit
     executable = os.path.join(opts.path,program)
+    # options shared by every job
+    common = ""
+    if opts.tabulate > 0:
+        common += " --tabulate %d"%opts.tabulate
+    if opts.distance_store is not None:
+        common += " --distance_store %s"%os.path.abspath(opts.distance_store)
+    if opts.detection_table is not None:
+        common += " --detection_table %s"%os.path.abspath(opts.detection_table)
     if opts.source_class =='MBH':
         for M in MBH_Models:
             work_folder = os.path.join(opts.work,"%s"%M)
@@ -48,7 +59,7 @@ if __name__=="__main__":
                 submit_file.write("getEnv = True\n")
                 submit_file.write("request_cpus = %d\n"%opts.threads)
                 submit_file.write("\n")
-                submit_file.write("arguments = -d %s -o %s -m %s -c %s\n"%(catalog_folder,catalog_folder,opts.model,opts.source_class))
+                submit_file.write("arguments = -d %s -o %s -m %s -c %s%s\n"%(catalog_folder,catalog_folder,opts.model,opts.source_class,common))
                 submit_file.write("queue 1\n")
                 submit_file.write("\n")
                 submit_file.close()
@@ -73,7 +84,7 @@ if __name__=="__main__":
                 submit_file.write("request_cpus = %d\n"%opts.threads)
                 submit_file.write("\n")
                 J = int(E.split('_')[-1][1:])-1
-                submit_file.write("arguments = -d %s -o %s -e %d -m %s -c %s --zhorizon %s --gw_selection %d --em_selection %d --snr_threshold %d\n"%(work_folder,event_folder,J,opts.model,opts.source_class,opts.zhorizon,opts.gw_selection,opts.em_selection,opts.snr_threshold))
+                submit_file.write("arguments = -d %s -o %s -e %d -m %s -c %s --zhorizon %s --gw_selection %d --em_selection %d --snr_threshold %d%s\n"%(work_folder,event_folder,J,opts.model,opts.source_class,opts.zhorizon,opts.gw_selection,opts.em_selection,opts.snr_threshold,common))
                 submit_file.write("queue 1\n")
                 submit_file.write("\n")
                 submit_file.close()
@@ -91,7 +102,7 @@ if __name__=="__main__":
             submit_file.write("getEnv = True\n")
             submit_file.write("request_cpus = %d\n"%opts.threads)
             submit_file.write("\n")
-            submit_file.write("arguments = -d %s -o %s -m %s -c %s -j %d\n"%(work_folder,catalog_folder,opts.model,opts.source_class,opts.joint))
+            submit_file.write("arguments = -d %s -o %s -m %s -c %s -j %d%s\n"%(work_folder,catalog_folder,opts.model,opts.source_class,opts.joint,common))
             submit_file.write("queue 1\n")
             submit_file.write("\n")
             submit_file.close()
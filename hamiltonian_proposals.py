@@ -0,0 +1,44 @@
+"""
+Hamiltonian proposals for cpnest driven by the analytic gradient of the log likelihood
+(CosmologicalModel.log_likelihood_gradient). cpnest's constrained leap frog reflects the
+trajectory on the iso-likelihood surface logL = logLmin along a normal it estimates from
+spline fits to the ensemble, here the normal is the exact likelihood gradient at the point.
+Imported by run_sampler only with --nhamiltonian > 0, cpnest.proposal pulls in scipy
+"""
+import numpy as np
+from cpnest.proposal import ProposalCycle, ConstrainedLeapFrog
+
+class GradientConstrainedLeapFrog(ConstrainedLeapFrog):
+    """
+    constrained leap frog whose reflections use the normal
+    log_likelihood_gradient/|log_likelihood_gradient| of the model
+    Parameters:
+    ===============
+    model: :obj:'cosmological_model.CosmologicalModel': model with a log_likelihood_gradient
+    """
+    def __init__(self, model = None, **kwargs):
+        super(GradientConstrainedLeapFrog,self).__init__(model = model, **kwargs)
+        self.log_likelihood_gradient = model.log_likelihood_gradient
+
+    def update_normal_vector(self):
+        # no spline fit to the ensemble, the normal comes from the gradient
+        pass
+
+    def unit_normal(self, q):
+        """
+        unit normal at q to the iso-likelihood surface, zero where the gradient
+        vanishes or is not finite (the momentum is then left unchanged)
+        """
+        v    = np.asarray(self.log_likelihood_gradient(q), dtype=np.float64)
+        norm = np.linalg.norm(v)
+        if not np.isfinite(norm) or norm == 0.0:
+            return np.zeros_like(v)
+        return v/norm
+
+class GradientHamiltonianProposalCycle(ProposalCycle):
+    """
+    drop-in replacement of cpnest.proposal.HamiltonianProposalCycle
+    (the 'hmc' entry of the proposals of cpnest.CPNest)
+    """
+    def __init__(self, model = None, id = None):
+        super(GradientHamiltonianProposalCycle,self).__init__([GradientConstrainedLeapFrog(model = model, id = id)], [1])
@@ -1,56 +1,65 @@
 from __future__ import division
 import numpy as np
 cimport numpy as np
+import os
+import copyreg
 from numpy cimport ndarray
-from libc.math cimport log,exp,sqrt,cos,fabs,sin,sinh
+from libc.math cimport log,log1p,exp,pow,sqrt,ceil,cos,fabs,sin,sinh,isnan,NAN,INFINITY,M_PI
 cimport cython
-from scipy.integrate import quad
+from cython.parallel cimport prange
 from scipy.special.cython_special cimport erfc, hyp2f1
-from scipy.special import logsumexp
-from scipy.optimize import newton
+from cosmology cimport CosmologicalParameters, LUMINOSITY_DISTANCE, UNIFORM_COMOVING_VOLUME_DENSITY, INTEGRATE_COMOVING_VOLUME_DENSITY
+from cosmology cimport D_Z, D_H, NGRADIENT
 
-cdef inline double log_add(double x, double y): return x+log(1.0+exp(y-x)) if x >= y else y+log(1.0+exp(x-y))
+cdef inline double log_add(double x, double y) nogil:
+    if x == -INFINITY: return y
+    return x+log(1.0+exp(y-x)) if x >= y else y+log(1.0+exp(x-y))
+cdef inline double log_one_minus_exp(double x) nogil: return log1p(-exp(x))
 cdef inline double linear_density(double x, double a, double b): return a+log(x)*b
 
-@cython.cdivision(True)
-@cython.boundscheck(False)
-cpdef double logLikelihood_single_event(ndarray[double, ndim=2] hosts, double meandl, double sigma, object omega, double event_redshift, int em_selection = 0, double zmin = 0.0, double zmax = 1.0):
+cpdef double logLikelihood_single_event(const double[:, ::1] hosts, double meandl, double sigma, CosmologicalParameters omega, double event_redshift, int em_selection = 0, double zmin = 0.0, double zmax = 1.0, double log_norm = NAN):
     """
     Likelihood function for a single GW event.
-    Loops over all possible hosts to accumulate the likelihood
+    Loops over all possible hosts to accumulate the likelihood.
+    The computation runs without the GIL, so concurrent sampler threads
+    evaluate it in parallel
     Parameters:
     ===============
     hosts: :obj:'numpy.array' with shape Nx3. The columns are redshift, redshift_error, angular_weight
     meandl: :obj: 'numpy.double': mean of the DL marginal likelihood
     sigma: :obj:'numpy.double': standard deviation of the DL marginal likelihood
-    omega: :obj:'lal.CosmologicalParameter': cosmological parameter structure
+    omega: :obj:'cosmology.CosmologicalParameters': cosmological parameter structure
     event_redshift: :obj:'numpy.double': redshift for the the GW event
     em_selection :obj:'numpy.int': apply em selection function. optional. default = 0
+    zmin: :obj:'numpy.double': lower redshift bound of the event. optional. default = 0
+    zmax: :obj:'numpy.double': upper redshift bound of the event. optional. default = 1
+    log_norm: :obj:'numpy.double': log of the redshift prior normalisation up to zmax, if already known
+              (see CosmologicalParameters.IntegrateComovingVolumeDensityArray). optional. default = computed
     """
-    cdef unsigned int i
-    cdef unsigned int N = hosts.shape[0]
-    cdef double logTwoPiByTwo = 0.5*log(2.0*np.pi)
-    cdef double logL_galaxy
-    cdef double dl
-    cdef double score_z, sigma_z
-    cdef double logL = -np.inf
-    cdef double weak_lensing_error
+    cdef double logL
+    with nogil:
+        logL = _logLikelihood_single_event(hosts, meandl, sigma, omega, event_redshift, em_selection, zmin, zmax, log_norm)
+    return logL
 
-    # predict dl from the cosmology and the redshift
-    dl = omega.LuminosityDistance(event_redshift)
-    
-    cdef double logp_detection = 0.0
-    cdef double logp_nondetection = 0.0
-    
-    if em_selection == 1:
-        # compute the probability p(G|O) that the event is located in a detected galaxy
-        # compute the probability p(notG|O) that the event is located in a non-detected galaxy as 1-p(G|O)
-        logp_detection      = log(em_selection_function(dl))
-        logp_nondetection   = logsumexp([0.0,logp_detection], b = [1,-1])
+@cython.cdivision(True)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef double _logLikelihood_single_event(const double[:, ::1] hosts, double meandl, double sigma, CosmologicalParameters omega, double event_redshift, int em_selection, double zmin, double zmax, double log_norm) nogil:
+    return _logLikelihood_event(_log_host_density(hosts, event_redshift), meandl, sigma, omega, event_redshift, em_selection, zmin, zmax, log_norm)
 
-    # compute the weak lensing error
-    weak_lensing_error = sigma_weak_lensing(event_redshift, dl)
-    
+@cython.cdivision(True)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef double _log_host_density(const double[:, ::1] hosts, double event_redshift) nogil:
+    """
+    log of the redshift probability density of the hosts at event_redshift
+    """
+    cdef Py_ssize_t i
+    cdef Py_ssize_t N = hosts.shape[0]
+    cdef double logTwoPiByTwo = 0.5*log(2.0*M_PI)
+    cdef double logL_galaxy
+    cdef double score_z, sigma_z
+    cdef double logL = -INFINITY
     # sum over the observed galaxies
     # p(d|O,zgw,G)p(zgw|O,G) = exp(-0.5*((d-d(zgw,O))/sig_d)^2)*\sum_g w_g*exp(-0.5*(z_g-zgw)^2/sig_z_g^2)
     for i in range(N):
@@ -59,24 +68,1040 @@ cpdef double logLikelihood_single_event(ndarray[double, ndim=2] hosts, double me
         score_z = (event_redshift-hosts[i,0])/sigma_z
         logL_galaxy = -0.5*score_z*score_z+log(hosts[i,2])-log(sigma_z)-logTwoPiByTwo
         logL = log_add(logL,logL_galaxy)
+    return logL
+
+@cython.cdivision(True)
+cdef double _logLikelihood_event(double logL, double meandl, double sigma, CosmologicalParameters omega, double event_redshift, int em_selection, double zmin, double zmax, double log_norm) nogil:
+    """
+    likelihood of a single GW event given the log density logL of its hosts at event_redshift
+    """
+    cdef double logp_detection = 0.0
+    cdef double logp_nondetection = 0.0
+    cdef double logGW = _log_distance_and_prior(meandl, sigma, omega, event_redshift, em_selection, zmax, log_norm, &logp_detection)
+    
+    if em_selection == 1:
+        # compute the probability p(notG|O) that the event is located in a non-detected galaxy as 1-p(G|O)
+        logp_nondetection   = log_one_minus_exp(logp_detection)
 
     # add the probability that the GW was in a seen galaxy, multiply by p(G|O)
     if em_selection == 1: logL += logp_detection
     
-    cdef double logLn = -np.inf
+    cdef double logLn = -INFINITY
     # sum over the unobserved galaxies, assuming they all have redshift = zgw
     # p(d|O,zgw,notG)p(zgw|O,notG) = exp(-0.5*((d-d(zgw,O))/sig_d)^2)*\sum_g (1/Nn)*exp(-0.5*(zgw-zgw)^2/sig_zgw^2)
     if em_selection == 1:
         # multiply by p(notG|O)
         logLn = logp_nondetection
     
+    return logGW+log_add(logL,logLn)
+
+@cython.cdivision(True)
+cdef double _log_distance_and_prior(double meandl, double sigma, CosmologicalParameters omega, double event_redshift, int em_selection, double zmax, double log_norm, double *logp_detection) nogil:
+    """
+    log of the DL likelihood (including weak lensing) times the redshift prior
+    at event_redshift. If em_selection == 1 logp_detection is set to
+    the log of the probability p(G|O) that the host is a detected galaxy
+    """
+    cdef double logTwoPiByTwo = 0.5*log(2.0*M_PI)
+    cdef double dl
+    cdef double weak_lensing_error
+
+    # predict dl from the cosmology and the redshift
+    dl = omega._evaluate(LUMINOSITY_DISTANCE, event_redshift)
+    
+    if em_selection == 1:
+        # compute the probability p(G|O) that the event is located in a detected galaxy
+        logp_detection[0] = log(em_selection_function(dl))
+
+    # compute the weak lensing error
+    weak_lensing_error = sigma_weak_lensing(event_redshift, dl)
+    
     cdef double SigmaSquared = sigma**2+weak_lensing_error**2
     cdef double logSigmaByTwo = 0.5*log(sigma**2+weak_lensing_error**2)
-    cdef double log_norm = log(omega.IntegrateComovingVolumeDensity(zmax))
-    cdef double logP     = log(omega.UniformComovingVolumeDensity(event_redshift))-log_norm
-    return (-0.5*(dl-meandl)*(dl-meandl)/SigmaSquared-logTwoPiByTwo-logSigmaByTwo)+log_add(logL,logLn)+logP
-    
-cpdef double sigma_weak_lensing(double z, double dl):
+    if isnan(log_norm):
+        log_norm = log(omega._evaluate(INTEGRATE_COMOVING_VOLUME_DENSITY, zmax))
+    cdef double logP     = log(omega._evaluate(UNIFORM_COMOVING_VOLUME_DENSITY, event_redshift))-log_norm
+    return (-0.5*(dl-meandl)*(dl-meandl)/SigmaSquared-logTwoPiByTwo-logSigmaByTwo)+logP
+
+@cython.cdivision(True)
+cdef double _log_distance_and_prior_gradient(double meandl, double sigma, CosmologicalParameters omega, double event_redshift, int em_selection, double log_norm, const double *dlog_norm, double *logp_detection, double *grad, double *dlogp_detection) nogil:
+    """
+    _log_distance_and_prior and its gradient grad with respect to the redshift and the
+    parameters (D_Z ... D_W1 components, see cosmology.pxd), given the gradient dlog_norm
+    of the log prior normalisation. If em_selection == 1 logp_detection and its
+    gradient dlogp_detection are set as well
+    """
+    cdef int i
+    cdef double dlog_dl[NGRADIENT]
+    cdef double dlog_density[NGRADIENT]
+    cdef double dl = omega._evaluate(LUMINOSITY_DISTANCE, event_redshift)
+    cdef double x  = 1.0+event_redshift
+    # weak lensing error per unit distance (see sigma_weak_lensing) and its derivative
+    cdef double f        = (1.0-x**(-0.25))/0.25
+    cdef double lensing  = 0.066*f**1.8
+    cdef double dlensing = 0.066*1.8*f**0.8*x**(-1.25)
+    cdef double SigmaSquared = sigma*sigma+dl*dl*lensing*lensing
+    cdef double residual = dl-meandl
+    # derivatives of the log DL likelihood with respect to dl and to the variance
+    cdef double dG_ddl = -residual/SigmaSquared
+    cdef double dG_dS  = 0.5*residual*residual/(SigmaSquared*SigmaSquared)-0.5/SigmaSquared
+    cdef double dlogp_ddl
+    omega._log_distance_gradient(event_redshift, dlog_dl, dlog_density)
+    for i in range(NGRADIENT):
+        grad[i] = (dG_ddl+2.0*dG_dS*dl*lensing*lensing)*dl*dlog_dl[i]+dlog_density[i]
+    grad[D_Z] += 2.0*dG_dS*dl*dl*lensing*dlensing
+    for i in range(D_H, NGRADIENT):
+        grad[i] -= dlog_norm[i]
+    if em_selection == 1:
+        logp_detection[0] = log(em_selection_function(dl))
+        dlogp_ddl = em_selection_function_log_derivative(dl)
+        for i in range(NGRADIENT):
+            dlogp_detection[i] = dlogp_ddl*dl*dlog_dl[i]
+    return (-0.5*residual*residual/SigmaSquared-0.5*log(2.0*M_PI)-0.5*log(SigmaSquared))+log(omega._evaluate(UNIFORM_COMOVING_VOLUME_DENSITY, event_redshift))-log_norm
+
+cdef double _logLikelihood_event_gradient(double logL, double dlogL, double meandl, double sigma, CosmologicalParameters omega, double event_redshift, int em_selection, double log_norm, const double *dlog_norm, double *grad) nogil:
+    """
+    _logLikelihood_event and its gradient grad (see _log_distance_and_prior_gradient),
+    given the derivative dlogL of the log host density with respect to the redshift
+    """
+    cdef int i
+    cdef double logp_detection = 0.0
+    cdef double logp_nondetection, logLt, w, wn
+    cdef double dlogp_detection[NGRADIENT]
+    cdef double logGW = _log_distance_and_prior_gradient(meandl, sigma, omega, event_redshift, em_selection, log_norm, dlog_norm, &logp_detection, grad, dlogp_detection)
+    if em_selection != 1:
+        grad[D_Z] += dlogL
+        return logGW+logL
+    logp_nondetection = log_one_minus_exp(logp_detection)
+    logL  += logp_detection
+    logLt  = log_add(logL, logp_nondetection)
+    # relative weights of the detected and of the non-detected galaxies
+    w  = exp(logL-logLt)
+    wn = exp(logp_nondetection-logLt)
+    grad[D_Z] += w*dlogL
+    for i in range(NGRADIENT):
+        grad[i] += (w-wn*exp(logp_detection-logp_nondetection))*dlogp_detection[i]
+    return logGW+logLt
+
+def flatten_hosts(hosts):
+    """
+    Concatenate the host arrays of a list of events into a single
+    contiguous array, with CSR-style offsets: the hosts of event j are
+    the rows offsets[j]:offsets[j+1], sorted by redshift
+    Parameters:
+    ===============
+    hosts: :obj:'list' of :obj:'numpy.array' with shape Nx3, one per event
+    """
+    counts  = [len(h) for h in hosts]
+    offsets = np.zeros(len(hosts)+1, dtype=np.intp)
+    offsets[1:] = np.cumsum(counts)
+    flat    = np.zeros((offsets[-1], 3), dtype=np.float64)
+    for j, h in enumerate(hosts):
+        if counts[j] > 0: flat[offsets[j]:offsets[j+1]] = h[np.argsort(h[:,0], kind='stable')]
+    return flat, offsets
+
+def host_redshift_widths(hosts, offsets):
+    """
+    largest redshift standard deviation sigma_z = dz*(1+z) among the hosts of each
+    event of a catalog built by flatten_hosts (0 for events without hosts)
+    """
+    sigma_z = hosts[:,1]*(1.0+hosts[:,0])
+    return np.array([np.max(sigma_z[a:b]) if b > a else 0.0 for a, b in zip(offsets[:-1], offsets[1:])], dtype=np.float64)
+
+def host_constants(hosts):
+    """
+    Struct-of-arrays cache of the per-host constants of the host sum, shape 3xN:
+    redshift z_g, inverse standard deviation 1/sigma_g with sigma_g = dz_g*(1+z_g),
+    and log(w_g)-log(sigma_g)-log(2pi)/2, so that the log density of host g at
+    z is constants[2,g]-0.5*((z-z_g)/sigma_g)^2
+    Parameters:
+    ===============
+    hosts: :obj:'numpy.array' with shape Nx3. The columns are redshift, redshift_error, angular_weight
+    """
+    hosts   = np.atleast_2d(hosts).reshape(-1, 3)
+    sigma_z = hosts[:,1]*(1.0+hosts[:,0])
+    with np.errstate(divide='ignore'):
+        return np.ascontiguousarray([hosts[:,0], 1.0/sigma_z, np.log(hosts[:,2])-np.log(sigma_z)-0.5*np.log(2.0*np.pi)], dtype=np.float64)
+
+def host_window_neglected_mass(double window):
+    """
+    fraction of the redshift probability of a host lying beyond window standard
+    deviations of its redshift. Summing only over the hosts within window standard
+    deviations of the event redshift (see logLikelihood_multiple_events) neglects
+    hosts whose Gaussian at the event redshift is below this fraction of its mass;
+    it is not a bound on the relative error of the host sum
+    """
+    if window <= 0.0: return 0.0
+    return erfc(window/sqrt(2.0))
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline Py_ssize_t _bisect_hosts(const double[::1] redshifts, Py_ssize_t lo, Py_ssize_t hi, double z) nogil:
+    """
+    first index in [lo, hi) of the sorted host redshifts with redshift >= z
+    """
+    cdef Py_ssize_t mid
+    while lo < hi:
+        mid = (lo+hi)//2
+        if redshifts[mid] < z: lo = mid+1
+        else: hi = mid
+    return lo
+
+cdef inline void _host_window(const double[::1] redshifts, Py_ssize_t *first, Py_ssize_t *last, double z, double half_width) nogil:
+    """
+    narrow the hosts first:last to those within half_width of z. If there are
+    none, all the hosts are kept, so that the host density stays finite
+    far from every host
+    """
+    cdef Py_ssize_t a = _bisect_hosts(redshifts, first[0], last[0], z-half_width)
+    cdef Py_ssize_t b = _bisect_hosts(redshifts, a, last[0], z+half_width)
+    if b > a:
+        first[0] = a
+        last[0]  = b
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef double _log_host_density_cached(const double[:, ::1] constants, Py_ssize_t first, Py_ssize_t last, double event_redshift) nogil:
+    """
+    log redshift density at event_redshift of the hosts first:last of the
+    constants built by host_constants. The first pass finds the largest term,
+    the second sums the exponentials relative to it
+    """
+    cdef Py_ssize_t i
+    cdef double score_z, term
+    cdef double peak = -INFINITY
+    cdef double acc = 0.0
+    for i in range(first, last):
+        score_z = (event_redshift-constants[0,i])*constants[1,i]
+        term    = constants[2,i]-0.5*score_z*score_z
+        if term > peak: peak = term
+    if peak == -INFINITY:
+        return -INFINITY
+    for i in range(first, last):
+        score_z = (event_redshift-constants[0,i])*constants[1,i]
+        acc    += exp(constants[2,i]-0.5*score_z*score_z-peak)
+    return peak+log(acc)
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef double _log_host_density_derivative(const double[:, ::1] constants, Py_ssize_t first, Py_ssize_t last, double event_redshift, double logL) nogil:
+    """
+    derivative with respect to the redshift of the log host density logL = _log_host_density_cached(constants, first, last, event_redshift)
+    """
+    cdef Py_ssize_t i
+    cdef double score_z
+    cdef double d = 0.0
+    if logL == -INFINITY:
+        return 0.0
+    for i in range(first, last):
+        score_z = (event_redshift-constants[0,i])*constants[1,i]
+        d -= exp(constants[2,i]-0.5*score_z*score_z-logL)*score_z*constants[1,i]
+    return d
+
+cdef class HostDensityTable:
+    """
+    Log redshift probability density of the hosts of each event,
+    log sum_g w_g N(z; z_g, dz_g(1+z_g)), tabulated on a uniform grid over the
+    redshift bounds of the event, together with its derivative, and
+    interpolated with cubic Hermite polynomials (exact for a single host).
+    It does not depend on the cosmology, so it is computed once and the host
+    term of the likelihood then costs O(1) whatever the number of hosts.
+    The grid is refined (doubling the number of intervals) until the largest
+    interpolation error at the midpoints of the grid, on the density in units
+    of its peak value, is below tolerance or the grid reaches max_npoints.
+    error adds to it a bound on the hosts skipped at each node (see _tabulate_host_density).
+    Parameters:
+    ===============
+    hosts, offsets: catalog of the hosts of all the events, sorted by redshift (see flatten_hosts)
+    zmin, zmax: :obj:'numpy.array': redshift bounds of the events
+    npoints: :obj:'int': initial number of grid points. default = 1000
+    tolerance: :obj:'numpy.double': target interpolation error. default = 1e-4
+    max_npoints: :obj:'int': maximum number of grid points. default = 65537
+    """
+    cdef const double[:, ::1] log_density
+    cdef const double[:, ::1] dlog_density
+    cdef const double[::1] zlow
+    cdef const double[::1] step
+    cdef public int npoints
+    cdef public double error
+
+    def __init__(self, hosts, offsets, zmin, zmax, int npoints = 1000, double tolerance = 1e-4, int max_npoints = 65537):
+        if npoints < 2 or max_npoints < npoints:
+            raise ValueError("the grid needs at least 2 points and npoints <= max_npoints")
+        zmin = np.ascontiguousarray(zmin, dtype=np.float64)
+        zmax = np.ascontiguousarray(zmax, dtype=np.float64)
+        widths    = host_redshift_widths(hosts, offsets)
+        constants = host_constants(hosts)
+        cdef double interpolation
+        while True:
+            table, derivative = _tabulate_host_density(constants, offsets, widths, zmin, (zmax-zmin)/(npoints-1), npoints)
+            self.log_density = table
+            self.dlog_density = derivative
+            self.zlow = zmin
+            self.step = (zmax-zmin)/(npoints-1)
+            self.npoints = npoints
+            interpolation = self._midpoint_error(constants, offsets, widths, table)
+            if interpolation <= tolerance or 2*npoints-1 > max_npoints:
+                break
+            npoints = 2*npoints-1
+        self.error = interpolation+_host_cut_error(constants, offsets, table)
+
+    def __reduce__(self):
+        """
+        pickle support: the tables travel with the object, nothing is recomputed
+        """
+        return (copyreg.__newobj__, (HostDensityTable,),
+                (np.asarray(self.log_density), np.asarray(self.dlog_density), np.asarray(self.zlow), np.asarray(self.step), self.npoints, self.error))
+
+    def __setstate__(self, state):
+        self.log_density, self.dlog_density, self.zlow, self.step, self.npoints, self.error = state
+
+    def _midpoint_error(self, constants, offsets, widths, table):
+        midpoints = _tabulate_host_density(constants, offsets, widths, np.asarray(self.zlow)+0.5*np.asarray(self.step), self.step, self.npoints-1)[0]
+        interpolated = self._evaluate_midpoints()
+        peak = np.max(table, axis=1)[:,None]
+        with np.errstate(invalid='ignore'):
+            error = np.abs(np.exp(interpolated-peak)-np.exp(midpoints-peak))
+        return np.nanmax(error) if error.size > 0 else 0.0
+
+    @cython.cdivision(True)
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cdef double evaluate(self, Py_ssize_t j, double z) nogil:
+        """
+        log host density of event j at redshift z, constant beyond the redshift bounds
+        """
+        cdef double x = (z-self.zlow[j])/self.step[j]
+        cdef Py_ssize_t k
+        cdef double t, left, right
+        if x <= 0.0: return self.log_density[j, 0]
+        if x >= self.npoints-1: return self.log_density[j, self.npoints-1]
+        k     = <Py_ssize_t>x
+        t     = x-k
+        left  = self.log_density[j, k]
+        right = self.log_density[j, k+1]
+        # event without hosts
+        if left == -INFINITY or right == -INFINITY: return -INFINITY
+        return ((1.0+2.0*t)*(1.0-t)*(1.0-t)*left+t*(1.0-t)*(1.0-t)*self.step[j]*self.dlog_density[j, k]
+                +t*t*(3.0-2.0*t)*right-t*t*(1.0-t)*self.step[j]*self.dlog_density[j, k+1])
+
+    @cython.cdivision(True)
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cdef double derivative(self, Py_ssize_t j, double z) nogil:
+        """
+        derivative with respect to z of the interpolated log host density of event j
+        """
+        cdef double x = (z-self.zlow[j])/self.step[j]
+        cdef Py_ssize_t k
+        cdef double t, left, right
+        if x <= 0.0 or x >= self.npoints-1: return 0.0
+        k     = <Py_ssize_t>x
+        t     = x-k
+        left  = self.log_density[j, k]
+        right = self.log_density[j, k+1]
+        if left == -INFINITY or right == -INFINITY: return 0.0
+        return (6.0*t*(t-1.0)*(left-right)/self.step[j]+(1.0-t)*(1.0-3.0*t)*self.dlog_density[j, k]
+                +t*(3.0*t-2.0)*self.dlog_density[j, k+1])
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cdef object _evaluate_midpoints(self):
+        cdef Py_ssize_t j, k
+        values = np.empty((self.log_density.shape[0], self.npoints-1), dtype=np.float64)
+        cdef double[:, ::1] res = values
+        with nogil:
+            for j in range(res.shape[0]):
+                for k in range(res.shape[1]):
+                    res[j, k] = self.evaluate(j, self.zlow[j]+(k+0.5)*self.step[j])
+        return values
+
+    def LogDensity(self, Py_ssize_t j, z):
+        """
+        interpolated log host density of event j at the redshifts z
+        """
+        return np.array([self.evaluate(j, zi) for zi in np.atleast_1d(z)])
+
+# standard deviations beyond which a host is skipped when tabulating the host density
+DEF HOST_CUT = 12.0
+
+def _host_cut_error(constants, offsets, table):
+    """
+    bound, in units of the peak of each event's density as HostDensityTable.error,
+    on the hosts skipped by _tabulate_host_density: each is further than HOST_CUT
+    standard deviations, hence below exp(constants[2,g]-HOST_CUT**2/2)
+    """
+    error = 0.0
+    for j in range(len(offsets)-1):
+        if offsets[j+1] > offsets[j]:
+            log_mass = np.logaddexp.reduce(constants[2, offsets[j]:offsets[j+1]])
+            error = max(error, np.exp(log_mass-0.5*HOST_CUT*HOST_CUT-np.max(table[j])))
+    return error
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef object _tabulate_host_density(const double[:, ::1] constants, const Py_ssize_t[::1] offsets, const double[::1] widths, const double[::1] zstart, const double[::1] step, int npoints):
+    """
+    exact log host density, and its derivative, on npoints redshifts zstart[j]+k*step[j]
+    for every event j. Hosts further than HOST_CUT standard deviations are skipped,
+    unless there are no closer ones, so that the table is finite wherever the
+    exact sum is (see _host_cut_error for the error)
+    """
+    cdef Py_ssize_t j, k, first, last
+    cdef double z
+    cdef Py_ssize_t M = zstart.shape[0]
+    table = np.empty((M, npoints), dtype=np.float64)
+    derivative = np.empty((M, npoints), dtype=np.float64)
+    cdef double[:, ::1] res = table
+    cdef double[:, ::1] dres = derivative
+    with nogil:
+        for j in range(M):
+            for k in range(npoints):
+                z     = zstart[j]+k*step[j]
+                first = offsets[j]
+                last  = offsets[j+1]
+                _host_window(constants[0], &first, &last, z, HOST_CUT*widths[j])
+                res[j, k]  = _log_host_density_cached(constants, first, last, z)
+                dres[j, k] = _log_host_density_derivative(constants, first, last, z, res[j, k])
+    return table, derivative
+
+def likelihood_threads(threads, Py_ssize_t M):
+    """
+    number of OpenMP threads used over M events: threads, or one per core if threads <= 0,
+    and at most one per event
+    """
+    if threads is None or threads <= 0: threads = os.cpu_count() or 1
+    return max(1, min(threads, M))
+
+def balanced_event_chunks(offsets, Py_ssize_t nchunks):
+    """
+    split the events in nchunks contiguous chunks of about the same cost,
+    taken as one plus the number of hosts of each event.
+    Returns the nchunks+1 event boundaries: chunk c is events chunks[c]:chunks[c+1]
+    """
+    offsets = np.asarray(offsets)
+    cost    = np.cumsum(np.diff(offsets)+1)
+    chunks  = np.empty(nchunks+1, dtype=np.intp)
+    chunks[0]  = 0
+    chunks[1:] = np.searchsorted(cost, cost[-1]*np.arange(1, nchunks+1)/nchunks, side='left')+1 if len(cost) > 0 else 0
+    chunks[-1] = len(cost)
+    return chunks
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def logLikelihood_multiple_events(const double[:, ::1] hosts, const Py_ssize_t[::1] offsets, const double[::1] meandl, const double[::1] sigma, CosmologicalParameters omega, const double[::1] event_redshifts, int em_selection = 0, zmin = None, zmax = None, out = None, double window = 0.0, widths = None, HostDensityTable density = None, constants = None, int threads = 1):
+    """
+    Joint likelihood of a set of GW events, in a single call.
+    Equivalent to the sum of logLikelihood_single_event over the events, with the
+    redshift prior normalisations computed from a single cumulative integral
+    and the loop over the events running without the GIL, split over
+    OpenMP threads in chunks of events with about the same number of hosts
+    Parameters:
+    ===============
+    hosts: :obj:'numpy.array' with shape Nx3, hosts of all the events (see flatten_hosts)
+    offsets: :obj:'numpy.array' of :obj:'numpy.intp': hosts of event j are hosts[offsets[j]:offsets[j+1]]
+    meandl: :obj:'numpy.array': means of the DL marginal likelihoods
+    sigma: :obj:'numpy.array': standard deviations of the DL marginal likelihoods
+    omega: :obj:'cosmology.CosmologicalParameters': cosmological parameter structure
+    event_redshifts: :obj:'numpy.array': redshifts of the GW events
+    em_selection :obj:'numpy.int': apply em selection function. optional. default = 0
+    zmin: :obj:'numpy.array': lower redshift bounds of the events. optional. default = 0
+    zmax: :obj:'numpy.array': upper redshift bounds of the events. optional. default = 1
+    out: :obj:'numpy.array': if given, filled with the log likelihood of each event. optional
+    window: :obj:'numpy.double': if > 0, sum only over the hosts within window*widths[j] of the event
+            redshift, found by bisection, or over all of them if none is that close.
+            See host_window_neglected_mass. optional. default = 0, all hosts
+    widths: :obj:'numpy.array': largest host redshift standard deviation of each event (see host_redshift_widths).
+            optional. default = computed
+    density: :obj:'HostDensityTable': if given, the host term is interpolated from it instead
+             of summed over the hosts. optional. default = None
+    constants: :obj:'numpy.array': per-host constants of hosts (see host_constants). optional. default = computed
+    threads: :obj:'int': number of OpenMP threads, 0 for one per core. optional. default = 1
+    Returns the total log likelihood
+    """
+    cdef Py_ssize_t c, j, first, last
+    cdef Py_ssize_t M = event_redshifts.shape[0]
+    cdef double logL = 0.0
+    if offsets.shape[0] != M+1 or meandl.shape[0] != M or sigma.shape[0] != M:
+        raise ValueError("offsets must have one entry more than the events, meandl and sigma one per event")
+    if zmin is None: zmin = np.zeros(M, dtype=np.float64)
+    if zmax is None: zmax = np.ones(M, dtype=np.float64)
+    cdef const double[::1] zlow  = np.ascontiguousarray(zmin, dtype=np.float64)
+    cdef const double[::1] log_norms = np.log(omega.IntegrateComovingVolumeDensityArray(np.ascontiguousarray(zmax, dtype=np.float64)))
+    cdef const double[::1] zhigh = np.ascontiguousarray(zmax, dtype=np.float64)
+    cdef const double[:, ::1] soa = host_constants(hosts) if constants is None else constants
+    cdef const double[::1] sigma_z
+    if window > 0.0:
+        sigma_z = host_redshift_widths(np.asarray(hosts), np.asarray(offsets)) if widths is None else widths
+    cdef double[::1] terms
+    if out is None:
+        terms = np.empty(M, dtype=np.float64)
+    else:
+        terms = out
+        if terms.shape[0] != M:
+            raise ValueError("out must have one entry per event")
+    threads = likelihood_threads(threads, M)
+    cdef const Py_ssize_t[::1] chunks = balanced_event_chunks(offsets, threads)
+    with nogil:
+        for c in prange(threads, num_threads = threads, schedule = 'static', chunksize = 1):
+            for j in range(chunks[c], chunks[c+1]):
+                if density is not None:
+                    terms[j] = _logLikelihood_event(density.evaluate(j, event_redshifts[j]), meandl[j], sigma[j], omega, event_redshifts[j],
+                                                    em_selection, zlow[j], zhigh[j], log_norms[j])
+                    continue
+                first = offsets[j]
+                last  = offsets[j+1]
+                if window > 0.0:
+                    _host_window(soa[0], &first, &last, event_redshifts[j], window*sigma_z[j])
+                terms[j] = _logLikelihood_event(_log_host_density_cached(soa, first, last, event_redshifts[j]), meandl[j], sigma[j], omega, event_redshifts[j],
+                                                em_selection, zlow[j], zhigh[j], log_norms[j])
+        # summed in event order, so that the result does not depend on the number of threads
+        for j in range(M):
+            logL += terms[j]
+    return logL
+
+def _log_norm_gradients(CosmologicalParameters omega, zmax):
+    """
+    gradient of the log redshift prior normalisation of every event,
+    computed once per distinct upper bound
+    """
+    unique, inverse = np.unique(zmax, return_inverse=True)
+    return np.ascontiguousarray(np.array([omega.LogNormalisationGradient(z) for z in unique]).reshape(-1, NGRADIENT)[inverse])
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def logLikelihood_multiple_events_gradient(const double[:, ::1] hosts, const Py_ssize_t[::1] offsets, const double[::1] meandl, const double[::1] sigma, CosmologicalParameters omega, const double[::1] event_redshifts, int em_selection = 0, zmin = None, zmax = None, double window = 0.0, widths = None, HostDensityTable density = None, constants = None, int threads = 1):
+    """
+    logLikelihood_multiple_events and its gradient, for Hamiltonian sampling.
+    The derivatives of the distances and of the redshift prior come from the
+    cosmology (CosmologicalParameters.LogDistanceGradient), those of the host sum,
+    of the weak lensing error and of the em selection function are analytic
+    Parameters: see logLikelihood_multiple_events
+    Returns the total log likelihood, its gradient with respect to (h, om, ol, w0, w1)
+    and its gradient with respect to the event redshifts
+    """
+    cdef Py_ssize_t c, j, first, last
+    cdef double host_density, dhost_density
+    cdef Py_ssize_t M = event_redshifts.shape[0]
+    if offsets.shape[0] != M+1 or meandl.shape[0] != M or sigma.shape[0] != M:
+        raise ValueError("offsets must have one entry more than the events, meandl and sigma one per event")
+    if zmin is None: zmin = np.zeros(M, dtype=np.float64)
+    if zmax is None: zmax = np.ones(M, dtype=np.float64)
+    zmax = np.ascontiguousarray(zmax, dtype=np.float64)
+    cdef const double[::1] log_norms = np.log(omega.IntegrateComovingVolumeDensityArray(zmax))
+    cdef const double[:, ::1] dlog_norms = _log_norm_gradients(omega, zmax)
+    cdef const double[:, ::1] soa = host_constants(hosts) if constants is None else constants
+    cdef const double[::1] sigma_z
+    if window > 0.0:
+        sigma_z = host_redshift_widths(np.asarray(hosts), np.asarray(offsets)) if widths is None else widths
+    terms = np.empty(M, dtype=np.float64)
+    gradients = np.empty((M, NGRADIENT), dtype=np.float64)
+    cdef double[::1] t = terms
+    cdef double[:, ::1] g = gradients
+    threads = likelihood_threads(threads, M)
+    cdef const Py_ssize_t[::1] chunks = balanced_event_chunks(offsets, threads)
+    with nogil:
+        for c in prange(threads, num_threads = threads, schedule = 'static', chunksize = 1):
+            for j in range(chunks[c], chunks[c+1]):
+                if density is not None:
+                    host_density  = density.evaluate(j, event_redshifts[j])
+                    dhost_density = density.derivative(j, event_redshifts[j])
+                else:
+                    first = offsets[j]
+                    last  = offsets[j+1]
+                    if window > 0.0:
+                        _host_window(soa[0], &first, &last, event_redshifts[j], window*sigma_z[j])
+                    host_density  = _log_host_density_cached(soa, first, last, event_redshifts[j])
+                    dhost_density = _log_host_density_derivative(soa, first, last, event_redshifts[j], host_density)
+                t[j] = _logLikelihood_event_gradient(host_density, dhost_density, meandl[j], sigma[j], omega, event_redshifts[j],
+                                                     em_selection, log_norms[j], &dlog_norms[j, 0], &g[j, 0])
+    return np.sum(terms), np.sum(gradients[:,D_H:], axis=0), np.ascontiguousarray(gradients[:,D_Z])
+
+# standard deviations of the DL likelihood on either side of meandl
+# covered by the redshift grid of an event with marginalised redshift
+DEF MARGINAL_CUT = 8.0
+# hosts narrower than 1/GAUSS_HERMITE_RATIO of the DL likelihood, in redshift,
+# are integrated by Gauss-Hermite quadrature, the others on the grid
+DEF GAUSS_HERMITE_RATIO = 3.0
+DEF WINDOW_BISECTIONS = 30
+DEF MAX_CELLS = 1099511627776.0
+
+@cython.cdivision(True)
+cdef double _distance_residual(double meandl, double sigma, CosmologicalParameters omega, double z) nogil:
+    """
+    (dl(z)-meandl)/Sigma(z), with Sigma including the weak lensing error
+    """
+    cdef double dl = omega._evaluate(LUMINOSITY_DISTANCE, z)
+    cdef double weak_lensing_error = sigma_weak_lensing(z, dl)
+    return (dl-meandl)/sqrt(sigma*sigma+weak_lensing_error*weak_lensing_error)
+
+@cython.cdivision(True)
+cdef double _residual_crossing(double meandl, double sigma, CosmologicalParameters omega, double zmin, double zmax, double target) nogil:
+    """
+    redshift in [zmin, zmax] where _distance_residual crosses target, by bisection.
+    zmin (zmax) if the residual is above (below) target everywhere
+    """
+    cdef int i
+    cdef double z
+    cdef double a = zmin, b = zmax
+    if _distance_residual(meandl, sigma, omega, a) >= target: return zmin
+    if _distance_residual(meandl, sigma, omega, b) <= target: return zmax
+    for i in range(WINDOW_BISECTIONS):
+        z = 0.5*(a+b)
+        if _distance_residual(meandl, sigma, omega, z) < target: a = z
+        else: b = z
+    return 0.5*(a+b)
+
+@cython.cdivision(True)
+cdef void _marginal_grid(double meandl, double sigma, CosmologicalParameters omega, double zmin, double zmax, Py_ssize_t npoints, Py_ssize_t *cells, Py_ssize_t *first, Py_ssize_t *last) nogil:
+    """
+    redshift grid of an event: the points zmin+k*(zmax-zmin)/cells, k = first...last,
+    covering the part of [zmin, zmax] where the DL likelihood is within MARGINAL_CUT
+    standard deviations of meandl, or all of it if there is no such part. cells is the smallest power of two that puts at least
+    npoints-1 cells across that window, so the points do not move with the cosmology
+    until the width of the window changes by a factor two
+    """
+    cdef double zlow  = _residual_crossing(meandl, sigma, omega, zmin, zmax, -MARGINAL_CUT)
+    cdef double zhigh = _residual_crossing(meandl, sigma, omega, zlow, zmax, MARGINAL_CUT)
+    cdef double step
+    if zhigh <= zlow:
+        # further than the cut everywhere
+        zlow  = zmin
+        zhigh = zmax
+    cells[0] = 2
+    while cells[0] < MAX_CELLS and cells[0]*(zhigh-zlow) < (npoints-1)*(zmax-zmin):
+        cells[0] *= 2
+    step     = (zmax-zmin)/cells[0]
+    first[0] = <Py_ssize_t>((zlow-zmin)/step)
+    last[0]  = <Py_ssize_t>ceil((zhigh-zmin)/step)
+    if last[0] > cells[0]: last[0] = cells[0]
+    if first[0] > last[0]-2: first[0] = last[0]-2
+    if first[0] < 0:
+        first[0] = 0
+        last[0]  = 2
+
+@cython.cdivision(True)
+cdef inline Py_ssize_t _grid_ceil(double x, Py_ssize_t first, Py_ssize_t last) nogil:
+    """
+    index of the first grid point at or after x, in units of the grid step, within [first, last+1]
+    """
+    if x <= first: return first
+    if x > last: return last+1
+    return <Py_ssize_t>ceil(x)
+
+@cython.cdivision(True)
+cdef inline Py_ssize_t _quadratic_weights(double x, Py_ssize_t first, Py_ssize_t last, double *w) nogil:
+    """
+    first of the three grid points nearest to x, in units of the grid step,
+    within [first, last], and the weights at x of the quadratic through them
+    """
+    cdef Py_ssize_t k = <Py_ssize_t>(x+0.5)-1
+    cdef double t
+    if k < first: k = first
+    if k > last-2: k = last-2
+    t = x-(k+1)
+    w[0] = 0.5*t*(t-1.0)
+    w[1] = (1.0-t)*(1.0+t)
+    w[2] = 0.5*t*(t+1.0)
+    return k
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline double _quadratic_interpolation(const double[::1] values, Py_ssize_t i, const double *w) nogil:
+    # next to a zero of the tabulated density (z = 0) the quadratic is meaningless
+    if values[i] == -INFINITY or values[i+1] == -INFINITY or values[i+2] == -INFINITY:
+        return -INFINITY
+    return w[0]*values[i]+w[1]*values[i+1]+w[2]*values[i+2]
+
+@cython.cdivision(True)
+cdef inline double _log_simpson_weight(Py_ssize_t k, Py_ssize_t cells, double step) nogil:
+    """
+    log weight of the point k of Simpson's rule over cells (even) cells of width step
+    """
+    return log(step/3.0*(1.0 if k == 0 or k == cells else (4.0 if k%2 == 1 else 2.0)))
+
+cdef inline double _log_add_gradient(double logL, double *dlogL, double term, const double *dterm) nogil:
+    """
+    log_add(logL, term), updating dlogL from the gradient of logL to the one of the sum
+    """
+    cdef int l
+    cdef double logLnew
+    if term == -INFINITY: return logL
+    logLnew = log_add(logL, term)
+    for l in range(NGRADIENT):
+        dlogL[l] = dlogL[l]*exp(logL-logLnew)+dterm[l]*exp(term-logLnew)
+    return logLnew
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef double _simpson_weighted(const double[::1] log_f, Py_ssize_t cells, Py_ssize_t ka, Py_ssize_t kb, double step, double[::1] weighted) nogil:
+    """
+    log_f times the Simpson weights, relative to their largest value, in weighted.
+    Returns the log of the largest value
+    """
+    cdef Py_ssize_t k
+    cdef double scale = -INFINITY
+    for k in range(ka, kb+1):
+        weighted[k-ka] = log_f[k-ka]+_log_simpson_weight(k, cells, step)
+        if weighted[k-ka] > scale: scale = weighted[k-ka]
+    if scale == -INFINITY: scale = 0.0
+    for k in range(kb-ka+1):
+        weighted[k] = exp(weighted[k]-scale)
+    return scale
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef double _gaussian_sum(const double[::1] weighted, Py_ssize_t a, Py_ssize_t b, double score, double dscore, const double[:, ::1] dlog_f, double *dsum) nogil:
+    """
+    sum over i = a...b-1 of weighted[i]*exp(-0.5*(score+(i-a)*dscore)**2), the Gaussian by a
+    recurrence rather than one exponential per point. If dlog_f is not None, dsum is set to
+    the sum of the same terms times dlog_f[i]
+    """
+    cdef Py_ssize_t i
+    cdef int l
+    cdef double term
+    cdef double res   = 0.0
+    cdef double gauss = exp(-0.5*score*score)
+    cdef double ratio = exp(-(score*dscore+0.5*dscore*dscore))
+    cdef double decay = exp(-dscore*dscore)
+    if dlog_f is not None:
+        for l in range(NGRADIENT):
+            dsum[l] = 0.0
+    for i in range(a, b):
+        term   = weighted[i]*gauss
+        res   += term
+        if dlog_f is not None:
+            for l in range(NGRADIENT):
+                dsum[l] += term*dlog_f[i, l]
+        gauss *= ratio
+        ratio *= decay
+    return res
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef double _logLikelihood_marginalised_grid(const double[:, ::1] constants, Py_ssize_t first, Py_ssize_t last, double meandl, double sigma, CosmologicalParameters omega, int em_selection, double zmin, double zmax, double log_norm, Py_ssize_t cells, Py_ssize_t ka, Py_ssize_t kb, const double[::1] gh_nodes, const double[::1] gh_log_weights, double[::1] log_f, double[::1] log_c, double[::1] weighted, double *log_hosts) nogil:
+    """
+    likelihood of a single GW event integrated over its redshift, on the points ka...kb
+    of a grid of cells cells over [zmin, zmax] (see _marginal_grid).
+    The DL likelihood times the redshift prior (times p(G|O)), log_f, and times p(notG|O), log_c,
+    are tabulated on the grid. A host narrower than the likelihood is integrated by Gauss-Hermite
+    quadrature over its Gaussian, with log_f interpolated by quadratics, a wider one with
+    Simpson's rule on the grid, as are the non-detected galaxies. If log_hosts is not NULL
+    the contribution of each host, then the one of the non-detected galaxies, are stored in it
+    """
+    cdef Py_ssize_t i, g, k, a, b
+    cdef double step = (zmax-zmin)/cells
+    cdef double narrow = (kb-ka)*step/(2.0*MARGINAL_CUT*GAUSS_HERMITE_RATIO)
+    cdef double z, sigma_z, score_z, log_weight, host, scale, logp_detection = 0.0
+    cdef double w[3]
+    cdef double logL = -INFINITY
+    cdef double logLn = -INFINITY
+    cdef double logTwoPiByTwo = 0.5*log(2.0*M_PI)
+    for k in range(ka, kb+1):
+        i = k-ka
+        log_f[i] = _log_distance_and_prior(meandl, sigma, omega, zmin+k*step, em_selection, zmax, log_norm, &logp_detection)
+        log_c[i] = log_f[i]+log_one_minus_exp(logp_detection) if em_selection == 1 else -INFINITY
+        log_f[i] += logp_detection
+    scale = _simpson_weighted(log_f, cells, ka, kb, step, weighted)
+    # hosts: w_g \int N(z; z_g, sigma_g) f(z) dz
+    for g in range(first, last):
+        host    = -INFINITY
+        sigma_z = 1.0/constants[1,g]
+        if sigma_z <= narrow:
+            log_weight = constants[2,g]+log(sigma_z)+logTwoPiByTwo
+            for i in range(gh_nodes.shape[0]):
+                z = (constants[0,g]+sqrt(2.0)*sigma_z*gh_nodes[i]-zmin)/step
+                if z < ka or z > kb: continue
+                k = _quadratic_weights(z, ka, kb, w)
+                host = log_add(host, log_weight+gh_log_weights[i]+_quadratic_interpolation(log_f, k-ka, w))
+        else:
+            a = _grid_ceil((constants[0,g]-HOST_CUT*sigma_z-zmin)/step, ka, kb)
+            b = _grid_ceil((constants[0,g]+HOST_CUT*sigma_z-zmin)/step, ka, kb)
+            host = _gaussian_sum(weighted, a-ka, b-ka, (zmin+a*step-constants[0,g])*constants[1,g], step*constants[1,g], None, NULL)
+            if host > 0.0:
+                host = scale+constants[2,g]+log(host)
+            else:
+                # underflow, far in the tail of the likelihood
+                host = -INFINITY
+                for k in range(a, b):
+                    score_z = (zmin+k*step-constants[0,g])*constants[1,g]
+                    host = log_add(host, constants[2,g]-0.5*score_z*score_z+log_f[k-ka]+_log_simpson_weight(k, cells, step))
+        if log_hosts != NULL: log_hosts[g-first] = host
+        logL = log_add(logL, host)
+    # non-detected galaxies: \int f(z)(1-p(G|O)) dz
+    if em_selection == 1:
+        for k in range(ka, kb+1):
+            logLn = log_add(logLn, log_c[k-ka]+_log_simpson_weight(k, cells, step))
+    if log_hosts != NULL: log_hosts[last-first] = logLn
+    return log_add(logL, logLn)
+
+cdef double _logLikelihood_marginalised_event(const double[:, ::1] constants, Py_ssize_t first, Py_ssize_t last, double meandl, double sigma, CosmologicalParameters omega, int em_selection, double zmin, double zmax, double log_norm, const double[::1] gh_nodes, const double[::1] gh_log_weights, double[::1] log_f, double[::1] log_c, double[::1] weighted, double *grid, double *log_hosts) nogil:
+    """
+    likelihood of a single GW event integrated over its redshift in [zmin, zmax].
+    The integrand is negligible further than MARGINAL_CUT standard deviations of the
+    DL likelihood from meandl, so it is tabulated only there, with a fixed number of points
+    per standard deviation of the event redshift whatever sigma (_marginal_grid).
+    Far from every host, with nothing left in the window, the whole of [zmin, zmax] is
+    used instead, so that the likelihood stays finite.
+    log_f, log_c and weighted need 2*npoints entries. grid, if not NULL, is set to the first redshift,
+    the step and the number of points of the grid, and log_hosts as in _logLikelihood_marginalised_grid
+    """
+    cdef Py_ssize_t npoints = log_f.shape[0]//2
+    cdef Py_ssize_t cells, ka, kb
+    cdef double logL
+    _marginal_grid(meandl, sigma, omega, zmin, zmax, npoints, &cells, &ka, &kb)
+    logL = _logLikelihood_marginalised_grid(constants, first, last, meandl, sigma, omega, em_selection, zmin, zmax, log_norm,
+                                            cells, ka, kb, gh_nodes, gh_log_weights, log_f, log_c, weighted, log_hosts)
+    if logL == -INFINITY and (ka > 0 or kb < cells):
+        cells = 2
+        while cells < npoints-1: cells *= 2
+        ka = 0
+        kb = cells
+        logL = _logLikelihood_marginalised_grid(constants, first, last, meandl, sigma, omega, em_selection, zmin, zmax, log_norm,
+                                                cells, ka, kb, gh_nodes, gh_log_weights, log_f, log_c, weighted, log_hosts)
+    if grid != NULL:
+        grid[1] = (zmax-zmin)/cells
+        grid[0] = zmin+ka*grid[1]
+        grid[2] = kb-ka+1
+    return logL
+
+def _gauss_hermite(int order):
+    """
+    Gauss-Hermite nodes and log weights for the average over a unit Gaussian
+    in the variable sqrt(2)*x
+    """
+    x, w = np.polynomial.hermite.hermgauss(order)
+    return np.ascontiguousarray(x), np.ascontiguousarray(np.log(w/np.sqrt(np.pi)))
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def logLikelihood_marginalised(const double[:, ::1] hosts, const Py_ssize_t[::1] offsets, const double[::1] meandl, const double[::1] sigma, CosmologicalParameters omega, int em_selection = 0, zmin = None, zmax = None, out = None, constants = None, int npoints = 201, int order = 5, int threads = 1):
+    """
+    Joint likelihood of a set of GW events with the redshift of each event
+    marginalised over [zmin, zmax] by fixed order quadrature, so that the event redshifts
+    are not sampled. The redshift posteriors can be recovered afterwards with draw_event_redshifts
+    Parameters:
+    ===============
+    hosts, offsets, meandl, sigma, omega, em_selection, zmin, zmax, out, constants, threads: see logLikelihood_multiple_events
+    npoints: :obj:'int': minimum number of redshift grid points of each event within 8 standard
+             deviations of the DL likelihood on either side of meandl, so the default is at least
+             12 points per standard deviation of the event redshift. default = 201
+    order: :obj:'int': Gauss-Hermite order of the integral over each host narrower than a third
+           of the DL likelihood in redshift, the wider ones are integrated on the grid. default = 5
+    Returns the total log likelihood
+    """
+    cdef Py_ssize_t c, j
+    cdef Py_ssize_t M = meandl.shape[0]
+    cdef double logL = 0.0
+    if npoints < 3:
+        raise ValueError("npoints must be at least 3")
+    if offsets.shape[0] != M+1 or sigma.shape[0] != M:
+        raise ValueError("offsets must have one entry more than the events, sigma one per event")
+    if zmin is None: zmin = np.zeros(M, dtype=np.float64)
+    if zmax is None: zmax = np.ones(M, dtype=np.float64)
+    cdef const double[::1] zlow  = np.ascontiguousarray(zmin, dtype=np.float64)
+    cdef const double[::1] zhigh = np.ascontiguousarray(zmax, dtype=np.float64)
+    cdef const double[::1] log_norms = np.log(omega.IntegrateComovingVolumeDensityArray(np.ascontiguousarray(zmax, dtype=np.float64)))
+    cdef const double[:, ::1] soa = host_constants(hosts) if constants is None else constants
+    nodes, log_weights = _gauss_hermite(order)
+    cdef const double[::1] gh_nodes = nodes
+    cdef const double[::1] gh_log_weights = log_weights
+    threads = likelihood_threads(threads, M)
+    cdef const Py_ssize_t[::1] chunks = balanced_event_chunks(offsets, threads)
+    # one redshift grid per chunk
+    cdef double[:, ::1] log_f = np.empty((threads, 2*npoints), dtype=np.float64)
+    cdef double[:, ::1] log_c = np.empty((threads, 2*npoints), dtype=np.float64)
+    cdef double[:, ::1] weighted = np.empty((threads, 2*npoints), dtype=np.float64)
+    out = _output_array(out, M)
+    cdef double[::1] terms = out
+    with nogil:
+        for c in prange(threads, num_threads = threads, schedule = 'static', chunksize = 1):
+            for j in range(chunks[c], chunks[c+1]):
+                terms[j] = _logLikelihood_marginalised_event(soa, offsets[j], offsets[j+1], meandl[j], sigma[j], omega, em_selection,
+                                                             zlow[j], zhigh[j], log_norms[j], gh_nodes, gh_log_weights, log_f[c], log_c[c], weighted[c], NULL, NULL)
+        for j in range(M):
+            logL += terms[j]
+    return logL
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef double _logLikelihood_marginalised_grid_gradient(const double[:, ::1] constants, Py_ssize_t first, Py_ssize_t last, double meandl, double sigma, CosmologicalParameters omega, int em_selection, double zmin, double zmax, double log_norm, const double *dlog_norm, Py_ssize_t cells, Py_ssize_t ka, Py_ssize_t kb, const double[::1] gh_nodes, const double[::1] gh_log_weights, double[::1] log_f, double[::1] log_c, double[::1] weighted, double[:, ::1] dlog_f, double[:, ::1] dlog_c, double *grad) nogil:
+    """
+    _logLikelihood_marginalised_grid and its gradient grad with respect to the parameters,
+    from the gradients dlog_f and dlog_c of the tabulated integrands, interpolated in the same way
+    """
+    cdef Py_ssize_t i, g, k, l, a, b
+    cdef double step = (zmax-zmin)/cells
+    cdef double narrow = (kb-ka)*step/(2.0*MARGINAL_CUT*GAUSS_HERMITE_RATIO)
+    cdef double z, sigma_z, score_z, log_weight, term, scale, logp_nondetection, logp_detection = 0.0
+    cdef double w[3]
+    cdef double logL = -INFINITY
+    cdef double logLn = -INFINITY
+    cdef double logTwoPiByTwo = 0.5*log(2.0*M_PI)
+    cdef double dlogp_detection[NGRADIENT]
+    cdef double dterm[NGRADIENT]
+    cdef double dlogL[NGRADIENT]
+    cdef double dlogLn[NGRADIENT]
+    for l in range(NGRADIENT):
+        dlogL[l]  = 0.0
+        dlogLn[l] = 0.0
+    for k in range(ka, kb+1):
+        i = k-ka
+        log_f[i] = _log_distance_and_prior_gradient(meandl, sigma, omega, zmin+k*step, em_selection, log_norm, dlog_norm, &logp_detection, &dlog_f[i, 0], dlogp_detection)
+        if em_selection == 1:
+            logp_nondetection = log_one_minus_exp(logp_detection)
+            log_c[i] = log_f[i]+logp_nondetection
+            log_f[i] += logp_detection
+            for l in range(NGRADIENT):
+                dlog_c[i, l] = dlog_f[i, l]-exp(logp_detection-logp_nondetection)*dlogp_detection[l]
+                dlog_f[i, l] += dlogp_detection[l]
+        else:
+            log_c[i] = -INFINITY
+    scale = _simpson_weighted(log_f, cells, ka, kb, step, weighted)
+    # hosts, accumulating the gradient as a running weighted average of the terms
+    for g in range(first, last):
+        sigma_z = 1.0/constants[1,g]
+        if sigma_z <= narrow:
+            log_weight = constants[2,g]+log(sigma_z)+logTwoPiByTwo
+            for i in range(gh_nodes.shape[0]):
+                z = (constants[0,g]+sqrt(2.0)*sigma_z*gh_nodes[i]-zmin)/step
+                if z < ka or z > kb: continue
+                k = _quadratic_weights(z, ka, kb, w)-ka
+                term = log_weight+gh_log_weights[i]+_quadratic_interpolation(log_f, k, w)
+                for l in range(NGRADIENT):
+                    dterm[l] = w[0]*dlog_f[k, l]+w[1]*dlog_f[k+1, l]+w[2]*dlog_f[k+2, l]
+                logL = _log_add_gradient(logL, dlogL, term, dterm)
+        else:
+            a = _grid_ceil((constants[0,g]-HOST_CUT*sigma_z-zmin)/step, ka, kb)
+            b = _grid_ceil((constants[0,g]+HOST_CUT*sigma_z-zmin)/step, ka, kb)
+            term = _gaussian_sum(weighted, a-ka, b-ka, (zmin+a*step-constants[0,g])*constants[1,g], step*constants[1,g], dlog_f, dterm)
+            if term > 0.0:
+                for l in range(NGRADIENT):
+                    dterm[l] /= term
+                logL = _log_add_gradient(logL, dlogL, scale+constants[2,g]+log(term), dterm)
+            else:
+                # underflow, far in the tail of the likelihood
+                for k in range(a, b):
+                    score_z = (zmin+k*step-constants[0,g])*constants[1,g]
+                    term = constants[2,g]-0.5*score_z*score_z+log_f[k-ka]+_log_simpson_weight(k, cells, step)
+                    logL = _log_add_gradient(logL, dlogL, term, &dlog_f[k-ka, 0])
+    # non-detected galaxies
+    if em_selection == 1:
+        for k in range(ka, kb+1):
+            logLn = _log_add_gradient(logLn, dlogLn, log_c[k-ka]+_log_simpson_weight(k, cells, step), &dlog_c[k-ka, 0])
+    term = log_add(logL, logLn)
+    for l in range(NGRADIENT):
+        grad[l] = 0.0 if term == -INFINITY else dlogL[l]*exp(logL-term)+dlogLn[l]*exp(logLn-term)
+    grad[D_Z] = 0.0
+    return term
+
+cdef double _logLikelihood_marginalised_event_gradient(const double[:, ::1] constants, Py_ssize_t first, Py_ssize_t last, double meandl, double sigma, CosmologicalParameters omega, int em_selection, double zmin, double zmax, double log_norm, const double *dlog_norm, const double[::1] gh_nodes, const double[::1] gh_log_weights, double[::1] log_f, double[::1] log_c, double[::1] weighted, double[:, ::1] dlog_f, double[:, ::1] dlog_c, double *grad) nogil:
+    """
+    _logLikelihood_marginalised_event and its gradient grad with respect to the parameters
+    """
+    cdef Py_ssize_t npoints = log_f.shape[0]//2
+    cdef Py_ssize_t cells, ka, kb
+    cdef double logL
+    _marginal_grid(meandl, sigma, omega, zmin, zmax, npoints, &cells, &ka, &kb)
+    logL = _logLikelihood_marginalised_grid_gradient(constants, first, last, meandl, sigma, omega, em_selection, zmin, zmax, log_norm, dlog_norm,
+                                                     cells, ka, kb, gh_nodes, gh_log_weights, log_f, log_c, weighted, dlog_f, dlog_c, grad)
+    if logL == -INFINITY and (ka > 0 or kb < cells):
+        cells = 2
+        while cells < npoints-1: cells *= 2
+        logL = _logLikelihood_marginalised_grid_gradient(constants, first, last, meandl, sigma, omega, em_selection, zmin, zmax, log_norm, dlog_norm,
+                                                         cells, 0, cells, gh_nodes, gh_log_weights, log_f, log_c, weighted, dlog_f, dlog_c, grad)
+    return logL
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def logLikelihood_marginalised_gradient(const double[:, ::1] hosts, const Py_ssize_t[::1] offsets, const double[::1] meandl, const double[::1] sigma, CosmologicalParameters omega, int em_selection = 0, zmin = None, zmax = None, constants = None, int npoints = 201, int order = 5, int threads = 1):
+    """
+    logLikelihood_marginalised and its gradient, for Hamiltonian sampling
+    Parameters: see logLikelihood_marginalised
+    Returns the total log likelihood and its gradient with respect to (h, om, ol, w0, w1)
+    """
+    cdef Py_ssize_t c, j
+    cdef Py_ssize_t M = meandl.shape[0]
+    if npoints < 3:
+        raise ValueError("npoints must be at least 3")
+    if offsets.shape[0] != M+1 or sigma.shape[0] != M:
+        raise ValueError("offsets must have one entry more than the events, sigma one per event")
+    if zmin is None: zmin = np.zeros(M, dtype=np.float64)
+    if zmax is None: zmax = np.ones(M, dtype=np.float64)
+    cdef const double[::1] zlow  = np.ascontiguousarray(zmin, dtype=np.float64)
+    cdef const double[::1] zhigh = np.ascontiguousarray(zmax, dtype=np.float64)
+    cdef const double[::1] log_norms = np.log(omega.IntegrateComovingVolumeDensityArray(np.ascontiguousarray(zmax, dtype=np.float64)))
+    cdef const double[:, ::1] dlog_norms = _log_norm_gradients(omega, np.ascontiguousarray(zmax, dtype=np.float64))
+    cdef const double[:, ::1] soa = host_constants(hosts) if constants is None else constants
+    nodes, log_weights = _gauss_hermite(order)
+    cdef const double[::1] gh_nodes = nodes
+    cdef const double[::1] gh_log_weights = log_weights
+    threads = likelihood_threads(threads, M)
+    cdef const Py_ssize_t[::1] chunks = balanced_event_chunks(offsets, threads)
+    cdef double[:, ::1] log_f = np.empty((threads, 2*npoints), dtype=np.float64)
+    cdef double[:, ::1] log_c = np.empty((threads, 2*npoints), dtype=np.float64)
+    cdef double[:, ::1] weighted = np.empty((threads, 2*npoints), dtype=np.float64)
+    cdef double[:, :, ::1] dlog_f = np.empty((threads, 2*npoints, NGRADIENT), dtype=np.float64)
+    cdef double[:, :, ::1] dlog_c = np.zeros((threads, 2*npoints, NGRADIENT), dtype=np.float64)
+    terms = np.empty(M, dtype=np.float64)
+    gradients = np.empty((M, NGRADIENT), dtype=np.float64)
+    cdef double[::1] t = terms
+    cdef double[:, ::1] g = gradients
+    with nogil:
+        for c in prange(threads, num_threads = threads, schedule = 'static', chunksize = 1):
+            for j in range(chunks[c], chunks[c+1]):
+                t[j] = _logLikelihood_marginalised_event_gradient(soa, offsets[j], offsets[j+1], meandl[j], sigma[j], omega, em_selection,
+                                                                  zlow[j], zhigh[j], log_norms[j], &dlog_norms[j, 0], gh_nodes, gh_log_weights,
+                                                                  log_f[c], log_c[c], weighted[c], dlog_f[c], dlog_c[c], &g[j, 0])
+    return np.sum(terms), np.sum(gradients[:,D_H:], axis=0)
+
+def draw_event_redshifts(const double[:, ::1] hosts, const Py_ssize_t[::1] offsets, const double[::1] meandl, const double[::1] sigma, CosmologicalParameters omega, int em_selection = 0, zmin = None, zmax = None, constants = None, int npoints = 201, int order = 5, rng = None):
+    """
+    Draw one redshift per event from its posterior given the cosmology omega,
+    to reconstruct the event redshifts of a run with marginalised redshifts:
+    either a host, chosen with its marginalised weight, and a redshift from its Gaussian
+    (times the tabulated DL likelihood, for the hosts integrated on the grid), or,
+    with the probability of the non-detected galaxies, a redshift from the tabulated continuum.
+    Parameters: see logLikelihood_marginalised
+    rng: :obj:'numpy.random.RandomState'. optional. default = numpy.random
+    """
+    cdef Py_ssize_t j
+    cdef Py_ssize_t M = meandl.shape[0]
+    cdef double grid[3]
+    cdef double[::1] log_hosts = np.empty(1+np.max(np.diff(offsets), initial = 0), dtype=np.float64)
+    if rng is None: rng = np.random
+    if zmin is None: zmin = np.zeros(M, dtype=np.float64)
+    if zmax is None: zmax = np.ones(M, dtype=np.float64)
+    soa = np.asarray(host_constants(hosts) if constants is None else constants)
+    log_norms = np.log(omega.IntegrateComovingVolumeDensityArray(np.ascontiguousarray(zmax, dtype=np.float64)))
+    nodes, log_weights = _gauss_hermite(order)
+    log_f = np.empty(2*npoints, dtype=np.float64)
+    log_c = np.empty(2*npoints, dtype=np.float64)
+    weighted = np.empty(2*npoints, dtype=np.float64)
+    redshifts = np.empty(M, dtype=np.float64)
+    for j in range(M):
+        _logLikelihood_marginalised_event(soa, offsets[j], offsets[j+1], meandl[j], sigma[j], omega, em_selection,
+                                          zmin[j], zmax[j], log_norms[j], nodes, log_weights, log_f, log_c, weighted, grid, &log_hosts[0])
+        n  = int(grid[2])
+        z  = grid[0]+grid[1]*np.arange(n)
+        zg, sg = soa[0,offsets[j]:offsets[j+1]], 1.0/soa[1,offsets[j]:offsets[j+1]]
+        # marginalised weight of every host, then of the non-detected galaxies
+        log_p = np.asarray(log_hosts)[:len(zg)+1]
+        p = np.exp(log_p-np.max(log_p))
+        k = rng.choice(len(p), p = p/p.sum())
+        if k < len(zg) and sg[k] <= (n-1)*grid[1]/(2.0*MARGINAL_CUT*GAUSS_HERMITE_RATIO):
+            redshifts[j] = np.clip(rng.normal(zg[k], sg[k]), zmin[j], zmax[j])
+        else:
+            log_density = log_f[:n]-0.5*((z-zg[k])/sg[k])**2 if k < len(zg) else log_c[:n]
+            cdf = np.cumsum(np.exp(log_density-np.max(log_density)))
+            redshifts[j] = np.interp(rng.uniform(0.0, cdf[-1]), cdf, z)
+    return redshifts
+
+cpdef double sigma_weak_lensing(double z, double dl) nogil:
     """
     Weak lensing error. From <REF>
     Parameters:
@@ -88,28 +1113,257 @@ cpdef double sigma_weak_lensing(double z, double dl):
 
 @cython.cdivision(True)
 @cython.boundscheck(False)
-cpdef double em_selection_function(double dl):
+cpdef double em_selection_function(double dl) nogil:
     return (1.0-dl/12000.)/(1.0+(dl/3700.0)**7)**1.35
 
+@cython.cdivision(True)
+cdef double em_selection_function_log_derivative(double dl) nogil:
+    """
+    derivative of log em_selection_function with respect to dl
+    """
+    cdef double x7 = (dl/3700.0)**7
+    return -1.0/(12000.0-dl)-1.35*7.0*x7/(dl*(1.0+x7))
+
 @cython.cdivision(True)
 @cython.boundscheck(False)
-cpdef double em_selection_function_number_density(double dl):
+cpdef double em_selection_function_number_density(double dl) nogil:
     return (1.0)/(1.0+(dl/3700.0)**7)**1.35
 
-cpdef double em_selection_function_normalisation(double zmin, double zmax, object omega, int N = 1):
-    cdef int i = 0
-    cdef double z = zmin, dz = (zmax-zmin)/100.
-    cdef double res = -np.inf
-    cdef double tmp
-    for i in range(0,100):
-        dl = omega.LuminosityDistance(z)
-        tmp = N*(log(1.0-em_selection_function(dl))+log(omega.ComovingVolumeElement(z)))#
-        res = log_add(res,tmp)
-        z   += dz
-    return res+log(dz)
-
-cdef double find_redshift(object omega, double dl):
-    return newton(objective,1.0,args=(omega,dl))
-
-cdef double objective(double z, object omega, double dl):
-    return dl - omega.LuminosityDistance(z)
+cdef object _output_array(object out, Py_ssize_t n):
+    if out is None:
+        return np.empty(n, dtype=np.float64)
+    if np.shape(out) != (n,):
+        raise ValueError("out must have the same shape as the input")
+    return out
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def sigma_weak_lensing_array(const double[::1] z, const double[::1] dl, out = None):
+    """
+    Weak lensing error for arrays of redshifts and luminosity distances (see sigma_weak_lensing)
+    """
+    cdef Py_ssize_t i
+    if dl.shape[0] != z.shape[0]:
+        raise ValueError("z and dl must have the same shape")
+    out = _output_array(out, z.shape[0])
+    cdef double[::1] res = out
+    with nogil:
+        for i in range(z.shape[0]):
+            res[i] = sigma_weak_lensing(z[i], dl[i])
+    return out
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def em_selection_function_array(const double[::1] dl, out = None):
+    """
+    EM selection function for an array of luminosity distances (see em_selection_function)
+    """
+    cdef Py_ssize_t i
+    out = _output_array(out, dl.shape[0])
+    cdef double[::1] res = out
+    with nogil:
+        for i in range(dl.shape[0]):
+            res[i] = em_selection_function(dl[i])
+    return out
+
+# quadrature rules of em_selection_function_normalisation
+em_selection_rules = ('rectangle', 'gauss')
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cpdef double em_selection_function_normalisation(double zmin, double zmax, CosmologicalParameters omega, int N = 1, object rule = 'rectangle', int npoints = 100):
+    """
+    log of the integral over [zmin, zmax] of ((1-p(dl(z)))*dVc/dz)^N, with p the
+    EM selection function. The result is memoized on omega for the current
+    cosmology, so repeated calls for the same (zmin, zmax, N) and quadrature are free
+    Parameters:
+    ===============
+    zmin, zmax: :obj:'numpy.double': redshift bounds
+    omega: :obj:'cosmology.CosmologicalParameters': cosmological parameter structure
+    N: :obj:'int': power of the integrand. default = 1
+    rule: :obj:'str': quadrature rule, 'rectangle' (left Riemann sum) or 'gauss' (Gauss-Legendre). default = 'rectangle'
+    npoints: :obj:'int': number of quadrature points. default = 100
+    """
+    cdef int i
+    cdef double res = -INFINITY
+    # the memo of omega is cleared when the shape parameters change, the
+    # value also depends on h through dl, so it is stored with the h it was computed at
+    key   = ('em_selection_normalisation', zmin, zmax, N, rule, npoints)
+    entry = omega._memo_get(key)
+    if entry is not None and entry[0] == omega.h:
+        return entry[1]
+    if rule == 'rectangle':
+        z = zmin+(zmax-zmin)/npoints*np.arange(npoints)
+        w = np.full(npoints, (zmax-zmin)/npoints)
+    elif rule == 'gauss':
+        x, w = np.polynomial.legendre.leggauss(npoints)
+        z = zmin+0.5*(zmax-zmin)*(x+1.0)
+        w = 0.5*(zmax-zmin)*w
+    else:
+        raise ValueError("unknown quadrature rule %s, the rules are %s"%(rule, ', '.join(em_selection_rules)))
+    cdef const double[::1] log_w = np.log(w)
+    cdef double[::1] dl = omega.LuminosityDistanceArray(z)
+    cdef double[::1] dV = omega.ComovingVolumeElementArray(z)
+    cdef double[::1] p  = em_selection_function_array(dl)
+    with nogil:
+        for i in range(npoints):
+            res = log_add(res,N*(log(1.0-p[i])+log(dV[i]))+log_w[i])
+    omega._memo_set(key, (omega.h, res))
+    return res
+
+class DetectionProbabilityTable(object):
+    """
+    Probability of detecting a GW source at redshift z for a set of SNR thresholds,
+    tabulated on a redshift grid: probability[i, j] at redshift z[i] and threshold snr_threshold[j].
+    Tables from injection campaigns are read with load, from_horizon builds one
+    from the horizon redshift of a threshold
+    Parameters:
+    ===============
+    z: :obj:'numpy.array': increasing redshift grid, starting at 0
+    snr_threshold: :obj:'numpy.array': increasing SNR thresholds
+    probability: :obj:'numpy.array' with shape len(z) x len(snr_threshold): detection probabilities
+    """
+    def __init__(self, z, snr_threshold, probability):
+        self.z             = np.ascontiguousarray(z, dtype=np.float64)
+        self.snr_threshold = np.atleast_1d(np.asarray(snr_threshold, dtype=np.float64))
+        self.probability   = np.asarray(probability, dtype=np.float64).reshape(len(self.z), len(self.snr_threshold))
+        if np.any(np.diff(self.z) <= 0.0) or np.any(np.diff(self.snr_threshold) <= 0.0):
+            raise ValueError("the redshifts and the SNR thresholds must be increasing")
+
+    @classmethod
+    def load(cls, path):
+        """
+        read a table from a .npz file with the arrays z, snr_threshold and probability
+        """
+        data = np.load(path)
+        return cls(data['z'], data['snr_threshold'], data['probability'])
+
+    def save(self, path):
+        np.savez(path, z = self.z, snr_threshold = self.snr_threshold, probability = self.probability)
+
+    @classmethod
+    def from_horizon(cls, double z_horizon, double snr_threshold, thresholds = None, double zmax = 0.0, int npoints = 1000, CosmologicalParameters omega = None):
+        """
+        table for sources whose SNR, for the optimal orientation, is snr_threshold at z_horizon
+        and scales as 1/dl in the reference cosmology omega. The probability of a threshold is the
+        fraction of orientations above it, from the fit of Dominik et al. (2015) to the
+        distribution of the projection factor w: P(w) = a2 (1-w)^2+a4 (1-w)^4+a8 (1-w)^8+a10 (1-w)^10
+        Parameters:
+        ===============
+        z_horizon: :obj:'numpy.double': horizon redshift of snr_threshold
+        snr_threshold: :obj:'numpy.double': SNR threshold defining the horizon
+        thresholds: :obj:'numpy.array': thresholds of the table. optional. default = snr_threshold
+        zmax: :obj:'numpy.double': largest redshift of the table. optional. default = z_horizon
+        npoints: :obj:'int': number of redshifts. optional. default = 1000
+        omega: :obj:'cosmology.CosmologicalParameters': reference cosmology. optional. default = h 0.73, om 0.25, ol 0.75
+        """
+        from cosmology import CosmologicalParameters as Cosmology
+        if snr_threshold <= 0.0 or z_horizon <= 0.0:
+            raise ValueError("the horizon needs a positive SNR threshold and redshift")
+        if omega is None: omega = Cosmology(0.73, 0.25, 0.75, -1.0, 0.0)
+        if thresholds is None: thresholds = [snr_threshold]
+        if zmax <= 0.0: zmax = z_horizon
+        z   = np.linspace(0.0, zmax, npoints)
+        # projection factor needed to reach each threshold at each redshift
+        w   = np.clip(np.outer(omega.LuminosityDistanceArray(z), thresholds)/(snr_threshold*omega.LuminosityDistance(z_horizon)), 0.0, 1.0)
+        a2, a4, a8 = 0.374222, 2.04216, -2.63948
+        probability = a2*(1.0-w)**2+a4*(1.0-w)**4+a8*(1.0-w)**8+(1.0-a2-a4-a8)*(1.0-w)**10
+        return cls(z, thresholds, probability)
+
+    def DetectionProbability(self, double snr_threshold):
+        """
+        detection probability on the redshift grid for snr_threshold,
+        linear in the threshold between the columns of the table
+        """
+        if len(self.snr_threshold) == 1:
+            return self.probability[:,0]
+        j = int(np.clip(np.searchsorted(self.snr_threshold, snr_threshold)-1, 0, len(self.snr_threshold)-2))
+        t = np.clip((snr_threshold-self.snr_threshold[j])/(self.snr_threshold[j+1]-self.snr_threshold[j]), 0.0, 1.0)
+        return (1.0-t)*self.probability[:,j]+t*self.probability[:,j+1]
+
+def gw_selection_normalisation(CosmologicalParameters omega, table, double snr_threshold, double zmax, bint gradient = False):
+    """
+    log of the fraction alpha of the sources uniform in comoving volume within [0, zmax]
+    that are detectable with snr_threshold,
+    alpha = int_0^zmax Pdet(z) dVc/dz/(1+z) dz / int_0^zmax dVc/dz/(1+z) dz,
+    with the trapezoidal rule on the redshift grid of the table, from the vectorized
+    distances of omega. alpha does not depend on h, the result is memoized on omega
+    and computed once per shape (om, ol, w0, w1)
+    Parameters:
+    ===============
+    omega: :obj:'cosmology.CosmologicalParameters': cosmological parameter structure
+    table: :obj:'DetectionProbabilityTable': detection probabilities
+    snr_threshold: :obj:'numpy.double': SNR threshold
+    zmax: :obj:'numpy.double': largest redshift of the sources
+    gradient: :obj:'bool': if True, return as well the gradient with respect to (h, om, ol, w0, w1)
+    """
+    # the key holds the table itself: an id could be reused by a later table
+    key   = ('gw_selection_normalisation', table, snr_threshold, zmax, gradient)
+    entry = omega._memo_get(key)
+    if entry is not None:
+        return entry
+    z = np.append(table.z[table.z < zmax], zmax)
+    p = np.interp(z, table.z, table.DetectionProbability(snr_threshold), right = 0.0)
+    w = np.zeros(len(z))
+    w[1:]  += 0.5*np.diff(z)
+    w[:-1] += 0.5*np.diff(z)
+    density  = w*omega.UniformComovingVolumeDensityArray(z)
+    detected = p*density
+    res = np.log(np.sum(detected))-np.log(np.sum(density))
+    if gradient:
+        # the density vanishes at z = 0, where its log gradient is undefined
+        dlog_density = np.zeros((len(z), NGRADIENT-1))
+        for i in np.flatnonzero(z > 0.0):
+            dlog_density[i] = omega.LogDistanceGradient(z[i])[1][D_H:]
+        res = (res, detected.dot(dlog_density)/np.sum(detected)-density.dot(dlog_density)/np.sum(density))
+    omega._memo_set(key, res)
+    return res
+
+def logLikelihood_population(const double[:, ::1] hosts, const Py_ssize_t[::1] offsets, const double[::1] meandl, const double[::1] sigma, cosmologies, event_redshifts, int em_selection = 0, zmin = None, zmax = None, pool = None, threads = None, out = None, double window = 0.0, widths = None, HostDensityTable density = None, constants = None):
+    """
+    Joint likelihood of a set of GW events (see logLikelihood_multiple_events)
+    for M points at once, each a cosmology and a set of event redshifts.
+    The points are sorted by the shape parameters (om, ol, w0, w1), so that
+    points with the same shape share their distance tables and prior
+    normalisations, and split in contiguous chunks scored in parallel threads.
+    Parameters:
+    ===============
+    hosts, offsets, meandl, sigma, em_selection, zmin, zmax, window, widths, density, constants: see logLikelihood_multiple_events
+    cosmologies: :obj:'numpy.array' of :obj:'cosmology.cosmology_dtype' records, shape M
+    event_redshifts: :obj:'numpy.array' with shape MxN, redshifts of the N events for each point
+    pool: :obj:'cosmology.CosmologyPool': source of the per-thread cosmologies, sets tabulation
+          and backend. optional. default = LAL backend, no tabulation
+    threads: :obj:'int': number of threads. optional. default = 1/core
+    out: :obj:'numpy.array': if given, filled with the M log likelihoods. optional
+    Returns the array of the M log likelihoods
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from cosmology import CosmologyPool
+    cosmologies = np.atleast_1d(cosmologies)
+    zs  = np.ascontiguousarray(np.atleast_2d(event_redshifts), dtype=np.float64)
+    M   = cosmologies.shape[0]
+    if zs.shape != (M, meandl.shape[0]):
+        raise ValueError("event_redshifts must have shape (number of points, number of events)")
+    out = _output_array(out, M)
+    if pool is None: pool = CosmologyPool()
+    if threads is None: threads = os.cpu_count() or 1
+    order  = np.lexsort((cosmologies['w1'], cosmologies['w0'], cosmologies['ol'], cosmologies['om']))
+    if window > 0.0 and widths is None: widths = host_redshift_widths(np.asarray(hosts), np.asarray(offsets))
+    if constants is None: constants = host_constants(hosts)
+    
+    def score(chunk):
+        for i in chunk:
+            c = cosmologies[i]
+            omega  = pool.get(c['h'], c['om'], c['ol'], c['w0'], c['w1'])
+            out[i] = logLikelihood_multiple_events(hosts, offsets, meandl, sigma, omega, zs[i], em_selection, zmin, zmax, None, window, widths, density, constants)
+    
+    chunks = [c for c in np.array_split(order, min(threads, M)) if len(c) > 0]
+    if len(chunks) == 1:
+        score(chunks[0])
+    else:
+        with ThreadPoolExecutor(len(chunks)) as executor:
+            list(executor.map(score, chunks))
+    return out
+
+cdef double find_redshift(CosmologicalParameters omega, double dl):
+    return omega.RedshiftFromLuminosityDistance(dl)
@@ -0,0 +1,143 @@
+"""
+binary chain and posterior files. A structured array of samples is stored
+column by column in path.npy, with shape (number of columns, number of samples),
+and the column names in the sidecar path.json. load_samples memory-maps
+the file, so only the requested columns are read from disk and no text is parsed
+"""
+import os
+import json
+import tempfile
+import numpy as np
+
+def _replace(path, data):
+    """
+    write data to a temporary file next to path and rename it into place,
+    so that a reader never sees a partial file
+    """
+    fd, tmp = tempfile.mkstemp(dir = os.path.dirname(path) or '.', suffix = '.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if isinstance(data, np.ndarray): np.save(f, data)
+            else: f.write(data)
+        os.replace(tmp, path)
+    except:
+        if os.path.exists(tmp): os.remove(tmp)
+        raise
+
+def save_samples(path, samples, **metadata):
+    """
+    write a structured array of samples to path.npy and its header to path.json
+    Parameters:
+    ===============
+    path: :obj:'str': output path, without extension
+    samples: :obj:'numpy.array': structured array of samples, all the columns numeric
+    metadata: stored in the header along with the column names and the number of samples
+    """
+    samples = np.asarray(samples).ravel()
+    names   = list(samples.dtype.names)
+    columns = np.empty((len(names), samples.shape[0]), dtype=np.float64)
+    for i, n in enumerate(names):
+        columns[i] = samples[n]
+    # the data first, a header always describes a complete file
+    _replace(path+'.npy', columns)
+    _replace(path+'.json', json.dumps(dict(metadata, names = names, samples = samples.shape[0])).encode())
+
+def read_header(path):
+    """
+    header of the samples in path.npy, None if they do not exist
+    """
+    try:
+        with open(path+'.json', 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+def load_samples(path, columns = None):
+    """
+    read the samples written by save_samples
+    Parameters:
+    ===============
+    path: :obj:'str': path of the samples, without extension
+    columns: :obj:'list': names of the columns to read. default = None, all of them
+    Returns a structured array with the requested columns
+    """
+    header = read_header(path)
+    if header is None:
+        raise IOError("no samples in %s.npy"%path)
+    data  = np.load(path+'.npy', mmap_mode = 'r')
+    names = header['names']
+    if data.shape != (len(names), header['samples']):
+        raise ValueError("%s.npy does not match its header"%path)
+    if columns is None:
+        columns = names
+    for c in columns:
+        if c not in names:
+            raise ValueError("no column %s in %s.npy, the columns are %s"%(c, path, ', '.join(names)))
+    samples = np.empty(data.shape[1], dtype=[(c, np.float64) for c in columns])
+    for c in columns:
+        samples[c] = data[names.index(c)]
+    return samples
+
+def _cached(path, samples, columns, **metadata):
+    """
+    store samples in path and return the requested columns. A full or read-only
+    folder only costs the recomputation at the next call
+    """
+    try:
+        save_samples(path, samples, **metadata)
+    except OSError:
+        from numpy.lib.recfunctions import repack_fields
+        return samples if columns is None else repack_fields(samples[list(columns)])
+    return load_samples(path, columns)
+
+def _up_to_date(path, source):
+    """
+    True if the samples in path exist and are not older than the file source
+    """
+    return (read_header(path) is not None and os.path.exists(path+'.npy')
+            and os.path.getmtime(path+'.npy') >= os.path.getmtime(source))
+
+def load_text_samples(filename, columns = None):
+    """
+    samples of a text file with a header line of column names (as read by np.genfromtxt(names=True)),
+    through a binary copy next to it, in filename.npy and filename.json (posterior.dat.npy
+    for posterior.dat, distinct from the posterior.npy written by load_posterior).
+    The copy is written on the first call and rewritten whenever the text file is newer
+    """
+    path = filename
+    if not _up_to_date(path, filename):
+        return _cached(path, np.genfromtxt(filename, names = True), columns, source = os.path.basename(filename))
+    return load_samples(path, columns)
+
+def chain_path(folder, nlive, seed = 1234):
+    """
+    path, without extension, of the nested sampling chain written by cpnest in folder
+    """
+    return os.path.join(folder, "chain_%d_%d"%(nlive, seed))
+
+def load_posterior(folder, nlive, columns = None, seed = 1234):
+    """
+    posterior samples of the run in folder. They are drawn from the nested
+    sampling chain with nest2pos the first time and stored in folder/posterior.npy,
+    later calls memory-map them for as long as they are newer than the chain.
+    The chain is read from its binary copy, or from cpnest's text file if there is none
+    Parameters:
+    ===============
+    folder: :obj:'str': output folder of the run
+    nlive: :obj:'int': number of live points of the run
+    columns: :obj:'list': names of the columns to read. default = None, all of them
+    seed: :obj:'int': seed of the run, part of the chain file name. default = 1234
+    """
+    chain     = chain_path(folder, nlive, seed)
+    posterior = os.path.join(folder, "posterior")
+    # the binary chain written by run_sampler, the text one of cpnest only without it
+    binary    = read_header(chain) is not None and os.path.exists(chain+'.npy')
+    source    = chain+'.npy' if binary else chain+'.txt'
+    header    = read_header(posterior)
+    # without the chain a stored posterior of the same run is still usable
+    if (header is None or header.get('nlive') != nlive
+        or (os.path.exists(source) and not _up_to_date(posterior, source))):
+        from cpnest import nest2pos
+        samples = load_samples(chain) if binary else load_text_samples(chain+'.txt')
+        return _cached(posterior, nest2pos.draw_posterior_many([samples], [nlive], verbose = False), columns, nlive = nlive)
+    return load_samples(posterior, columns)
@@ -0,0 +1,108 @@
+"""
+posterior predictive curves and credible bands over a redshift grid:
+luminosity distance, EM selection function and Hubble parameter for every
+posterior sample, evaluated in batch by the array interfaces of
+cosmology.CosmologicalParameters and split in chunks scored in parallel threads
+"""
+import os
+import numpy as np
+import cosmology as cs
+import likelihood as lk
+
+# values of the parameters a model does not sample (same as cosmological_model.truths)
+fixed = {'h':0.73,'om':0.25,'ol':0.75,'w0':-1.0,'w1':0.0}
+
+# parameters sampled by each cosmological model
+model_parameters = {'LambdaCDM':   ('h','om'),
+                    'CLambdaCDM':  ('h','om','ol'),
+                    'LambdaCDMDE': ('h','om','ol','w0','w1'),
+                    'DE':          ('w0','w1')}
+
+# quantities available on the redshift grid
+quantities = ('luminosity_distance', 'em_selection', 'hubble_parameter')
+
+def posterior_cosmologies(x, model):
+    """
+    cosmology records (see cosmology.cosmology_dtype) of the posterior samples
+    Parameters:
+    ===============
+    x: :obj:'numpy.array': structured array of posterior samples
+    model: :obj:'str': cosmological model, one of model_parameters (case insensitive)
+    """
+    names = {m.lower(): m for m in model_parameters}
+    if model.lower() not in names:
+        raise ValueError("unknown model %s, supported: %s"%(model, ', '.join(model_parameters)))
+    model   = names[model.lower()]
+    x       = np.atleast_1d(x)
+    records = np.zeros(x.shape[0], dtype=cs.cosmology_dtype)
+    for name in cs.cosmology_dtype.names:
+        records[name] = x[name] if name in model_parameters[model] else fixed[name]
+    if model == "LambdaCDM":
+        records['ol'] = 1.0-records['om']
+    return records
+
+def predictive_curves(cosmologies, z, which = quantities, pool = None, threads = None):
+    """
+    the requested quantities on the redshift grid z for every cosmology
+    Parameters:
+    ===============
+    cosmologies: :obj:'numpy.array' of :obj:'cosmology.cosmology_dtype' records, shape M
+    z: :obj:'numpy.array': redshift grid, shape Z
+    which: :obj:'tuple': subset of quantities. luminosity_distance in Mpc,
+           em_selection (see likelihood.em_selection_function), hubble_parameter H(z) in km/s/Mpc.
+           default = all of them
+    pool: :obj:'cosmology.CosmologyPool': source of the per-thread cosmologies,
+          sets the backend. optional. default = native backend, medium accuracy
+    threads: :obj:'int': number of threads. optional. default = 1/core
+    Returns a dictionary of arrays with shape MxZ, one per quantity
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    for q in which:
+        if q not in quantities:
+            raise ValueError("unknown quantity %s, supported: %s"%(q, ', '.join(quantities)))
+    cosmologies = np.atleast_1d(cosmologies)
+    z = np.ascontiguousarray(z, dtype=np.float64).reshape(-1)
+    M = cosmologies.shape[0]
+    if pool is None: pool = cs.CosmologyPool(backend = 'native', accuracy = 'medium')
+    if threads is None: threads = os.cpu_count() or 1
+    curves = {q: np.empty((M, z.shape[0]), dtype=np.float64) for q in which}
+    # the selection function needs the distances even if they are not requested
+    dl = curves['luminosity_distance'] if 'luminosity_distance' in which else None
+
+    def evaluate(chunk):
+        buffer = np.empty(z.shape[0], dtype=np.float64)
+        for i in chunk:
+            c = cosmologies[i]
+            omega = pool.get(c['h'], c['om'], c['ol'], c['w0'], c['w1'])
+            if dl is not None or 'em_selection' in which:
+                distances = omega.LuminosityDistanceArray(z, out = dl[i] if dl is not None else buffer)
+                if 'em_selection' in which:
+                    lk.em_selection_function_array(distances, out = curves['em_selection'][i])
+            if 'hubble_parameter' in which:
+                # HubbleParameterArray is 1/E(z)
+                H = omega.HubbleParameterArray(z, out = curves['hubble_parameter'][i])
+                np.divide(100.0*c['h'], H, out = H)
+
+    chunks = [c for c in np.array_split(np.arange(M), min(threads, M)) if len(c) > 0]
+    if len(chunks) == 1:
+        evaluate(chunks[0])
+    elif len(chunks) > 1:
+        with ThreadPoolExecutor(len(chunks)) as executor:
+            list(executor.map(evaluate, chunks))
+    return curves
+
+def predictive_bands(x, model, z, percentiles = (2.5, 16.0, 50.0, 84.0, 97.5), which = quantities, thin = 1, pool = None, threads = None):
+    """
+    percentiles over the posterior samples of the quantities on the redshift grid z
+    Parameters:
+    ===============
+    x: :obj:'numpy.array': structured array of posterior samples
+    model: :obj:'str': cosmological model, one of model_parameters
+    z: :obj:'numpy.array': redshift grid, shape Z
+    percentiles: :obj:'tuple': percentiles to compute, shape P. default = 2.5, 16, 50, 84, 97.5
+    which, pool, threads: see predictive_curves
+    thin: :obj:'int': use every thin-th sample. default = 1
+    Returns a dictionary of arrays with shape PxZ, one per quantity
+    """
+    curves = predictive_curves(posterior_cosmologies(x, model)[::thin], z, which = which, pool = pool, threads = threads)
+    return {q: np.percentile(curves[q], percentiles, axis = 0) for q in which}
@@ -239,6 +239,17 @@ def read_DEBUG_event(datafile, *args, **kwargs):
     sys.stderr.write("Selected %d events\n"%len(events))
     return events
 
+def fiducial_redshifts(events, omega):
+    """
+    redshifts corresponding to the measured luminosity distances
+    of the events in the cosmology omega, computed in one call
+    Parameters:
+    ===============
+    events: :obj:'list' of :obj:'Event'
+    omega: :obj:'cosmology.CosmologicalParameters'
+    """
+    return omega.RedshiftFromLuminosityDistanceArray(np.array([e.dl for e in events], dtype=np.float64))
+
 def read_event(event_class,*args,**kwargs):
     if event_class == "MBH": return read_MBH_event(*args, **kwargs)
     elif event_class == "EMRI": return read_EMRI_event(*args, **kwargs)
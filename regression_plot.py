@@ -10,6 +10,7 @@ import readdata
 import multiprocessing as mp
 from scipy.misc import logsumexp
 from cosmology import *
+from posterior_predictive import predictive_bands
 import matplotlib.patches as mpatches
 import matplotlib.lines as mlines
 import matplotlib
@@ -76,39 +77,15 @@ if __name__=="__main__":
     omega_true = CosmologicalParameters(0.73,0.25,0.75,-1,0)
     redshift = np.logspace(-3,1.0,100)
     
-    # loop over the posterior samples to get all models to then average
-    # for the plot
-    
-    models = []
-    
-    for k in range(posteriors.shape[0]):
-        if opts.model == "LAMBDACDM":
-            omega = CosmologicalParameters(posteriors['h'][k],
-                                           posteriors['om'][k],
-                                           1.0-posteriors['om'][k],
-                                           -1,
-                                           0.0)
-
-        elif opts.model == "LAMBDACDMDE":
-            omega = CosmologicalParameters(posteriors['h'][k],
-                                           posteriors['om'][k],
-                                           posteriors['ol'][k],
-                                           posteriors['w0'][k],
-                                           posteriors['w1'][k])
-        else:
-            print(opts.model,"is unknown")
-            exit()
-        models.append([omega.LuminosityDistance(zi)/1e3 for zi in redshift])
-        omega.DestroyCosmologicalParameters()
-    
-    models = np.array(models)
-    model2p5,model16,model50,model84,model97p5 = np.percentile(models,[2.7,16.0,50.0,84.0,97.5],axis = 0)
+    # percentiles of the distance over the posterior samples
+    bands = predictive_bands(posteriors, opts.model, redshift, which = ('luminosity_distance',))
+    model2p5,model16,model50,model84,model97p5 = bands['luminosity_distance']/1e3
     
     
     fig = plt.figure()
     ax = fig.add_subplot(111)
     ax.errorbar(z,dl,xerr=deltaz,yerr=deltadl,markersize=2,linewidth=2,color='k',fmt='o')
-    ax.plot(redshift,[omega_true.LuminosityDistance(zi)/1e3 for zi in redshift],linestyle='dashed',color='r')
+    ax.plot(redshift,omega_true.LuminosityDistanceArray(redshift)/1e3,linestyle='dashed',color='r')
     ax.plot(redshift,model50,color='k')
     ax.errorbar(ztrue, dl, yerr=deltadl, markersize=8,linewidth=2,color='r',fmt='o')
     ax.fill_between(redshift,model2p5,model97p5,facecolor='turquoise')
@@ -9,32 +9,43 @@ try:
 except AttributeError:
     user = ''
 
+# LAL installation prefix: $LAL_PREFIX if set, otherwise the usual local install
+lal_prefix = os.environ.get('LAL_PREFIX', "/Users/{0}/opt/master".format(user))
+lal_lib    = os.path.join(lal_prefix, "lib")
+lal_inc    = os.path.join(lal_prefix, "include")
+
+# OpenMP for the parallel loop over the events in likelihood.pyx: $OPENMP_FLAGS if set
+# (e.g. "-Xpreprocessor -fopenmp -lomp" with Apple clang), empty to build it serial
+openmp_flags = os.environ.get('OPENMP_FLAGS', '-fopenmp').split()
+
 ext_modules=[
              Extension("cosmology",
                        sources=["cosmology.pyx"],
                        libraries=["m","lal"], # Unix-like specific
-                       library_dirs = ["/Users/{0}/opt/master/lib".format(user)],
-                       include_dirs=[numpy.get_include(),"/Users/{0}/opt/master/include".format(user)]
+                       library_dirs = [lal_lib],
+                       include_dirs=[numpy.get_include(),lal_inc]
                        )
              ]
 
 setup(
       name = "cosmology",
       ext_modules = cythonize(ext_modules),
-      include_dirs=[numpy.get_include(),"/Users/{0}/opt/master/include".format(user)]
+      include_dirs=[numpy.get_include(),lal_inc]
       )
 ext_modules=[
              Extension("likelihood",
                        sources=["likelihood.pyx"],
                        libraries=["m","lal"], # Unix-like specific
-                       library_dirs = ["/Users/{0}/opt/master/lib".format(user)],
-                       include_dirs=[numpy.get_include(),"/Users/{0}/opt/master/include".format(user)]
+                       library_dirs = [lal_lib],
+                       include_dirs=[numpy.get_include(),lal_inc],
+                       extra_compile_args=openmp_flags,
+                       extra_link_args=openmp_flags
                        )
              ]
 
 setup(
       name = "likelihood",
       ext_modules = cythonize(ext_modules),
-      include_dirs=[numpy.get_include(),"/Users/{0}/opt/master/include".format(user)]
+      include_dirs=[numpy.get_include(),lal_inc]
       )
 
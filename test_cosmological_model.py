@@ -0,0 +1,70 @@
+import unittest
+import array
+import pickle
+import numpy as np
+import cpnest.parameter
+import readdata
+import cosmological_model as cm
+
+def events(nevents = 2, nhosts = 20, seed = 0):
+    """
+    random events at ~800 Mpc with their hosts in [0.1, 0.2]
+    """
+    rng = np.random.RandomState(seed)
+    return [readdata.Event(i, 800.0+10.0*i, 80.0, rng.uniform(0.1, 0.2, nhosts), np.full(nhosts, 1e-3), rng.uniform(0.0, 1.0, nhosts),
+                           0.01, 0.5, 20.0, 0.15) for i in range(nevents)]
+
+def build(*args):
+    opts, _ = cm.build_parser().parse_args(list(args))
+    return cm.build_model(opts, events(), 0)
+
+def point(C, values):
+    return cpnest.parameter.LivePoint(C.names, d = array.array('d', values[:len(C.names)]))
+
+class TestPickle(unittest.TestCase):
+
+    def test_round_trip(self):
+        # samplers started with spawn or forkserver receive a pickled model
+        for args in ((), ('--marginalise_redshifts', '1'),
+                     ('--host_density', '100', '--tabulate', '100', '--gw_selection', '1', '--snr_threshold', '8', '--zhorizon', '0.3')):
+            C = build(*args)
+            D = pickle.loads(pickle.dumps(C))
+            x = point(C, [0.7, 0.3, 0.15, 0.16])
+            self.assertEqual(C.log_likelihood(x), D.log_likelihood(x))
+
+class TestOptions(unittest.TestCase):
+
+    def test_gw_selection_needs_a_threshold(self):
+        with self.assertRaises(SystemExit):
+            cm.parse_options(cm.build_parser(), ['--gw_selection', '1'])
+        opts, _ = cm.parse_options(cm.build_parser(), ['--gw_selection', '1', '--snr_threshold', '8'])
+        self.assertEqual(opts.snr_threshold, 8.0)
+        opts, _ = cm.parse_options(cm.build_parser(), ['--gw_selection', '1', '--detection_table', 'table.npz'])
+        self.assertEqual(opts.detection_table, 'table.npz')
+
+class TestHamiltonian(unittest.TestCase):
+
+    def setUp(self):
+        self.C = build()
+        self.x = point(self.C, [0.7, 0.3, 0.15, 0.16])
+
+    def test_force_is_the_log_prior_gradient(self):
+        # force = -grad(potential) = -grad(-log prior), checked with a prior gradient that is not zero
+        self.C.log_prior_gradient = lambda x: np.arange(1.0, len(self.C.names)+1.0)
+        np.testing.assert_array_equal(self.C.force(self.x), np.arange(1.0, len(self.C.names)+1.0))
+
+    def test_reflection_normal(self):
+        from hamiltonian_proposals import GradientConstrainedLeapFrog
+        normal = GradientConstrainedLeapFrog(model = self.C, id = 0).unit_normal(self.x)
+        step, numerical = 1e-6, []
+        for n in self.C.names:
+            f = []
+            for sign in (1.0, -1.0):
+                y = self.x.copy()
+                y[n] += sign*step
+                f.append(self.C.log_likelihood(y))
+            numerical.append((f[0]-f[1])/(2.0*step))
+        np.testing.assert_allclose(normal, np.array(numerical)/np.linalg.norm(numerical), atol = 1e-6)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import unittest
+import pickle
+import tempfile
+import numpy as np
+import cosmology as cs
+
+class FailingCache(object):
+    """
+    DistanceCache stand-in that serves the first table and fails afterwards
+    """
+    def __init__(self):
+        self.cache = cs.DistanceCache()
+        self.calls = 0
+
+    def get(self, *args):
+        self.calls += 1
+        if self.calls > 1:
+            raise RuntimeError("cache unavailable")
+        return self.cache.get(*args)
+
+class TestDistanceCache(unittest.TestCase):
+
+    def test_pickle(self):
+        cache = cs.DistanceCache(64, 0.0, tempfile.mkdtemp())
+        omega = cs.CosmologicalParameters(0.73, 0.25, 0.75, -1.0, 0.0)
+        omega.Tabulate(2.0, 100, cache)
+        copy  = pickle.loads(pickle.dumps(cache))
+        self.assertEqual((copy.maxsize, copy.tolerance, copy.store, len(copy)), (64, 0.0, cache.store, 0))
+        # the copy reads the tables of the original from the store
+        other = cs.CosmologicalParameters(0.73, 0.25, 0.75, -1.0, 0.0)
+        other.Tabulate(2.0, 100, copy)
+        self.assertEqual((copy.store_hits, other.LuminosityDistance(1.0)), (1, omega.LuminosityDistance(1.0)))
+
+class TestTabulation(unittest.TestCase):
+
+    def test_invalid_arguments_raise(self):
+        omega = cs.CosmologicalParameters(0.73, 0.25, 0.75, -1.0, 0.0)
+        with self.assertRaises(ValueError):
+            omega.Tabulate(1.0, 1)
+        with self.assertRaises(ValueError):
+            omega.Tabulate(-1.0, 100)
+        self.assertFalse(omega.tabulated)
+
+    def test_failed_retabulation_drops_the_table(self):
+        omega = cs.CosmologicalParameters(0.73, 0.25, 0.75, -1.0, 0.0)
+        omega.Tabulate(2.0, 200, FailingCache())
+        with self.assertRaises(RuntimeError):
+            omega.Update(0.73, 0.35, 0.65, -1.0, 0.0)
+        self.assertFalse(omega.tabulated)
+        fresh = cs.CosmologicalParameters(0.73, 0.35, 0.65, -1.0, 0.0)
+        self.assertEqual(omega.LuminosityDistance(0.5), fresh.LuminosityDistance(0.5))
+
+    def test_memoized_integrals_follow_the_table(self):
+        omega = cs.CosmologicalParameters(0.73, 0.25, 0.75, -1.0, 0.0)
+        exact = omega.IntegrateComovingVolumeArray(np.array([1.0]))[0]
+        omega.Tabulate(2.0, 20)
+        fresh = cs.CosmologicalParameters(0.73, 0.25, 0.75, -1.0, 0.0)
+        fresh.Tabulate(2.0, 20)
+        self.assertEqual(omega.IntegrateComovingVolumeArray(np.array([1.0]))[0], fresh.IntegrateComovingVolumeArray(np.array([1.0]))[0])
+        omega.ClearTabulation()
+        self.assertEqual(omega.IntegrateComovingVolumeArray(np.array([1.0]))[0], exact)
+
+def curvature_switch(omega, threshold = 1e-3):
+    """
+    redshift at which |ok|*chi**2 reaches threshold, where the distance gradient
+    switches from the series in ok to the closed form
+    """
+    chi    = np.sqrt(threshold/abs(1.0-omega.om-omega.ol))
+    lo, hi = 0.0, 10.0
+    for _ in range(100):
+        mid = 0.5*(lo+hi)
+        if omega.ComovingDistance(mid)/omega.HubbleDistance() < chi: lo = mid
+        else: hi = mid
+    return 0.5*(lo+hi)
+
+class TestDistanceGradient(unittest.TestCase):
+
+    def gradient(self, omega, z):
+        return np.concatenate(omega.LogDistanceGradient(z))
+
+    def test_continuous_at_the_curvature_switch(self):
+        # the jump of a wrong series coefficient is ~3e-11, the rest is O(step**2)
+        step = 1e-5
+        for om, ol in ((0.25, 0.74), (0.25, 0.76)):
+            omega = cs.CosmologicalParameters(0.73, om, ol, -1.0, 0.0)
+            z     = curvature_switch(omega)
+            below = 2.0*self.gradient(omega, z-step)-self.gradient(omega, z-2.0*step)
+            above = 2.0*self.gradient(omega, z+step)-self.gradient(omega, z+2.0*step)
+            self.assertLess(np.max(np.abs(below-above)/(1.0+np.abs(below))), 5e-12)
+
+    def test_finite_differences_around_the_curvature_switch(self):
+        step = 1e-6
+        for om, ol in ((0.25, 0.74), (0.25, 0.76)):
+            z0 = curvature_switch(cs.CosmologicalParameters(0.73, om, ol, -1.0, 0.0))
+            for z in (0.9*z0, z0, 1.1*z0):
+                gradient = cs.CosmologicalParameters(0.73, om, ol, -1.0, 0.0).LogDistanceGradient(z)[0]
+                for i, (dom, dol) in ((2, (step, 0.0)), (3, (0.0, step))):
+                    f = [np.log(cs.CosmologicalParameters(0.73, om+sign*dom, ol+sign*dol, -1.0, 0.0).LuminosityDistance(z)) for sign in (1.0, -1.0)]
+                    self.assertAlmostEqual(gradient[i], (f[0]-f[1])/(2.0*step), places = 8)
+
+class TestMemo(unittest.TestCase):
+
+    def test_evicted_integrals_are_recomputed(self):
+        # many more upper limits than the memo keeps, at varying h
+        omega = cs.CosmologicalParameters(0.73, 0.25, 0.75, -1.0, 0.0)
+        first = omega.IntegrateComovingVolumeDensityArray(np.array([0.5, 1.0]))
+        for i in range(200):
+            omega.SetH(0.6+1e-3*i)
+            omega.IntegrateComovingVolumeDensityArray(np.array([0.5, 1.0+1e-3*i]))
+        omega.SetH(0.73)
+        np.testing.assert_array_equal(omega.IntegrateComovingVolumeDensityArray(np.array([0.5, 1.0])), first)
+
+class TestRecords(unittest.TestCase):
+
+    def test_round_trip(self):
+        omega = cs.CosmologicalParameters(0.73, 0.25, 0.75, -1.0, 0.0)
+        other = cs.CosmologicalParameters(0.6, 0.3, 0.6, -0.9, 0.1)
+        omega.UpdateFromRecord(other.ToRecord())
+        self.assertEqual(omega.ToRecord(), other.ToRecord())
+
+    def test_missing_key_raises(self):
+        omega  = cs.CosmologicalParameters(0.73, 0.25, 0.75, -1.0, 0.0)
+        record = {'h':0.6, 'ol':0.6, 'w0':-0.9, 'w1':0.1}
+        with self.assertRaises(KeyError):
+            omega.UpdateFromRecord(record)
+        self.assertEqual((omega.h, omega.om, omega.ol, omega.w0, omega.w1), (0.73, 0.25, 0.75, -1.0, 0.0))
+
+if __name__ == '__main__':
+    unittest.main()
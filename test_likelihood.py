@@ -0,0 +1,148 @@
+import unittest
+import numpy as np
+import cosmology as cs
+import likelihood as lk
+
+def catalog(nevents = 4, nhosts = 50, seed = 0):
+    """
+    random host catalog of nevents events in [0.05, 0.3], flattened as the model does
+    """
+    rng   = np.random.RandomState(seed)
+    hosts = [np.column_stack((rng.uniform(0.05, 0.3, nhosts), np.full(nhosts, 1e-3), rng.uniform(0.0, 1.0, nhosts))) for _ in range(nevents)]
+    return lk.flatten_hosts(hosts)
+
+class TestHostWindow(unittest.TestCase):
+
+    def setUp(self):
+        self.hosts, self.offsets = catalog()
+        self.M      = len(self.offsets)-1
+        self.meandl = np.full(self.M, 800.0)
+        self.sigma  = np.full(self.M, 80.0)
+        self.zmin   = np.full(self.M, 0.01)
+        self.zmax   = np.full(self.M, 1.0)
+        self.omega  = cs.CosmologicalParameters(0.73, 0.25, 0.75, -1.0, 0.0)
+
+    def logL(self, z, window):
+        return lk.logLikelihood_multiple_events(self.hosts, self.offsets, self.meandl, self.sigma, self.omega, z,
+                                                zmin = self.zmin, zmax = self.zmax, window = window)
+
+    def test_far_from_every_host(self):
+        # prior draw far from all the hosts: the window is empty and all the hosts are summed
+        z = np.full(self.M, 0.9)
+        self.assertTrue(np.isfinite(self.logL(z, 10.0)))
+        self.assertEqual(self.logL(z, 10.0), self.logL(z, 0.0))
+        g = lk.logLikelihood_multiple_events_gradient(self.hosts, self.offsets, self.meandl, self.sigma, self.omega, z,
+                                                      zmin = self.zmin, zmax = self.zmax, window = 10.0)
+        self.assertTrue(np.isfinite(g[0]) and np.all(np.isfinite(g[1])) and np.all(np.isfinite(g[2])))
+
+    def test_prior_draws(self):
+        rng = np.random.RandomState(1)
+        for _ in range(100):
+            self.assertTrue(np.isfinite(self.logL(rng.uniform(0.01, 1.0, self.M), 10.0)))
+
+    def test_window_error(self):
+        z = np.full(self.M, 0.2)
+        self.assertAlmostEqual(self.logL(z, 10.0), self.logL(z, 0.0), places = 8)
+
+class TestHostDensityTable(unittest.TestCase):
+
+    def test_finite_far_from_hosts(self):
+        hosts, offsets = catalog()
+        M     = len(offsets)-1
+        zmin  = np.full(M, 0.01)
+        zmax  = np.full(M, 1.0)
+        table = lk.HostDensityTable(hosts, offsets, zmin, zmax, npoints = 200)
+        omega = cs.CosmologicalParameters(0.73, 0.25, 0.75, -1.0, 0.0)
+        rng   = np.random.RandomState(2)
+        for _ in range(100):
+            z = rng.uniform(0.01, 1.0, M)
+            tabulated = lk.logLikelihood_multiple_events(hosts, offsets, np.full(M, 800.0), np.full(M, 80.0), omega, z, zmin = zmin, zmax = zmax, density = table)
+            exact     = lk.logLikelihood_multiple_events(hosts, offsets, np.full(M, 800.0), np.full(M, 80.0), omega, z, zmin = zmin, zmax = zmax)
+            self.assertTrue(np.isfinite(tabulated))
+            self.assertAlmostEqual(tabulated/exact, 1.0, places = 6)
+
+    def test_invalid_grid(self):
+        hosts, offsets = catalog()
+        M    = len(offsets)-1
+        zmin = np.full(M, 0.01)
+        zmax = np.full(M, 1.0)
+        for npoints, max_npoints in [(1, 65537), (0, 65537), (-5, 65537), (200, 100)]:
+            with self.assertRaises(ValueError):
+                lk.HostDensityTable(hosts, offsets, zmin, zmax, npoints = npoints, max_npoints = max_npoints)
+        table = lk.HostDensityTable(hosts, offsets, zmin, zmax, npoints = 2, max_npoints = 2)
+        self.assertEqual(table.npoints, 2)
+
+def brute_force_marginalised(hosts, meandl, sigma, omega, zmin, zmax, em_selection):
+    """
+    logLikelihood_marginalised of a single event by the trapezoidal rule on a very fine grid
+    """
+    z  = np.linspace(zmin, zmax, 400001)
+    dl = omega.LuminosityDistanceArray(z)
+    S2 = sigma**2+lk.sigma_weak_lensing_array(z, dl)**2
+    f  = (-0.5*(dl-meandl)**2/S2-0.5*np.log(2.0*np.pi*S2)+np.log(omega.UniformComovingVolumeDensityArray(z))
+          -np.log(omega.IntegrateComovingVolumeDensity(zmax)))
+    c  = lk.host_constants(hosts)
+    log_hosts = np.logaddexp.reduce(c[2][:,None]-0.5*((z[None,:]-c[0][:,None])*c[1][:,None])**2, axis=0)
+    if em_selection == 1:
+        log_p = np.log(lk.em_selection_function_array(dl))
+        f = np.logaddexp(f+log_p+log_hosts, f+np.log1p(-np.exp(log_p)))
+    else:
+        f = f+log_hosts
+    return np.max(f)+np.log(np.trapezoid(np.exp(f-np.max(f)), z))
+
+class TestSelectionNormalisation(unittest.TestCase):
+
+    def test_memo_follows_the_table(self):
+        # every table is freed after use, so a later one can get the same id
+        omega = cs.CosmologicalParameters(0.73, 0.25, 0.75, -1.0, 0.0)
+        for z in (0.1, 0.2, 0.4):
+            memoized = lk.gw_selection_normalisation(omega, lk.DetectionProbabilityTable.from_horizon(z, 8.0, zmax = 1.0), 8.0, 1.0)
+            fresh    = lk.gw_selection_normalisation(cs.CosmologicalParameters(0.73, 0.25, 0.75, -1.0, 0.0),
+                                                     lk.DetectionProbabilityTable.from_horizon(z, 8.0, zmax = 1.0), 8.0, 1.0)
+            self.assertEqual(memoized, fresh)
+
+class TestMarginalised(unittest.TestCase):
+
+    def setUp(self):
+        self.omega = cs.CosmologicalParameters(0.73, 0.25, 0.75, -1.0, 0.0)
+        rng = np.random.RandomState(3)
+        # hosts both much narrower and wider than the redshift width of the event
+        self.hosts, self.offsets = lk.flatten_hosts([np.column_stack((0.1+rng.normal(0.0, 0.01, 30), rng.choice([1e-5, 1e-3, 3e-3], 30), rng.uniform(0.1, 1.0, 30)))])
+        self.meandl = np.array([self.omega.LuminosityDistance(0.1)])
+        self.zmin   = np.array([0.01])
+        self.zmax   = np.array([0.5])
+
+    def test_narrow_event(self):
+        # sigma_dl/dl = 0.5%, the event redshift is known to ~5e-4
+        for relative in (0.05, 0.005):
+            for em_selection in (0, 1):
+                sigma = relative*self.meandl
+                logL  = lk.logLikelihood_marginalised(self.hosts, self.offsets, self.meandl, sigma, self.omega, em_selection = em_selection, zmin = self.zmin, zmax = self.zmax)
+                exact = brute_force_marginalised(self.hosts, self.meandl[0], sigma[0], self.omega, self.zmin[0], self.zmax[0], em_selection)
+                self.assertAlmostEqual(logL, exact, places = 6)
+
+    def test_gradient(self):
+        p, step = np.array([0.73, 0.25, 0.75, -1.0, 0.0]), 1e-6
+        sigma   = 0.005*self.meandl
+        logL, gradient = lk.logLikelihood_marginalised_gradient(self.hosts, self.offsets, self.meandl, sigma, cs.CosmologicalParameters(*p),
+                                                                em_selection = 1, zmin = self.zmin, zmax = self.zmax)
+        for i in range(5):
+            f = []
+            for sign in (1.0, -1.0):
+                q = p.copy()
+                q[i] += sign*step
+                f.append(lk.logLikelihood_marginalised(self.hosts, self.offsets, self.meandl, sigma, cs.CosmologicalParameters(*q),
+                                                       em_selection = 1, zmin = self.zmin, zmax = self.zmax))
+            self.assertAlmostEqual(gradient[i]/(1.0+abs(gradient[i])), (f[0]-f[1])/(2.0*step)/(1.0+abs(gradient[i])), places = 5)
+
+    def test_far_from_every_host(self):
+        # no host within the window of the event (z ~ 0.3), or no window at all (beyond zmax)
+        for z in (0.3, 2.0):
+            meandl = np.array([self.omega.LuminosityDistance(z)])
+            logL   = lk.logLikelihood_marginalised(self.hosts, self.offsets, meandl, 0.005*meandl, self.omega, zmin = self.zmin, zmax = self.zmax)
+            self.assertTrue(np.isfinite(logL))
+            logL, gradient = lk.logLikelihood_marginalised_gradient(self.hosts, self.offsets, meandl, 0.005*meandl, self.omega, zmin = self.zmin, zmax = self.zmax)
+            self.assertTrue(np.isfinite(logL) and np.all(np.isfinite(gradient)))
+
+if __name__ == '__main__':
+    unittest.main()